@@ -1,60 +1,74 @@
 # file: app.py
 import gradio as gr
 import pandas as pd
-from urllib.parse import urlparse
 
 # Import your existing backend functions
-from crawler import crawl_website
-from knowledge_Base import create_and_store_embeddings
-from qa_agent import query_knowledge_base
-from llm_handler import get_llm_answer
+import metrics
+from collection_registry import start_prewarm
+from jobs import DONE, get_job_queue
+from qa_agent import retrieve_chunks
+from llm_handler import stream_llm_answer
 
 # --- 1. Gradio Core Functions (Event Handlers) ---
 
-def build_knowledge_base(url, depth, progress=gr.Progress(track_tqdm=True)):
+def build_knowledge_base(url, depth):
     """
-    This function is triggered by the 'Build' button. It crawls a website,
-    builds the knowledge base, and updates the UI.
+    This function is triggered by the 'Build' button. It queues the crawl and
+    the knowledge-base build as a background job and returns at once; the
+    status timer then follows the job, so chat stays usable meanwhile.
     """
     if not url:
         raise gr.Error("URL cannot be empty.", "Please enter a valid website URL.")
 
-    # --- Step 1: Parse URL and set up company name ---
-    progress(0, desc="Parsing URL...")
+    # --- Step 1: Queue the build (a build already running for this domain is joined) ---
     try:
-        parsed_url = urlparse(url)
-        company_name = parsed_url.netloc.replace(".", "_")
-        if not company_name:
-            raise gr.Error("Invalid URL.", "Please enter a full URL (e.g., https://www.example.com).")
-    except Exception as e:
-        raise gr.Error("URL Parsing Failed.", f"Could not parse the URL. Error: {e}")
-
-    # --- Step 2: Crawl the website ---
-    progress(0.2, desc=f"Crawling {url}...")
-    website_text, visited_urls = crawl_website(url, max_pages=int(depth))
-    if not website_text:
-        raise gr.Error("Crawling Failed.", "Failed to fetch content. The website may be blocking crawlers or requires JavaScript.")
-    
-    # --- Step 3: Create the knowledge base ---
-    progress(0.7, desc=f"Building knowledge base for '{company_name}'...")
-    create_and_store_embeddings(company_name, website_text)
-    
-    # --- Step 4: Prepare UI updates ---
-    progress(0.9, desc="Finalizing...")
+        job = get_job_queue().submit(url, max_pages=int(depth))
+    except ValueError as e:
+        raise gr.Error("Invalid URL.", str(e))
+
+    # --- Step 2: Start following the job ---
+    return [job.id, job.describe(), gr.Timer(active=True), gr.update(visible=True)]
+
+
+def check_build(job_id):
+    """
+    Runs on every tick of the status timer while a build is in progress and
+    updates the UI once the job has finished.
+    """
+    unchanged = gr.update()
+    if job_id is None:
+        return [None, unchanged, unchanged, unchanged, unchanged, unchanged, gr.Timer(active=False), gr.update(visible=False)]
+    job = get_job_queue().get(job_id)
+    if not job.finished:
+        return [job_id, f"{job.describe()} ({job.progress:.0%})", unchanged, unchanged, unchanged, unchanged,
+                gr.Timer(active=True), gr.update(visible=True)]
+
+    # --- Step 3: The build is over; prepare the UI updates ---
+    if job.status != DONE:
+        return [None, job.describe(), unchanged, unchanged, unchanged, unchanged,
+                gr.Timer(active=False), gr.update(visible=False)]
     # Create the initial chat message
-    welcome_message = [(None, f"Hello! I've learned about {company_name}. What would you like to know?")]
+    welcome_message = [(None, f"Hello! I've learned about {job.company_name}. What would you like to know?")]
     # Create the DataFrame for visited URLs
-    visited_urls_df = pd.DataFrame(visited_urls, columns=["Crawled URLs"])
-    
-    # Return updates for multiple components
-    # CORRECT: Returning a list of values in the correct order
+    visited_urls_df = pd.DataFrame(job.visited_urls, columns=["Crawled URLs"])
     return [
-        company_name,
+        None,
+        job.describe(),
+        job.company_name,
         welcome_message,
-        gr.update(interactive=True, placeholder=f"Ask about {company_name}..."),
-        visited_urls_df
+        gr.update(interactive=True, placeholder=f"Ask about {job.company_name}..."),
+        visited_urls_df,
+        gr.Timer(active=False),
+        gr.update(visible=False),
     ]
 
+
+def cancel_build(job_id):
+    if job_id is None:
+        return gr.update()
+    return get_job_queue().cancel(job_id).describe()
+
+
 def respond(user_message, chat_history, company_name):
     """
     This function is triggered when the user sends a message in the chat.
@@ -66,13 +80,20 @@ def respond(user_message, chat_history, company_name):
     chat_history.append([user_message, None])
     yield chat_history # Yield to immediately show the user's message
 
-    # 2. Retrieve context and get the LLM's answer
-    retrieved_chunks = query_knowledge_base(company_name, user_message)
-    final_answer = get_llm_answer(user_message, retrieved_chunks)
+    # 2. Retrieve context for the LLM. Gradio may resume this generator on another thread,
+    #    so the query's trace is activated around each step explicitly.
+    query_trace = metrics.Trace("query", company=company_name)
+    with query_trace.activate():
+        retrieved_chunks = retrieve_chunks(company_name, user_message)
 
-    # 3. Stream the final answer back to the chatbot
-    chat_history[-1][1] = final_answer
-    yield chat_history
+    # 3. Stream the answer into the chatbot as the tokens arrive
+    chat_history[-1][1] = ""
+    try:
+        for piece in query_trace.wrap(stream_llm_answer(user_message, retrieved_chunks, company_name=company_name)):
+            chat_history[-1][1] += piece
+            yield chat_history
+    finally:
+        query_trace.finish()
 
 
 # --- 2. Gradio Interface Definition ---
@@ -80,6 +101,8 @@ def respond(user_message, chat_history, company_name):
 with gr.Blocks(theme=gr.themes.Soft(), title="Company Intelligence Agent 🕵️") as demo:
     # State variables to hold data that isn't a visible component
     company_name_state = gr.State(value=None)
+    build_job_state = gr.State(value=None)
+    build_timer = gr.Timer(1.0, active=False)
     
     gr.Markdown("# Company Intelligence Agent 🕵️")
 
@@ -92,6 +115,8 @@ with gr.Blocks(theme=gr.themes.Soft(), title="Company Intelligence Agent 🕵️
                 minimum=1, maximum=50, value=10, step=1, label="Crawl Depth (Max Pages)"
             )
             build_button = gr.Button("Build Knowledge Base", variant="primary")
+            build_status = gr.Markdown()
+            cancel_button = gr.Button("Cancel Build", variant="stop", visible=False)
             
             gr.Markdown("### Crawled URLs")
             visited_urls_df = gr.Dataframe(headers=["Crawled URLs"], wrap=True)
@@ -115,8 +140,18 @@ with gr.Blocks(theme=gr.themes.Soft(), title="Company Intelligence Agent 🕵️
     build_button.click(
         fn=build_knowledge_base,
         inputs=[url_input, crawl_depth_slider],
-        outputs=[company_name_state, chatbot, chat_input, visited_urls_df]
+        outputs=[build_job_state, build_status, build_timer, cancel_button]
+    )
+    build_timer.tick(
+        fn=check_build,
+        inputs=[build_job_state],
+        outputs=[build_job_state, build_status, company_name_state, chatbot, chat_input, visited_urls_df,
+                 build_timer, cancel_button]
     )
+    cancel_button.click(fn=cancel_build, inputs=[build_job_state], outputs=[build_status])
 
 if __name__ == "__main__":
+    metrics.start_metrics_server()
+    # Load the most queried knowledge bases in the background, so their first answers are fast.
+    start_prewarm()
     demo.launch()
\ No newline at end of file
@@ -1,11 +1,11 @@
 # file: app.py
 import streamlit as st
-from urllib.parse import urlparse
-from crawler import crawl_website
-from knowledge_Base import create_and_store_embeddings
-from qa_agent import query_knowledge_base
+import metrics
+from collection_registry import start_prewarm
+from jobs import DONE, get_job_queue
+from qa_agent import retrieve_chunks
 import pandas as pd
-from llm_handler import get_llm_answer # Or your preferred LLM handler
+from llm_handler import stream_llm_answer # Or your preferred LLM handler
 
 # --- App Configuration ---
 st.set_page_config(
@@ -14,13 +14,23 @@ st.set_page_config(
     layout="wide"
 )
 
+# Prometheus metrics over HTTP when METRICS_PORT is set (started once per process)
+metrics.start_metrics_server()
+# The most queried knowledge bases are loaded in the background (once per process)
+start_prewarm()
+
 # --- Session State Initialization ---
 # This ensures that variables persist across user interactions
 if 'company_name' not in st.session_state:
     st.session_state.company_name = None
 if "messages" not in st.session_state:
     st.session_state.messages = []
-visited_urls = []
+if "build_job_id" not in st.session_state:
+    st.session_state.build_job_id = None
+if "visited_urls" not in st.session_state:
+    st.session_state.visited_urls = []
+if "build_result" not in st.session_state:
+    st.session_state.build_result = None
 # --- Sidebar for Building the Knowledge Base ---
 with st.sidebar:
     st.header("1. Build Knowledge Base")
@@ -36,36 +46,50 @@ with st.sidebar:
 
     if st.button("Build Knowledge Base"):
         if url_input:
-            with st.spinner(f"Processing {url_input}... This may take a few minutes."):
-                try:
-                    parsed_url = urlparse(url_input)
-                    company_name = parsed_url.netloc.replace(".", "_")
-                    if not company_name:
-                        st.error("Invalid URL.")
-                        st.stop()
-                except Exception as e:
-                    st.error(f"Could not parse URL. Error: {e}")
-                    st.stop()
-                
-                # Use the powerful crawler
-                website_text, visited_urls = crawl_website(url_input, max_pages=access_website)
-
-            if website_text:
-                with st.spinner(f"Creating knowledge base for '{company_name}'..."):
-                    create_and_store_embeddings(company_name, website_text)
-                
-                # Update session state
-                st.session_state.company_name = company_name
-                # Reset chat history for the new company
-                st.session_state.messages = [{"role": "assistant", "content": f"Hello! I've learned about {company_name}. What would you like to know?"}]
-                st.success(f"Knowledge base for '{company_name}' is ready!")
-            else:
-                st.error("Failed to fetch content. The website may be blocking crawlers or requires JavaScript.")
+            try:
+                # The crawl and embedding run as a background job, so chat stays responsive.
+                # A build already running for this domain is joined instead of started twice.
+                st.session_state.build_job_id = get_job_queue().submit(url_input, max_pages=access_website).id
+                st.session_state.build_result = None
+            except ValueError as e:
+                st.error(f"Invalid URL. {e}")
         else:
             st.warning("Please enter a URL.")
-    if st.session_state.company_name and visited_urls:    
+
+    @st.fragment(run_every=1)
+    def build_progress():
+        # Reruns on its own every second to follow the build without rerunning the chat.
+        job_id = st.session_state.build_job_id
+        if job_id is None:
+            return
+        job = get_job_queue().get(job_id)
+        if not job.finished:
+            st.progress(job.progress, text=job.describe())
+            if st.button("Cancel Build"):
+                get_job_queue().cancel(job_id)
+            return
+
+        st.session_state.build_job_id = None
+        st.session_state.build_result = (job.status == DONE, job.describe())
+        if job.status == DONE:
+            # Update session state
+            st.session_state.company_name = job.company_name
+            st.session_state.visited_urls = job.visited_urls
+            # Reset chat history for the new company
+            st.session_state.messages = [{"role": "assistant", "content": f"Hello! I've learned about {job.company_name}. What would you like to know?"}]
+        st.rerun()
+
+    build_progress()
+
+    if st.session_state.build_result:
+        succeeded, message = st.session_state.build_result
+        if succeeded:
+            st.success(message)
+        else:
+            st.error(message)
+    if st.session_state.company_name and st.session_state.visited_urls:
         st.write(f"List of websites crawled: ")
-        df = pd.DataFrame(visited_urls, columns=["Crawled URLs"])
+        df = pd.DataFrame(st.session_state.visited_urls, columns=["Crawled URLs"])
         st.dataframe(df)
 
 # --- Main Chat Interface ---
@@ -89,15 +113,13 @@ if prompt := st.chat_input("Ask a follow-up question...", disabled=(not st.sessi
         st.markdown(prompt)
 
     # 2. Generate and display the AI's response
-    with st.chat_message("assistant"):
+    with st.chat_message("assistant"), metrics.trace("query", company=st.session_state.company_name):
         with st.spinner("Thinking..."):
             # Retrieve context from the knowledge base
-            retrieved_chunks = query_knowledge_base(st.session_state.company_name, prompt)
-            
-            # Get the final answer from the LLM
-            final_answer = get_llm_answer(prompt, retrieved_chunks) # Or your preferred LLM function call
+            retrieved_chunks = retrieve_chunks(st.session_state.company_name, prompt)
             
-            st.markdown(final_answer)
+        # Stream the answer from the LLM as it is generated; write_stream returns the full text
+        final_answer = st.write_stream(stream_llm_answer(prompt, retrieved_chunks, company_name=st.session_state.company_name)) # Or your preferred LLM function call
     
     # 3. Add AI's response to the history
     st.session_state.messages.append({"role": "assistant", "content": final_answer})
\ No newline at end of file
@@ -0,0 +1,140 @@
+# file: benchmarks/bench_chunking.py
+"""
+Compares the old chunking (one RecursiveCharacterTextSplitter, 500
+characters with a 50-character overlap, over trafilatura's plain text) with
+the structure-aware chunker in chunking.py (token-sized, per page, along
+headings, paragraphs and lists) on the same pages:
+
+- the Q/A fixture pages (benchmarks/fixtures/retrieval_qa.json),
+- the saved pages in benchmarks/fixtures/pages,
+- --generated pages from fixture_site.py, with a --boilerplate share.
+
+For each it reports the chunk count, chunk sizes in embedding-model tokens
+(and how many chunks the model would truncate), chunking and embedding
+time, and dense recall@k over the fixture questions: a question counts as
+answered at k if one of its k nearest chunks contains the expected answer.
+
+    python benchmarks/bench_chunking.py --generated 200
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import trafilatura
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from bench_parse import load_corpus
+from fixture_site import make_page
+
+QA_FIXTURE = os.path.join(REPO_ROOT, "benchmarks", "fixtures", "retrieval_qa.json")
+# all-MiniLM-L6-v2 reads at most 256 tokens, two of which are [CLS] and [SEP].
+MODEL_MAX_TOKENS = 254
+
+
+def load_pages(generated: int, boilerplate: float) -> tuple:
+    """
+    Returns the pages as [(url, old plain text, new structured text)] and the fixture questions.
+    """
+    from page_parser import parse_page
+
+    with open(QA_FIXTURE, encoding="utf-8") as f:
+        fixture = json.load(f)
+    pages = [(page["url"], page["text"], page["text"]) for page in fixture["pages"]]
+    html_pages = load_corpus() + [
+        (f"https://generated.example/page/{i}", make_page(i, generated, boilerplate_ratio=boilerplate))
+        for i in range(generated)
+    ]
+    for url, html in html_pages:
+        old_text = trafilatura.extract(html, include_comments=False, include_tables=False) or ""
+        new_text = parse_page(html, url)[0] or ""
+        pages.append((url, old_text, new_text))
+    return pages, fixture["questions"]
+
+
+def character_chunks(pages: list) -> list:
+    # As before: every page's text joined into one corpus, so chunks can straddle pages.
+    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+    return splitter.split_text("\n\n".join(old_text for _, old_text, _ in pages))
+
+
+def structured_chunks(pages: list, count_tokens) -> list:
+    from chunking import chunk_text
+
+    return [chunk.text for _, _, new_text in pages for chunk in chunk_text(new_text, count_tokens)]
+
+
+def evaluate(label: str, chunk_fn, questions: list, ks: list, count_tokens) -> dict:
+    import embedding_service
+
+    start = time.perf_counter()
+    chunks = chunk_fn()
+    chunk_seconds = time.perf_counter() - start
+
+    sizes = [count_tokens(chunk) for chunk in chunks]
+    start = time.perf_counter()
+    vectors = np.asarray(embedding_service.encode(chunks))
+    embed_seconds = time.perf_counter() - start
+
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    query_vectors = np.asarray(embedding_service.encode([item["question"] for item in questions]))
+    query_vectors = query_vectors / np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    ranked = np.argsort(-(query_vectors @ vectors.T), axis=1)[:, :max(ks)]
+    found_at = []
+    for item, neighbours in zip(questions, ranked):
+        ranks = [rank for rank, index in enumerate(neighbours, start=1) if item["answer"] in chunks[index]]
+        found_at.append(ranks[0] if ranks else None)
+    recall = {k: sum(1 for rank in found_at if rank is not None and rank <= k) / len(questions) for k in ks}
+    return {
+        "label": label,
+        "chunks": len(chunks),
+        "mean_tokens": sum(sizes) / len(sizes),
+        "max_tokens": max(sizes),
+        "truncated": sum(1 for size in sizes if size > MODEL_MAX_TOKENS),
+        "chunk_s": chunk_seconds,
+        "embed_s": embed_seconds,
+        "recall": recall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--generated", type=int, default=100, help="generated pages added to the corpus")
+    parser.add_argument("--boilerplate", type=float, default=0.2, help="share of paragraphs repeated on every generated page")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5], help="cut-offs for recall@k")
+    parser.add_argument("--model", help="embedding model name or path (default: the app's model)")
+    args = parser.parse_args()
+
+    import embedding_service
+    if args.model:
+        embedding_service.EMBEDDING_MODEL_NAME = args.model
+    from chunking import CHUNK_TOKENS, get_chunk_token_counter
+
+    pages, questions = load_pages(args.generated, args.boilerplate)
+    count_tokens = get_chunk_token_counter()
+    # Load the model outside the timings.
+    embedding_service.encode(["warm up"])
+
+    results = [
+        evaluate("character 500/50", lambda: character_chunks(pages), questions, args.k, count_tokens),
+        evaluate(f"structured {CHUNK_TOKENS} tok", lambda: structured_chunks(pages, count_tokens), questions, args.k, count_tokens),
+    ]
+
+    print(f"\n{len(pages)} pages, {len(questions)} questions\n")
+    header = " ".join(f"{f'R@{k}':>6}" for k in args.k)
+    print(f"{'chunker':<20} {'chunks':>7} {'mean tok':>9} {'max tok':>8} {'truncated':>10} "
+          f"{'chunk ms':>9} {'embed s':>8} {header}")
+    for result in results:
+        recalls = " ".join(f"{result['recall'][k]:6.0%}" for k in args.k)
+        print(f"{result['label']:<20} {result['chunks']:7d} {result['mean_tokens']:9.1f} {result['max_tokens']:8d} "
+              f"{result['truncated']:10d} {result['chunk_s'] * 1000:9.1f} {result['embed_s']:8.2f} {recalls}")
+
+
+if __name__ == "__main__":
+    main()
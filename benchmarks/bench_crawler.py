@@ -0,0 +1,83 @@
+# file: benchmarks/bench_crawler.py
+"""
+Compares the old one-page-at-a-time crawler with the async crawl engine
+against a local stand-in site and reports pages/sec for each.
+
+    python benchmarks/bench_crawler.py --pages 50 --latency 0.05
+"""
+import argparse
+import os
+import sys
+import time
+from urllib.parse import urljoin, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+import trafilatura
+from bs4 import BeautifulSoup
+
+import crawler
+from fixture_site import FixtureSite
+
+
+def legacy_crawl_website(start_url: str, max_pages: int = 20, delay: float = 0.5):
+    """
+    The original blocking crawl loop, kept here as the baseline.
+    """
+    to_visit_queue = [start_url]
+    visited_urls = set()
+    all_text_data = []
+    base_domain = urlparse(start_url).netloc
+
+    while to_visit_queue and len(visited_urls) < max_pages:
+        current_url = to_visit_queue.pop(0)
+        if current_url in visited_urls:
+            continue
+        try:
+            response = requests.get(current_url, headers=crawler.HEADERS, timeout=10)
+            response.raise_for_status()
+            visited_urls.add(current_url)
+
+            page_text = trafilatura.extract(response.text, include_comments=False, include_tables=False)
+            if page_text:
+                all_text_data.append(page_text)
+
+            soup = BeautifulSoup(response.text, 'html.parser')
+            for link in soup.find_all('a', href=True):
+                full_url = urljoin(start_url, link['href']).split('#')[0]
+                if (urlparse(full_url).netloc == base_domain and
+                        full_url not in visited_urls and
+                        full_url not in to_visit_queue):
+                    to_visit_queue.append(full_url)
+            time.sleep(delay)
+        except requests.RequestException:
+            continue
+
+    return "\n\n".join(all_text_data), visited_urls
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    _, visited = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {len(visited):>4} pages in {elapsed:6.2f}s  ->  {len(visited) / elapsed:7.2f} pages/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=50, help="max_pages for each crawl")
+    parser.add_argument("--site-size", type=int, default=200, help="number of pages on the stand-in site")
+    parser.add_argument("--latency", type=float, default=0.05, help="artificial server latency in seconds")
+    args = parser.parse_args()
+
+    with FixtureSite(page_count=args.site_size, latency=args.latency) as site:
+        print(f"Stand-in site at {site.base_url} ({args.site_size} pages, {args.latency * 1000:.0f} ms latency)\n")
+        timed("legacy (sleep 0.5s)", lambda: legacy_crawl_website(site.base_url, args.pages))
+        timed("async (polite defaults)", lambda: crawler.crawl_website(site.base_url, args.pages))
+        timed("async (no rate limit)", lambda: crawler._run_sync(crawler.crawl_website_async(
+            site.base_url, args.pages, requests_per_second=1000.0)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+# file: benchmarks/bench_e2e.py
+"""
+End-to-end benchmark of the whole pipeline, fully offline: a generated site
+served by fixture_site.py is crawled, embedded into a throwaway knowledge
+base, queried, and answered through the fake chat-completion server in
+fake_llm_server.py. Follows the path the apps take:
+
+    crawl_website_changes -> create_and_store_embeddings -> query_knowledge_base -> get_llm_answer
+
+and reports crawl pages/sec, ingest chunks/sec, the cost of rebuilding an
+unchanged site, query and answer latency (p50/p99), peak memory (this
+process plus the parse workers) and where each phase spent its time.
+
+Results are saved as JSON (by default under benchmarks/results/, named
+after the commit), so runs on different commits can be compared:
+
+    python benchmarks/bench_e2e.py --pages 200 --boilerplate 0.3
+    git checkout <other commit>
+    python benchmarks/bench_e2e.py --pages 200 --boilerplate 0.3 --compare benchmarks/results/<earlier run>.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import psutil
+
+from fake_llm_server import FakeLLMServer
+from fixture_site import WORDS, FixtureSite
+
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+COMPANY = "e2e_bench"
+# Headline numbers compared by --compare, and whether higher is better.
+HEADLINE = {
+    "crawl_pages_per_s": True,
+    "ingest_chunks_per_s": True,
+    "rebuild_unchanged_s": False,
+    "query_p50_ms": False,
+    "query_p99_ms": False,
+    "answer_p50_ms": False,
+    "answer_p99_ms": False,
+    "peak_rss_mb": False,
+}
+
+
+class PeakMemory:
+    """
+    Samples the resident memory of this process and its children (the parse
+    workers) in the background and keeps the peak, in MB.
+    """
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._process = psutil.Process()
+
+    def _sample(self):
+        rss = self._process.memory_info().rss
+        for child in self._process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except psutil.Error:
+                pass
+        self.peak_mb = max(self.peak_mb, rss / 2**20)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def percentile(values: list, q: float) -> float:
+    # Nearest-rank percentile: the smallest value with at least q% of the values at or below it.
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def make_questions(count: int) -> list:
+    rng = random.Random(7)
+    return [f"What does the {rng.choice(WORDS)} {rng.choice(WORDS)} {rng.choice(WORDS)} offer?" for _ in range(count)]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_benchmark(args, llm: FakeLLMServer) -> dict:
+    # Keep ChromaDB, the caches and the crawl state out of the working tree, and start them cold.
+    os.chdir(tempfile.mkdtemp(prefix="ciagent-e2e-"))
+    import embedding_service
+    if args.model:
+        embedding_service.EMBEDDING_MODEL_NAME = args.model
+    import metrics
+    from context_builder import get_token_counter
+    from crawler import crawl_website_changes
+    from knowledge_Base import create_and_store_embeddings
+    from llm_handler import MODEL_URL, get_llm_answer
+    from qa_agent import query_knowledge_base
+    from query_cache import retrieval_cache
+
+    results, stages = {}, {}
+    questions = make_questions(args.queries)
+    crawl_options = {"requests_per_second": args.requests_per_second} if args.requests_per_second else {}
+    site = FixtureSite(args.pages, args.fan_out, args.latency, args.paragraphs, args.boilerplate)
+    with site, PeakMemory() as memory:
+        # Load the embedding model and the LLM's tokenizer outside the timings.
+        embedding_service.encode(["warm up"])
+        get_token_counter(MODEL_URL)
+
+        # 1. Crawl the whole site.
+        with metrics.trace("crawl") as crawl_trace:
+            start = time.perf_counter()
+            delta = crawl_website_changes(site.base_url, max_pages=args.pages, full=True, **crawl_options)
+            crawl_seconds = time.perf_counter() - start
+        pages = len(delta.visited_urls)
+        results.update(crawl_pages=pages, crawl_s=crawl_seconds, crawl_pages_per_s=pages / crawl_seconds)
+        stages["crawl"] = crawl_trace.summary()
+
+        # 2. Chunk, embed and store it.
+        embedded = {"chunks": 0}
+        with metrics.trace("ingest") as ingest_trace:
+            start = time.perf_counter()
+            create_and_store_embeddings(COMPANY, delta, progress=lambda p, chunks: embedded.update(chunks=chunks))
+            ingest_seconds = time.perf_counter() - start
+        results.update(chunks=embedded["chunks"], ingest_s=ingest_seconds,
+                       ingest_chunks_per_s=embedded["chunks"] / ingest_seconds)
+        stages["ingest"] = ingest_trace.summary()
+
+        # 3. Rebuild the unchanged site, as the apps do when a knowledge base already exists.
+        with metrics.trace("rebuild") as rebuild_trace:
+            start = time.perf_counter()
+            create_and_store_embeddings(COMPANY, crawl_website_changes(site.base_url, max_pages=args.pages, **crawl_options))
+            results["rebuild_unchanged_s"] = time.perf_counter() - start
+        stages["rebuild"] = rebuild_trace.summary()
+
+        # 4. Retrieval alone, with the retrieval cache cleared so every question is searched.
+        query_ms = []
+        with metrics.trace("query") as query_trace:
+            for question in questions:
+                retrieval_cache.clear()
+                start = time.perf_counter()
+                query_knowledge_base(COMPANY, question)
+                query_ms.append((time.perf_counter() - start) * 1000)
+        results.update(query_p50_ms=percentile(query_ms, 50), query_p99_ms=percentile(query_ms, 99))
+        stages["query"] = query_trace.summary()
+
+        # 5. The full question-to-answer path against the stub LLM.
+        answer_ms = []
+        with metrics.trace("answer") as answer_trace:
+            for question in questions:
+                retrieval_cache.clear()
+                start = time.perf_counter()
+                get_llm_answer(question, query_knowledge_base(COMPANY, question))
+                answer_ms.append((time.perf_counter() - start) * 1000)
+        if llm.requests < len(questions):
+            # get_llm_answer reports failures as answer text, so check the stub was really reached.
+            raise SystemExit(f"Only {llm.requests} of {len(questions)} answers reached the stub LLM "
+                             "(is HF_HUB_OFFLINE set? It also blocks local endpoints).")
+        results.update(answer_p50_ms=percentile(answer_ms, 50), answer_p99_ms=percentile(answer_ms, 99))
+        stages["answer"] = answer_trace.summary()
+    results["peak_rss_mb"] = memory.peak_mb
+    return {"results": results, "stages": stages}
+
+
+def compare(current: dict, baseline_path: str):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("config") != current["config"]:
+        print("warning: the baseline was run with a different configuration")
+    print(f"\nCompared with {baseline.get('commit')} ({os.path.basename(baseline_path)})\n")
+    print(f"{'metric':<22} {'before':>10} {'after':>10} {'change':>8}")
+    for key, higher_is_better in HEADLINE.items():
+        before, after = baseline["results"].get(key), current["results"].get(key)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before if before else 0.0
+        worse = change < 0 if higher_is_better else change > 0
+        flag = "  worse" if worse and abs(change) > 0.05 else ""
+        print(f"{key:<22} {before:10.2f} {after:10.2f} {change:+8.1%}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=100, help="pages in the generated site (all are crawled)")
+    parser.add_argument("--fan-out", type=int, default=8, help="links per page")
+    parser.add_argument("--paragraphs", type=int, default=6, help="paragraphs of about 60 words per page")
+    parser.add_argument("--boilerplate", type=float, default=0.2, help="share of paragraphs repeated on every page")
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds the site waits before each response")
+    parser.add_argument("--requests-per-second", type=float,
+                        help="crawler politeness limit per host (default: the crawler's REQUESTS_PER_SECOND)")
+    parser.add_argument("--queries", type=int, default=50, help="questions asked for the latency percentiles")
+    parser.add_argument("--llm-tokens", type=int, default=64, help="tokens per stub LLM answer")
+    parser.add_argument("--first-token-latency", type=float, default=0.05)
+    parser.add_argument("--token-latency", type=float, default=0.002)
+    parser.add_argument("--model", help="embedding model name or path (default: the app's model)")
+    parser.add_argument("--output", help="where to save the JSON results (default: benchmarks/results/)")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    commit = git_commit()
+    with FakeLLMServer(args.llm_tokens, args.first_token_latency, args.token_latency) as llm:
+        # llm_handler creates its client at import time, so point it at the stub server first.
+        os.environ["LLM_BASE_URL"] = llm.base_url
+        os.environ.setdefault("HF_API_TOKEN", "unused")
+        measured = run_benchmark(args, llm)
+
+    report = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": config,
+        **measured,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"e2e-{commit}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    results = report["results"]
+    print(f"\n{results['crawl_pages']} pages, {results['chunks']} chunks, {args.queries} questions\n")
+    print(f"{'crawl':<28} {results['crawl_pages_per_s']:10.1f} pages/s")
+    print(f"{'ingest':<28} {results['ingest_chunks_per_s']:10.1f} chunks/s")
+    print(f"{'rebuild (site unchanged)':<28} {results['rebuild_unchanged_s']:10.2f} s")
+    print(f"{'query p50 / p99':<28} {results['query_p50_ms']:10.1f} / {results['query_p99_ms']:.1f} ms")
+    print(f"{'answer p50 / p99':<28} {results['answer_p50_ms']:10.1f} / {results['answer_p99_ms']:.1f} ms")
+    print(f"{'peak memory':<28} {results['peak_rss_mb']:10.1f} MB")
+    for phase, phase_stages in report["stages"].items():
+        breakdown = ", ".join(f"{stage} {totals['seconds']:.2f}s" for stage, totals in phase_stages.items())
+        print(f"  {phase:<10} {breakdown}")
+    print(f"\nSaved to {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# file: benchmarks/bench_embedding.py
+"""
+Embedding backend benchmark over chunks of the saved pages in
+benchmarks/fixtures/pages. Reports chunks/sec for each backend in
+embedding_backends.py and how far its vectors drift from the fp32
+sentence-transformers baseline:
+
+- cosine: mean and minimum cosine similarity to the baseline vector of the same chunk.
+- top-k: share of each chunk's k nearest neighbours that match the baseline's,
+  a proxy for how much retrieval results would change.
+
+    python benchmarks/bench_embedding.py --repeat 10 --processes 4
+
+The first ONNX run exports the model into onnx_models/, which is not timed.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from bench_parse import load_corpus
+from embedding_backends import OnnxBackend, SentenceTransformerBackend
+from embedding_service import EMBEDDING_MODEL_NAME
+from page_parser import parse_page
+
+
+def load_chunks():
+    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+    chunks = []
+    for url, html in load_corpus():
+        page_text, _, _ = parse_page(html, url)
+        if page_text:
+            chunks.extend(splitter.split_text(page_text))
+    return chunks
+
+
+def top_k_agreement(vectors, baseline, k):
+    def neighbours(matrix):
+        similarity = matrix @ matrix.T
+        np.fill_diagonal(similarity, -np.inf)
+        return np.argsort(-similarity, axis=1)[:, :k]
+
+    ours, theirs = neighbours(vectors), neighbours(baseline)
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ours, theirs)]))
+
+
+def timed_encode(encode, warm_up_chunks, chunks):
+    # Untimed first pass: loads lazily created sessions and starts the process pool.
+    encode(warm_up_chunks)
+    start = time.perf_counter()
+    encode(chunks)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=EMBEDDING_MODEL_NAME, help="sentence-transformers model name or path")
+    parser.add_argument("--repeat", type=int, default=10, help="passes over the fixture chunks when timing")
+    parser.add_argument("--processes", type=int, default=0, help="also time a multi-process pool of this size")
+    parser.add_argument("--top-k", type=int, default=5, help="neighbours compared for retrieval agreement")
+    args = parser.parse_args()
+
+    chunks = load_chunks()
+    timing_chunks = chunks * args.repeat
+    print(f"{len(chunks)} fixture chunks x {args.repeat} repeats\n")
+
+    torch_backend = SentenceTransformerBackend(args.model)
+    # The baseline is sentence-transformers with its default batch size of 32, as before backends existed.
+    backends = [
+        ("torch fp32 (baseline)", lambda texts: torch_backend.model.encode(texts, normalize_embeddings=True)),
+        ("torch fp32, tuned batches", torch_backend.encode),
+        ("onnx fp32", OnnxBackend(args.model).encode),
+        ("onnx int8", OnnxBackend(args.model, quantize=True).encode),
+    ]
+    if args.processes > 1:
+        backends.append((f"torch x{args.processes} processes",
+                         SentenceTransformerBackend(args.model, processes=args.processes).encode))
+
+    baseline = np.asarray(backends[0][1](chunks), dtype=np.float32)
+    print(f"{'backend':<28} {'chunks/s':>10} {'cos mean':>9} {'cos min':>9} {f'top-{args.top_k}':>7}")
+    for label, encode in backends:
+        elapsed = timed_encode(encode, chunks, timing_chunks)
+        vectors = np.asarray(encode(chunks), dtype=np.float32)
+        cosine = np.sum(vectors * baseline, axis=1)
+        print(f"{label:<28} {len(timing_chunks) / elapsed:10.1f} {cosine.mean():9.4f} {cosine.min():9.4f} "
+              f"{top_k_agreement(vectors, baseline, args.top_k):7.1%}")
+
+
+if __name__ == "__main__":
+    main()
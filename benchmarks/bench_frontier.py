@@ -0,0 +1,89 @@
+# file: benchmarks/bench_frontier.py
+"""
+Micro-benchmark for the crawl frontier. Simulates a BFS over a random link
+graph (no network, no parsing) and times the enqueue/dedup work of the old
+list-based queue against `Frontier` and `DiskFrontier`.
+
+    python benchmarks/bench_frontier.py --links 100000 --fan-out 10
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from frontier import DiskFrontier, Frontier
+
+
+def make_graph(link_count: int, fan_out: int, seed: int = 0):
+    """
+    Returns `page -> [linked pages]` with `link_count` links in total.
+    """
+    rng = random.Random(seed)
+    page_count = max(1, link_count // fan_out)
+    return [
+        [f"https://example.com/page/{rng.randrange(page_count)}/" for _ in range(fan_out)]
+        for _ in range(page_count)
+    ]
+
+
+def page_id(url: str) -> int:
+    return int(url.rstrip("/").rsplit("/", 1)[-1])
+
+
+def legacy_bfs(graph):
+    to_visit_queue = ["https://example.com/page/0/"]
+    visited_urls = set()
+    while to_visit_queue:
+        current_url = to_visit_queue.pop(0)
+        if current_url in visited_urls:
+            continue
+        visited_urls.add(current_url)
+        for full_url in graph[page_id(current_url)]:
+            if full_url not in visited_urls and full_url not in to_visit_queue:
+                to_visit_queue.append(full_url)
+    return len(visited_urls)
+
+
+def frontier_bfs(graph, frontier):
+    frontier.push("https://example.com/page/0/")
+    visited = 0
+    while frontier:
+        current_url = frontier.pop()
+        visited += 1
+        for full_url in graph[page_id(current_url)]:
+            frontier.push(full_url)
+    frontier.close()
+    return visited
+
+
+def timed(label, link_count, fn):
+    start = time.perf_counter()
+    pages = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{link_count:>9,} links  {label:<14} {pages:>7,} pages  {elapsed:8.3f}s  "
+          f"{link_count / elapsed:>12,.0f} links/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--links", type=int, default=100_000, help="largest graph size, in links")
+    parser.add_argument("--fan-out", type=int, default=10, help="links per page")
+    parser.add_argument("--legacy-max-links", type=int, default=100_000,
+                        help="skip the quadratic list-based queue above this size")
+    args = parser.parse_args()
+
+    sizes = sorted({size for size in (1_000, 10_000, args.links // 4, args.links) if size <= args.links})
+    for link_count in sizes:
+        graph = make_graph(link_count, args.fan_out)
+        if link_count <= args.legacy_max_links:
+            timed("list (legacy)", link_count, lambda: legacy_bfs(graph))
+        timed("Frontier", link_count, lambda: frontier_bfs(graph, Frontier()))
+        timed("DiskFrontier", link_count, lambda: frontier_bfs(graph, DiskFrontier()))
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# file: benchmarks/bench_llm_stream.py
+"""
+Compares how long a user waits for the first words of an answer with the
+old blocking call (one non-streamed chat completion) and with
+`llm_handler.stream_llm_answer`, against the local fake chat-completion
+server in fake_llm_server.py. Also checks that both return the same text.
+
+    python benchmarks/bench_llm_stream.py --tokens 200 --token-latency 0.02
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_llm_server import FakeLLMServer
+
+QUESTION = "What does Northwind charge for the enterprise plan?"
+CONTEXT = ["Northwind offers three plans.", "The enterprise plan is priced per seat."]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=200, help="tokens per answer")
+    parser.add_argument("--first-token-latency", type=float, default=0.3)
+    parser.add_argument("--token-latency", type=float, default=0.02)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    with FakeLLMServer(args.tokens, args.first_token_latency, args.token_latency) as server:
+        # llm_handler creates its client at import time, so point it at the fake server first.
+        os.environ["LLM_BASE_URL"] = server.base_url
+        os.environ.setdefault("HF_API_TOKEN", "unused")
+        import llm_handler
+
+        blocking_waits, streamed_waits, streamed_totals, rates = [], [], [], []
+        for _ in range(args.runs):
+            # Before: the UI shows nothing until the whole answer is back.
+            start = time.perf_counter()
+            response = llm_handler.client.chat_completion(
+                model=llm_handler.MODEL_URL,
+                messages=llm_handler._build_messages(QUESTION, "\n---\n".join(CONTEXT)),
+                max_tokens=512,
+            )
+            blocking_answer = response.choices[0].message.content.strip()
+            blocking_waits.append(time.perf_counter() - start)
+
+            # After: the UI shows each piece as it arrives.
+            stats = llm_handler.GenerationStats()
+            streamed_answer = "".join(llm_handler.stream_llm_answer(QUESTION, CONTEXT, stats)).strip()
+            streamed_waits.append(stats.time_to_first_token)
+            streamed_totals.append(stats.duration)
+            rates.append(stats.tokens_per_second)
+
+            if streamed_answer != blocking_answer:
+                print("warning: streamed answer differs from the blocking one")
+
+    print(f"\n{args.tokens} tokens per answer, {args.runs} runs (medians)\n")
+    print(f"{'before: blocking, first text after':<38} {statistics.median(blocking_waits):6.2f}s")
+    print(f"{'after: streamed, first text after':<38} {statistics.median(streamed_waits):6.2f}s")
+    print(f"{'after: streamed, complete after':<38} {statistics.median(streamed_totals):6.2f}s")
+    print(f"{'after: decoding rate':<38} {statistics.median(rates):6.1f} tokens/s")
+
+
+if __name__ == "__main__":
+    main()
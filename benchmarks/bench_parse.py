@@ -0,0 +1,105 @@
+# file: benchmarks/bench_parse.py
+"""
+Parse-time benchmark over the saved pages in benchmarks/fixtures/pages.
+Compares the old double parse (trafilatura + BeautifulSoup 'html.parser')
+with the single lxml parse in `page_parser.parse_page`, then times the
+process pool the crawler uses.
+
+    python benchmarks/bench_parse.py --rounds 20
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urljoin
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trafilatura
+from bs4 import BeautifulSoup
+
+from page_parser import parse_page
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "pages")
+BASE_URL = "https://northwind.example/"
+# Line prefixes of the structured page text: headings, list items and table rows.
+STRUCTURE_MARK = re.compile(r"^(#+ |- |\| )")
+
+
+def legacy_parse_page(html: str, page_url: str):
+    """
+    The original approach: trafilatura parses the page, then BeautifulSoup parses it again for links.
+    """
+    page_text = trafilatura.extract(html, include_comments=False, include_tables=False)
+    soup = BeautifulSoup(html, 'html.parser')
+    links = [urljoin(page_url, link['href']).split('#')[0] for link in soup.find_all('a', href=True)]
+    return page_text, links
+
+
+def destructured(text: str) -> str:
+    """
+    The words of a page's text without its structure marks (see
+    `page_parser.structured_text`), so the structured and the plain
+    extraction can be compared on what they extract.
+    """
+    if text is None:
+        return None
+    lines = []
+    for line in text.split("\n"):
+        line = STRUCTURE_MARK.sub("", line)
+        if line.endswith(" |"):
+            line = line[:-2].replace(" | ", " ")
+        lines.append(line)
+    return " ".join(" ".join(lines).split())
+
+
+def load_corpus():
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, "*.html"))):
+        with open(path, encoding="utf-8") as f:
+            corpus.append((BASE_URL + os.path.basename(path)[:-5] + "/", f.read()))
+    return corpus
+
+
+def timed(label, page_count, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed / page_count * 1000:8.2f} ms/page  ({page_count} pages, {elapsed:.2f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=20, help="passes over the fixture corpus")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="process pool size")
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    pages = corpus * args.rounds
+    print(f"{len(corpus)} fixture pages x {args.rounds} rounds\n")
+
+    # Warm up imports and lxml so the first timing isn't penalised.
+    legacy_parse_page(corpus[0][1], corpus[0][0])
+    parse_page(corpus[0][1], corpus[0][0])
+
+    timed("before: trafilatura + bs4", len(pages), lambda: [legacy_parse_page(html, url) for url, html in pages])
+    timed("after: single lxml parse", len(pages), lambda: [parse_page(html, url) for url, html in pages])
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        list(pool.map(parse_page, [html for _, html in corpus], [url for url, _ in corpus]))
+        timed(f"after: pool of {args.workers} (wall)", len(pages), lambda: list(pool.map(
+            parse_page, [html for _, html in pages], [url for url, _ in pages], chunksize=4)))
+
+    # Both pipelines must agree on what they extract; the new one only adds structure marks.
+    for url, html in corpus:
+        old_text, old_links = legacy_parse_page(html, url)
+        new_text, new_links, _ = parse_page(html, url)
+        if destructured(old_text) != destructured(new_text) or old_links != new_links:
+            print(f"warning: output differs for {url}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# file: benchmarks/bench_replay.py
+"""
+Crawls a generated site served by fixture_site.py once while archiving it
+(page_archive.py), then replays the same crawl from the archive with no
+network, and reports pages/sec for both, the archive's size against the
+raw HTML, and whether the replay extracted exactly the same text.
+
+    python benchmarks/bench_replay.py --pages 200 --latency 0.02
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crawler
+from fixture_site import FixtureSite
+
+
+def timed_crawl(start_url: str, max_pages: int, **options) -> tuple:
+    start = time.perf_counter()
+    text, visited = crawler.crawl_website(start_url, max_pages, **options)
+    return text, visited, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=100, help="pages in the generated site (all are crawled)")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds the site waits before each response")
+    parser.add_argument("--paragraphs", type=int, default=6, help="paragraphs of about 60 words per page")
+    args = parser.parse_args()
+
+    archive_dir = tempfile.mkdtemp(prefix="ciagent-archive-")
+    with FixtureSite(args.pages, latency=args.latency, paragraphs=args.paragraphs) as site:
+        fetched_text, fetched, fetch_seconds = timed_crawl(site.base_url, args.pages, archive_dir=archive_dir)
+        start_url = site.base_url
+    # The site is gone now, so the replay can't reach the network even by mistake.
+    replayed_text, replayed, replay_seconds = timed_crawl(start_url, args.pages, replay_dir=archive_dir)
+
+    archive_bytes = sum(os.path.getsize(os.path.join(archive_dir, name)) for name in os.listdir(archive_dir)
+                        if name.endswith(".warc.gz"))
+    print(f"\n{'mode':<10} {'pages':>6} {'seconds':>8} {'pages/s':>8}")
+    print(f"{'fetch':<10} {len(fetched):6d} {fetch_seconds:8.2f} {len(fetched) / fetch_seconds:8.1f}")
+    print(f"{'replay':<10} {len(replayed):6d} {replay_seconds:8.2f} {len(replayed) / replay_seconds:8.1f}")
+    print(f"\narchive: {archive_bytes / 2**10:.1f} KiB in {archive_dir}")
+    # Concurrent fetches finish in a different order without the network, so pages are compared as a set.
+    same_text = sorted(fetched_text.split("\n\n")) == sorted(replayed_text.split("\n\n"))
+    print(f"same pages: {fetched == replayed}, same text: {same_text}")
+
+
+if __name__ == "__main__":
+    main()
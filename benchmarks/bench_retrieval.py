@@ -0,0 +1,98 @@
+# file: benchmarks/bench_retrieval.py
+"""
+Offline retrieval evaluation. Builds a throwaway knowledge base from the
+Q/A fixture (benchmarks/fixtures/retrieval_qa.json) plus the saved pages
+in benchmarks/fixtures/pages as distractors, through the normal ingest
+path, then asks every fixture question with each retrieval mode of
+`qa_agent.query_knowledge_base` and reports recall@k and query latency.
+
+A question counts as answered at k if one of the top k chunks contains
+its expected answer text.
+
+    python benchmarks/bench_retrieval.py
+    python benchmarks/bench_retrieval.py --rerank   # also time the cross-encoder
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from bench_parse import load_corpus
+
+QA_FIXTURE = os.path.join(REPO_ROOT, "benchmarks", "fixtures", "retrieval_qa.json")
+COMPANY = "retrieval_eval"
+
+
+def build_knowledge_base():
+    from crawl_state import CrawlDelta
+    from knowledge_Base import create_and_store_embeddings
+    from page_parser import parse_page
+
+    with open(QA_FIXTURE, encoding="utf-8") as f:
+        fixture = json.load(f)
+    delta = CrawlDelta(site="northwind.example", full=True)
+    for page in fixture["pages"]:
+        delta.added[page["url"]] = page["text"]
+        delta.titles[page["url"]] = page["title"]
+    for url, html in load_corpus():
+        text, _, title = parse_page(html, url)
+        delta.added[url] = text
+        delta.titles[url] = title
+    delta.text_pages = len(delta.added)
+    create_and_store_embeddings(COMPANY, delta)
+    return fixture["questions"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5], help="cut-offs for recall@k")
+    parser.add_argument("--rerank", action="store_true", help="also evaluate hybrid retrieval with the cross-encoder")
+    parser.add_argument("--model", help="embedding model name or path (default: the app's model)")
+    args = parser.parse_args()
+
+    # Keep ChromaDB, the keyword index and the embedding cache out of the working tree.
+    os.chdir(tempfile.mkdtemp(prefix="scout-retrieval-"))
+    import embedding_service
+    if args.model:
+        embedding_service.EMBEDDING_MODEL_NAME = args.model
+    import qa_agent
+    from query_cache import retrieval_cache
+
+    questions = build_knowledge_base()
+    modes = [("dense", False), ("bm25", False), ("hybrid", False)]
+    if args.rerank:
+        modes.append(("hybrid", True))
+    depth = max(args.k)
+
+    # Load the models outside the timings.
+    qa_agent.query_knowledge_base(COMPANY, "warm up", n_results=depth, rerank=args.rerank)
+
+    print(f"\n{len(questions)} questions\n")
+    header = " ".join(f"{f'R@{k}':>6}" for k in args.k)
+    print(f"{'mode':<16} {header} {'p50 ms':>8} {'p95 ms':>8}")
+    for mode, rerank in modes:
+        found_at = []
+        latencies = []
+        for item in questions:
+            retrieval_cache.clear()
+            start = time.perf_counter()
+            chunks = qa_agent.query_knowledge_base(COMPANY, item["question"], n_results=depth, mode=mode, rerank=rerank)
+            latencies.append((time.perf_counter() - start) * 1000)
+            ranks = [rank for rank, chunk in enumerate(chunks, start=1) if item["answer"] in chunk]
+            found_at.append(ranks[0] if ranks else None)
+        recalls = " ".join(
+            f"{sum(1 for rank in found_at if rank is not None and rank <= k) / len(questions):6.0%}" for k in args.k
+        )
+        p95 = statistics.quantiles(latencies, n=20)[-1]
+        label = mode + (" + rerank" if rerank else "")
+        print(f"{label:<16} {recalls} {statistics.median(latencies):8.1f} {p95:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# file: benchmarks/bench_startup.py
+"""
+Measures what importing the backend costs a fresh process: wall time to
+import `knowledge_Base` and `qa_agent` (what both apps import), and the
+resident memory afterwards. If the tree has `embedding_service`, it also
+reports the cost of the first real use, when the shared model is loaded.
+
+To compare against an older version, check it out next to this one and
+point --tree at it:
+
+    git worktree add ../scout-before <commit>
+    python benchmarks/bench_startup.py --tree ../scout-before
+    python benchmarks/bench_startup.py
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, os, sys, time
+import psutil
+
+sys.path.insert(0, os.getcwd())
+process = psutil.Process()
+result = {"rss_start_mb": process.memory_info().rss / 2**20}
+
+start = time.perf_counter()
+import knowledge_Base, qa_agent
+result["import_s"] = time.perf_counter() - start
+result["rss_after_import_mb"] = process.memory_info().rss / 2**20
+
+try:
+    import embedding_service
+except ImportError:
+    embedding_service = None
+if embedding_service is not None:
+    start = time.perf_counter()
+    embedding_service.encode(["warm up"])
+    result["first_use_s"] = time.perf_counter() - start
+    result["rss_after_first_use_mb"] = process.memory_info().rss / 2**20
+
+print("RESULT " + json.dumps(result))
+"""
+
+
+def measure(tree: str) -> dict:
+    completed = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=tree, capture_output=True, text=True, check=True
+    )
+    line = next(line for line in completed.stdout.splitlines() if line.startswith("RESULT "))
+    return json.loads(line[len("RESULT "):])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tree", default=REPO_ROOT, help="checkout to measure (default: this one)")
+    parser.add_argument("--runs", type=int, default=3, help="fresh processes to average over")
+    args = parser.parse_args()
+
+    runs = [measure(os.path.abspath(args.tree)) for _ in range(args.runs)]
+    print(f"Tree: {os.path.abspath(args.tree)} ({args.runs} runs)\n")
+    for key in runs[0]:
+        values = [run[key] for run in runs]
+        unit = "s" if key.endswith("_s") else "MB"
+        print(f"{key:<26} {sum(values) / len(values):10.2f} {unit}")
+
+
+if __name__ == "__main__":
+    main()
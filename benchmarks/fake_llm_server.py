@@ -0,0 +1,146 @@
+# file: benchmarks/fake_llm_server.py
+"""
+A local stand-in for an OpenAI-style chat-completion endpoint, the API
+`InferenceClient.chat_completion` talks to. Answers are generated
+deterministically from the question, one word per token, after a
+configurable first-token delay and with a fixed delay between tokens.
+Supports both plain and streamed (`"stream": true`, server-sent events)
+responses, and can fail every request with a given HTTP status instead.
+
+Use it as a context manager in benchmarks, or run it on its own and point
+the apps at it:
+
+    python benchmarks/fake_llm_server.py --port 8008
+    LLM_BASE_URL=http://127.0.0.1:8008 HF_API_TOKEN=unused python app_gradio.py
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_answer(messages, tokens: int) -> list:
+    """
+    The answer as a list of token strings: the question's words, repeated until `tokens` long.
+    """
+    question = messages[-1]["content"].rsplit("QUESTION:", 1)[-1].split() if messages else []
+    words = question or ["answer"]
+    pieces = [words[i % len(words)] for i in range(tokens)]
+    return [piece if i == 0 else " " + piece for i, piece in enumerate(pieces)]
+
+
+class FakeLLMServer:
+    """
+    Serves the fake chat-completion API on 127.0.0.1 from a background thread.
+    `base_url` is what to pass to `InferenceClient(base_url=...)`. With
+    `error_status` (e.g. 500), every request fails with that status.
+    """
+
+    def __init__(self, tokens: int = 64, first_token_latency: float = 0.3, token_latency: float = 0.02,
+                 port: int = 0, error_status: int = None):
+        self.tokens = tokens
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.port = port
+        self.error_status = error_status
+        self.requests = 0
+        self.server = None
+        self.thread = None
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                fake.requests += 1
+                if fake.error_status is not None:
+                    self.send_error(fake.error_status)
+                    return
+                tokens = make_answer(request.get("messages", []), min(fake.tokens, request.get("max_tokens") or fake.tokens))
+                envelope = {
+                    "id": f"fake-{fake.requests}",
+                    "created": int(time.time()),
+                    "model": request.get("model") or "fake-model",
+                    "system_fingerprint": "fake",
+                }
+                time.sleep(fake.first_token_latency)
+
+                if not request.get("stream"):
+                    time.sleep(fake.token_latency * (len(tokens) - 1))
+                    body = json.dumps({**envelope, "object": "chat.completion", "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "".join(tokens)},
+                        "finish_reason": "stop",
+                        "logprobs": None,
+                    }], "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)}})
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body.encode("utf-8"))
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                for i, token in enumerate(tokens):
+                    if i:
+                        time.sleep(fake.token_latency)
+                    self._send_event({**envelope, "object": "chat.completion.chunk", "choices": [{
+                        "index": 0,
+                        "delta": {"role": "assistant", "content": token},
+                        "finish_reason": "stop" if i == len(tokens) - 1 else None,
+                        "logprobs": None,
+                    }]})
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def _send_event(self, payload):
+                self.wfile.write(b"data: " + json.dumps(payload).encode("utf-8") + b"\n\n")
+                self.wfile.flush()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", self.port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8008)
+    parser.add_argument("--tokens", type=int, default=64, help="tokens per answer")
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.02, help="seconds between tokens")
+    args = parser.parse_args()
+
+    with FakeLLMServer(args.tokens, args.first_token_latency, args.token_latency, args.port) as server:
+        print(f"Fake chat-completion server on {server.base_url} (Ctrl+C to stop)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# file: benchmarks/fixture_site.py
+"""
+A small local stand-in website for benchmarks. Pages are generated on the
+fly, link to each other, carry an ETag for conditional requests, and can be
+served with an artificial delay to mimic network latency. Page count, link
+fan-out, page size and the share of boilerplate text repeated on every
+page are configurable.
+"""
+import hashlib
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "company product customer platform service pricing team mission cloud "
+    "data security support partner solution enterprise analytics growth "
+    "market industry integration developer feature release global office"
+).split()
+
+
+def _paragraph(rng: random.Random) -> str:
+    return "<p>" + " ".join(rng.choice(WORDS) for _ in range(60)) + ".</p>"
+
+
+def make_page(page_id: int, page_count: int, fan_out: int = 8, paragraphs: int = 6,
+              boilerplate_ratio: float = 0.0) -> str:
+    """
+    Builds a deterministic HTML page with `paragraphs` paragraphs of text
+    (about 60 words each) and `fan_out` links to other pages of the site.
+    A `boilerplate_ratio` share of the paragraphs is the same on every page,
+    like the company blurbs and calls to action of real sites.
+    """
+    rng = random.Random(page_id)
+    shared = round(paragraphs * boilerplate_ratio)
+    boilerplate_rng = random.Random(-1)
+    body = "\n".join(
+        [_paragraph(rng) for _ in range(paragraphs - shared)]
+        + [_paragraph(boilerplate_rng) for _ in range(shared)]
+    )
+    links = "\n".join(
+        f'<li><a href="/page/{rng.randrange(page_count)}">Page link</a></li>'
+        for _ in range(fan_out)
+    )
+    return (
+        f"<html><head><title>Page {page_id}</title></head><body>"
+        f"<nav><ul>{links}</ul></nav>"
+        f"<article><h1>Page {page_id}</h1>\n{body}</article>"
+        "</body></html>"
+    )
+
+
+class FixtureSite:
+    """
+    Serves a generated site on 127.0.0.1 from a background thread.
+    Use as a context manager; `base_url` points at the first page.
+    """
+
+    def __init__(self, page_count: int = 100, fan_out: int = 8, latency: float = 0.05,
+                 paragraphs: int = 6, boilerplate_ratio: float = 0.0):
+        self.page_count = page_count
+        self.fan_out = fan_out
+        self.latency = latency
+        self.paragraphs = paragraphs
+        self.boilerplate_ratio = boilerplate_ratio
+        self.server = None
+        self.thread = None
+
+    def _handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                time.sleep(site.latency)
+                try:
+                    page_id = int(self.path.rstrip("/").rsplit("/", 1)[-1])
+                except ValueError:
+                    page_id = 0
+                if not 0 <= page_id < site.page_count:
+                    self.send_error(404)
+                    return
+                body = make_page(page_id, site.page_count, site.fan_out, site.paragraphs,
+                                 site.boilerplate_ratio).encode("utf-8")
+                etag = '"' + hashlib.md5(body).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/page/0"
+
+    def __enter__(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
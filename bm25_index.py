@@ -0,0 +1,133 @@
+# file: bm25_index.py
+"""
+Persistent BM25 keyword index over the chunks of each knowledge base,
+kept next to ChromaDB and updated at ingest time. Dense MiniLM retrieval
+is good at paraphrases but often misses exact terms (product names, SKUs,
+pricing tiers); BM25 catches those, and `qa_agent` fuses both rankings.
+
+The index is an inverted index in SQLite: one posting per (term, chunk)
+with the term frequency, plus each chunk's length, scored with Okapi BM25
+at query time. Pure Python, no extra dependencies.
+"""
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+
+BM25_INDEX_PATH = "./bm25_index.sqlite"
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN = re.compile(r"\w+")
+# Words so common in web copy that their postings would only cost time.
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how i in is it its of on or our that the their this "
+    "to was we what when where which who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> list:
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    BM25 postings for any number of collections in one SQLite file.
+    Mirror every write to a ChromaDB collection with `add` / `delete` /
+    `drop_collection`, and query with `search`.
+    """
+
+    def __init__(self, path: str = BM25_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                collection TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                length INTEGER NOT NULL,
+                PRIMARY KEY (collection, chunk_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS postings (
+                collection TEXT NOT NULL,
+                term TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (collection, term, chunk_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_by_chunk ON postings (collection, chunk_id);
+            """
+        )
+        self._db.commit()
+
+    def count(self, collection_name: str) -> int:
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM chunks WHERE collection = ?", (collection_name,)
+            ).fetchone()[0]
+
+    def add(self, collection_name: str, ids: list, documents: list):
+        """
+        Indexes chunks, replacing any earlier version of the same ids.
+        """
+        chunk_rows, posting_rows = [], []
+        for chunk_id, document in zip(ids, documents):
+            terms = Counter(tokenize(document))
+            chunk_rows.append((collection_name, chunk_id, sum(terms.values())))
+            posting_rows.extend((collection_name, term, chunk_id, tf) for term, tf in terms.items())
+        with self._lock, self._db:
+            self._delete(collection_name, ids)
+            self._db.executemany("INSERT INTO chunks VALUES (?, ?, ?)", chunk_rows)
+            self._db.executemany("INSERT INTO postings VALUES (?, ?, ?, ?)", posting_rows)
+
+    def _delete(self, collection_name: str, ids: list):
+        rows = [(collection_name, chunk_id) for chunk_id in ids]
+        self._db.executemany("DELETE FROM postings WHERE collection = ? AND chunk_id = ?", rows)
+        self._db.executemany("DELETE FROM chunks WHERE collection = ? AND chunk_id = ?", rows)
+
+    def delete(self, collection_name: str, ids: list):
+        with self._lock, self._db:
+            self._delete(collection_name, ids)
+
+    def drop_collection(self, collection_name: str):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM postings WHERE collection = ?", (collection_name,))
+            self._db.execute("DELETE FROM chunks WHERE collection = ?", (collection_name,))
+
+    def search(self, collection_name: str, query: str, n_results: int = 10) -> list:
+        """
+        Returns up to `n_results` `(chunk_id, score)` pairs, best first.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            chunk_count, average_length = self._db.execute(
+                "SELECT COUNT(*), AVG(length) FROM chunks WHERE collection = ?", (collection_name,)
+            ).fetchone()
+            # Chunks made only of stopwords or punctuation have no terms to match.
+            if not chunk_count or not average_length:
+                return []
+            scores = Counter()
+            for term in terms:
+                postings = self._db.execute(
+                    """
+                    SELECT p.chunk_id, p.tf, c.length FROM postings p
+                    JOIN chunks c ON c.collection = p.collection AND c.chunk_id = p.chunk_id
+                    WHERE p.collection = ? AND p.term = ?
+                    """,
+                    (collection_name, term),
+                ).fetchall()
+                if not postings:
+                    continue
+                idf = math.log(1 + (chunk_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf, length in postings:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                    scores[chunk_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores.most_common(n_results)
+
+    def close(self):
+        self._db.close()
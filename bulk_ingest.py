@@ -0,0 +1,240 @@
+# file: bulk_ingest.py
+"""
+Headless bulk ingestion: builds (or incrementally updates) knowledge bases
+for every site in a file of URLs, one URL per line.
+
+Sites flow through two stages with separate concurrency limits:
+
+1. crawl: up to --crawl-workers sites are crawled at once
+   (`crawl_website_changes`, so unchanged pages are not refetched);
+2. embed: up to --embed-workers crawled sites are chunked, embedded and
+   stored at once (`create_and_store_embeddings`). A small hand-off queue
+   between the stages stops crawling from running far ahead of embedding.
+
+Every finished site appends one JSON line of stats to the report,
+including the time spent per pipeline stage (fetch, parse, extract, chunk,
+embed, upsert). The report doubles as the checkpoint: run the same command
+again after a crash and sites already reported as "ok" are skipped.
+
+--archive keeps every fetched page in a page archive (page_archive.py);
+--replay rebuilds the knowledge bases from such an archive without touching
+the network, e.g. after changing the extraction or chunking settings.
+
+    python bulk_ingest.py sites.txt --report ingest_report.jsonl --max-pages 30 --archive crawl_archive
+    python bulk_ingest.py sites.txt --report replay_report.jsonl --max-pages 30 --replay crawl_archive
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+import metrics
+from crawler import ARCHIVE_DIR, crawl_website_changes
+from jobs import company_name_for
+from knowledge_Base import create_and_store_embeddings, knowledge_base_exists
+
+DEFAULT_REPORT_PATH = "./ingest_report.jsonl"
+
+
+def read_urls(path: str) -> list:
+    urls = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            url = line.strip()
+            if url and not url.startswith("#"):
+                urls.append(url if "://" in url else "https://" + url)
+    return list(dict.fromkeys(urls))
+
+
+def read_checkpoint(report_path: str) -> set:
+    """
+    URLs the report already lists as successfully ingested.
+    """
+    done = set()
+    if not os.path.exists(report_path):
+        return done
+    with open(report_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by a crash
+            if record.get("status") == "ok":
+                done.add(record["url"])
+    return done
+
+
+class ReportWriter:
+    """
+    Appends one JSON line per site and flushes it to disk straight away, so
+    the report is an accurate checkpoint at any moment.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, record: dict):
+        with self._lock:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def crawl_site(url: str, max_pages: int, site_trace: metrics.Trace, archive_dir: str = None,
+               replay_dir: str = None) -> tuple:
+    record = {"url": url, "company": company_name_for(url)}
+    start = time.perf_counter()
+    try:
+        if not record["company"]:
+            raise ValueError("not a full URL")
+        # A replay rebuilds from scratch: the archived pages are the same, the settings aren't.
+        full = replay_dir is not None or not knowledge_base_exists(record["company"])
+        with site_trace.activate():
+            delta = crawl_website_changes(url, max_pages=max_pages, full=full,
+                                          archive_dir=archive_dir, replay_dir=replay_dir)
+        if not delta.has_content:
+            raise ValueError("no content fetched; the site may block crawlers or require JavaScript")
+    except Exception as e:
+        record.update(status="error", stage="crawl", error=repr(e))
+        delta = None
+    record["crawl_seconds"] = round(time.perf_counter() - start, 3)
+    if delta is not None:
+        pages = {**delta.added, **delta.changed}
+        record.update(
+            pages=len(delta.visited_urls),
+            pages_added=len(delta.added),
+            pages_changed=len(delta.changed),
+            pages_deleted=len(delta.deleted),
+            pages_unchanged=len(delta.unchanged),
+            text_bytes=sum(len(text.encode("utf-8")) for text in pages.values()),
+        )
+    return record, delta
+
+
+def embed_site(record: dict, delta, site_trace: metrics.Trace, profiler: str = None) -> dict:
+    start = time.perf_counter()
+    embedded = {"chunks": 0}
+
+    def progress(pages, chunks):
+        embedded["chunks"] = chunks
+
+    try:
+        with site_trace.activate(), metrics.profile(f"build-{record['company']}", profiler):
+            create_and_store_embeddings(record["company"], delta, progress=progress)
+        record["status"] = "ok"
+    except Exception as e:
+        record.update(status="error", stage="embed", error=repr(e))
+    record["chunks"] = embedded["chunks"]
+    record["embed_seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def run(urls: list, report_path: str = DEFAULT_REPORT_PATH, max_pages: int = 20,
+        crawl_workers: int = 4, embed_workers: int = 1, trace_dir: str = None, profiler: str = None,
+        archive_dir: str = None, replay_dir: str = None) -> dict:
+    """
+    Ingests `urls`, skipping those the report already lists as done.
+    Returns a summary of how many sites succeeded, failed or were skipped.
+    With `trace_dir`, each site's full trace is written there as JSON;
+    `profiler` ("cprofile" or "pyinstrument") profiles each site's embedding stage.
+    `archive_dir` archives the fetched pages; `replay_dir` reads them from an archive instead.
+    """
+    done = read_checkpoint(report_path)
+    pending = queue.Queue()
+    for url in urls:
+        if url not in done:
+            pending.put(url)
+    summary = {"ok": 0, "error": 0, "skipped": len(urls) - pending.qsize()}
+    print(f"Bulk ingest: {pending.qsize()} sites to process, {summary['skipped']} already done.")
+
+    crawled = queue.Queue(maxsize=max(1, embed_workers) * 2)
+    report = ReportWriter(report_path)
+    summary_lock = threading.Lock()
+
+    def finish(record, site_trace):
+        record["stages"] = site_trace.summary()
+        site_trace.attributes["status"] = record["status"]
+        site_trace.finish(trace_dir)
+        metrics.count("builds_total", status=record["status"])
+        record["total_seconds"] = round(
+            record.get("crawl_seconds", 0) + record.get("queue_seconds", 0) + record.get("embed_seconds", 0), 3
+        )
+        record["finished_at"] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        report.write(record)
+        with summary_lock:
+            summary[record["status"]] += 1
+            finished = summary["ok"] + summary["error"]
+        print(f"[{finished}/{len(urls) - summary['skipped']}] {record['url']}: {record['status']}"
+              f"{' (' + record['error'] + ')' if record['status'] == 'error' else ''}")
+
+    def crawl_worker():
+        while True:
+            try:
+                url = pending.get_nowait()
+            except queue.Empty:
+                return
+            site_trace = metrics.Trace("build", url=url)
+            record, delta = crawl_site(url, max_pages, site_trace, archive_dir, replay_dir)
+            if delta is None:
+                finish(record, site_trace)
+            else:
+                crawled.put((record, delta, site_trace, time.perf_counter()))
+
+    def embed_worker():
+        while True:
+            item = crawled.get()
+            if item is None:
+                return
+            record, delta, site_trace, queued_at = item
+            record["queue_seconds"] = round(time.perf_counter() - queued_at, 3)
+            finish(embed_site(record, delta, site_trace, profiler), site_trace)
+
+    crawlers = [threading.Thread(target=crawl_worker, daemon=True) for _ in range(max(1, crawl_workers))]
+    embedders = [threading.Thread(target=embed_worker, daemon=True) for _ in range(max(1, embed_workers))]
+    for thread in crawlers + embedders:
+        thread.start()
+    try:
+        for thread in crawlers:
+            thread.join()
+        for _ in embedders:
+            crawled.put(None)
+        for thread in embedders:
+            thread.join()
+    finally:
+        report.close()
+
+    print(f"Bulk ingest finished: {summary['ok']} ok, {summary['error']} failed, {summary['skipped']} skipped.")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("url_file", help="text file with one site URL per line (# starts a comment)")
+    parser.add_argument("--report", default=DEFAULT_REPORT_PATH, help="JSONL stats report, also used to resume")
+    parser.add_argument("--max-pages", type=int, default=20, help="pages to crawl per site")
+    parser.add_argument("--crawl-workers", type=int, default=4, help="sites crawled at the same time")
+    parser.add_argument("--embed-workers", type=int, default=1, help="sites embedded and stored at the same time")
+    parser.add_argument("--trace-dir", default=metrics.TRACE_DIR, help="write a JSON trace of each site here")
+    parser.add_argument("--profile", choices=["cprofile", "pyinstrument"], default=metrics.PROFILER,
+                        help="profile each site's embedding stage into ./profiles")
+    parser.add_argument("--metrics-file", help="write the run's metrics here in the Prometheus text format")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--archive", default=ARCHIVE_DIR, help="archive every fetched page in this directory")
+    source.add_argument("--replay", help="read the pages from the archive in this directory instead of fetching them")
+    args = parser.parse_args()
+
+    run(read_urls(args.url_file), args.report, args.max_pages, args.crawl_workers, args.embed_workers,
+        args.trace_dir, args.profile, args.archive, args.replay)
+    if args.metrics_file:
+        with open(args.metrics_file, "w", encoding="utf-8") as f:
+            f.write(metrics.prometheus_text())
+
+
+if __name__ == "__main__":
+    main()
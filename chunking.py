@@ -0,0 +1,159 @@
+# file: chunking.py
+"""
+Structure-aware chunking of page text. Pages come from page_parser.py with
+one block per line (headings marked with '#', list items with "- ", table
+rows with "| ", paragraphs), and are chunked one page at a time:
+
+1. blocks are packed into chunks of at most CHUNK_TOKENS tokens, counted
+   with the embedding model's own tokenizer (the model truncates its input
+   at 256 tokens, so chunks sized in characters were either wasted or cut);
+2. a heading starts a new chunk, unless the chunk so far is shorter than
+   CHUNK_MIN_TOKENS, so sections stay together without leaving tiny chunks;
+3. a block longer than a chunk is split between sentences (and, for a
+   run-on sentence, between words); lists and tables split between items;
+4. chunks don't overlap, and each records the path of headings it sits
+   under ("Pricing > Enterprise").
+
+Plain text without any marks is chunked by its lines, as paragraphs.
+"""
+import os
+import re
+from dataclasses import dataclass, field
+
+import embedding_service
+from context_builder import load_token_counter
+
+CHUNK_TOKENS = int(os.environ.get("CHUNK_TOKENS", "200"))
+CHUNK_MIN_TOKENS = CHUNK_TOKENS // 4
+HEADING_SEPARATOR = " > "
+
+_HEADING = re.compile(r"^(#{1,6}) (.+)$")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+@dataclass
+class Chunk:
+    text: str
+    headings: list = field(default_factory=list)
+
+    @property
+    def heading_path(self) -> str:
+        return HEADING_SEPARATOR.join(self.headings)
+
+
+def get_chunk_token_counter():
+    """
+    Counts tokens with the embedding model's tokenizer (an estimate when it
+    can't be loaded, e.g. offline).
+    """
+    name = embedding_service.EMBEDDING_MODEL_NAME
+    if "/" not in name and not os.path.isdir(name):
+        # sentence-transformers resolves bare model names the same way.
+        name = "sentence-transformers/" + name
+    return load_token_counter(name)
+
+
+def _split_long_block(text: str, tokens: int, count_tokens, max_tokens: int) -> list:
+    """
+    Splits one block of `tokens` tokens into pieces of at most `max_tokens`,
+    between sentences where possible. Sentences are sized from the block's
+    tokens per character, and only the packed pieces are counted exactly.
+    Returns [(piece, tokens)].
+    """
+    tokens_per_char = tokens / max(1, len(text))
+    units = []
+    for sentence in _SENTENCE_END.split(text):
+        estimate = len(sentence) * tokens_per_char
+        if estimate > max_tokens:
+            # A run-on sentence: cut it into runs of words of about the right size.
+            words = sentence.split()
+            step = max(1, int(len(words) * max_tokens / estimate))
+            units.extend(" ".join(words[i:i + step]) for i in range(0, len(words), step))
+        else:
+            units.append(sentence)
+
+    pieces = []
+    for unit in units:
+        if pieces and (len(pieces[-1]) + 1 + len(unit)) * tokens_per_char <= max_tokens:
+            pieces[-1] += " " + unit
+        else:
+            pieces.append(unit)
+
+    counted = []
+    for piece in pieces:
+        piece_tokens = count_tokens(piece)
+        if piece_tokens > max_tokens and " " in piece:
+            # The estimate was off for this stretch; split it again with its own rate.
+            counted.extend(_split_long_block(piece, piece_tokens, count_tokens, max_tokens))
+        else:
+            counted.append((piece, piece_tokens))
+    return counted
+
+
+def chunk_text(text: str, count_tokens=None, max_tokens: int = CHUNK_TOKENS,
+               min_tokens: int = CHUNK_MIN_TOKENS) -> list:
+    """
+    Splits one page's structured text into a list of `Chunk`s of at most
+    `max_tokens` tokens as counted by `count_tokens` (by default the
+    embedding model's tokenizer).
+    """
+    count_tokens = count_tokens or get_chunk_token_counter()
+    chunks = []
+    path = []  # [(level, heading)] of the current section
+    lines = []  # [(is_heading, text, tokens)] of the chunk being built
+    state = {"tokens": 0, "headings": None}
+
+    def flush(carry_headings: bool = False):
+        # A chunk never ends with its section's heading: trailing headings move to the next chunk.
+        carried = []
+        while carry_headings and lines and lines[-1][0]:
+            carried.insert(0, lines.pop())
+        if any(not is_heading for is_heading, _, _ in lines):
+            chunks.append(Chunk("\n".join(line for _, line, _ in lines), state["headings"] or []))
+        lines[:] = carried
+        state["tokens"] = sum(tokens + 1 for _, _, tokens in carried)
+        state["headings"] = None
+
+    def append(is_heading: bool, line: str, tokens: int):
+        # Lines are joined with a newline, about one token each.
+        if lines and state["tokens"] + tokens + 1 > max_tokens:
+            flush(carry_headings=True)
+        if not is_heading and state["headings"] is None:
+            state["headings"] = [heading for _, heading in path]
+        lines.append((is_heading, line, tokens))
+        state["tokens"] += tokens + 1
+
+    def heading_tokens() -> int:
+        # Tokens of the headings ending the chunk, which stay with the block that follows them.
+        taken = 0
+        for is_heading, _, tokens in reversed(lines):
+            if not is_heading:
+                break
+            taken += tokens + 1
+        return taken
+
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if not line:
+            continue
+        heading = _HEADING.match(line)
+        if heading:
+            level, title = len(heading.group(1)), heading.group(2).strip()
+            if state["tokens"] >= min_tokens and any(not is_heading for is_heading, _, _ in lines):
+                flush()
+            while path and path[-1][0] >= level:
+                path.pop()
+            path.append((level, title))
+            append(True, title, count_tokens(title))
+            continue
+        tokens = count_tokens(line)
+        limit = max(max_tokens - heading_tokens() - 1, min_tokens)
+        if tokens <= limit:
+            append(False, line, tokens)
+            continue
+        # Keep a list item's or table row's marker on each of its pieces.
+        marker = line[:2] if line[:2] in ("- ", "| ") else ""
+        for piece, piece_tokens in _split_long_block(line[len(marker):], tokens, count_tokens, limit - 2):
+            append(False, marker + piece, piece_tokens + (2 if marker else 0))
+    flush()
+    return chunks
@@ -0,0 +1,513 @@
+# file: collection_registry.py
+"""
+Book-keeping for the many per-company collections that share one ChromaDB
+directory, so the cost of each tenant is visible and bounded:
+
+1. stats: a SQLite registry records, per collection, its chunks, embedding
+   size, the chunks deleted since its vector index was last rebuilt, its
+   last build, its last query and how often it was queried. Builds report
+   from `knowledge_Base`, queries from `qa_agent` (counted in memory and
+   written every FLUSH_INTERVAL seconds, so the query path stays cheap);
+2. memory: with CHROMA_MEMORY_LIMIT_MB set, the ChromaDB client keeps at
+   most that much of vector indexes loaded and evicts the least recently
+   used collection first (see `embedding_service.get_chroma_client`);
+3. compaction: deleting from a vector index only marks entries as deleted,
+   so collections that are rebuilt often keep growing. Once deleted entries
+   reach COMPACT_TOMBSTONE_RATIO of the live ones, the collection is copied
+   into a fresh index after its build (or by `--compact` below, which
+   leaves collections with a build in progress alone);
+4. expiry: collections neither built nor queried for COLLECTION_TTL_DAYS
+   days can be deleted (`expire_collections`, or `--expire-days` below),
+   together with the crawl state (and archived pages) of the site they
+   were built from, so a later build starts over;
+5. pre-warming: on app start, the PREWARM_COLLECTIONS most queried
+   collections are loaded in the background (within the memory limit), so
+   their first question doesn't pay for reading the index from disk.
+
+    python collection_registry.py                    # stats of every collection
+    python collection_registry.py --expire-days 90 --compact
+"""
+import argparse
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+import embedding_service
+import metrics
+import page_archive
+from crawl_state import CrawlStateStore
+from embedding_service import get_bm25_index, get_chroma_client
+from query_cache import answer_cache, collection_version, retrieval_cache
+
+COLLECTION_REGISTRY_PATH = "./collections.sqlite"
+# Collections unused for this many days are deleted by `expire_collections`. 0 keeps them forever.
+COLLECTION_TTL_DAYS = float(os.environ.get("COLLECTION_TTL_DAYS", "0"))
+# Most-queried collections loaded when an app starts, among those queried in the last PREWARM_WINDOW_DAYS.
+PREWARM_COLLECTIONS = int(os.environ.get("PREWARM_COLLECTIONS", "8"))
+PREWARM_WINDOW_DAYS = 7
+# Rebuild a collection's index once it holds this many deleted entries per live chunk.
+COMPACT_TOMBSTONE_RATIO = 0.5
+COMPACT_BATCH_SIZE = 1000
+# Names of the temporary collections used while compacting.
+COMPACT_PREFIX = "compacting-"
+RETIRED_PREFIX = "retired-"
+# Longest wait, in seconds, for a lookup that comes while a compaction swaps a collection's index.
+SWAP_WAIT = 2.0
+# Seconds between writes of the query counters.
+FLUSH_INTERVAL = 5.0
+
+_registry = None
+_registry_lock = threading.Lock()
+_prewarm_thread = None
+
+
+def collection_name_for(company_name: str) -> str:
+    """
+    The ChromaDB collection that holds a company's knowledge base.
+    """
+    return company_name.lower().replace(" ", "_")
+
+
+@dataclass
+class CollectionStats:
+    name: str
+    chunks: int = 0
+    dimension: int = None
+    deleted_chunks: int = 0  # entries the vector index still holds for deleted chunks
+    last_build: float = None
+    last_query: float = None
+    queries: int = 0
+    created: float = 0.0
+    site: str = None  # the site crawled into it, for builds from a crawl
+
+    @property
+    def vector_bytes(self) -> int:
+        # float32 vectors, deleted entries included: the bulk of a loaded index.
+        return (self.chunks + self.deleted_chunks) * (self.dimension or 0) * 4
+
+    @property
+    def last_used(self) -> float:
+        return max(self.last_build or 0.0, self.last_query or 0.0, self.created)
+
+
+class CollectionRegistry:
+    """
+    SQLite-backed `CollectionStats` per collection, shared by every process
+    on the machine. Query and delete counts are buffered in memory and
+    added to the stored values by `flush`.
+    """
+
+    def __init__(self, path: str = COLLECTION_REGISTRY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS collections (
+                name TEXT PRIMARY KEY,
+                chunks INTEGER NOT NULL DEFAULT 0,
+                dimension INTEGER,
+                deleted_chunks INTEGER NOT NULL DEFAULT 0,
+                last_build REAL,
+                last_query REAL,
+                queries INTEGER NOT NULL DEFAULT 0,
+                created REAL NOT NULL,
+                site TEXT
+            )
+            """
+        )
+        if "site" not in {row[1] for row in self._db.execute("PRAGMA table_info(collections)")}:
+            # Registries written before builds recorded their site.
+            self._db.execute("ALTER TABLE collections ADD COLUMN site TEXT")
+        self._db.commit()
+        self._pending_queries = {}  # name -> (queries, last query)
+        self._pending_deletes = {}  # name -> deleted chunks
+        self._flushed_at = time.monotonic()
+
+    def record_query(self, name: str):
+        now = time.time()
+        with self._lock:
+            queries, _ = self._pending_queries.get(name, (0, now))
+            self._pending_queries[name] = (queries + 1, now)
+            due = time.monotonic() - self._flushed_at >= FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def record_deletes(self, name: str, count: int):
+        with self._lock:
+            self._pending_deletes[name] = self._pending_deletes.get(name, 0) + count
+
+    def record_build(self, name: str, chunks: int, dimension: int = None, full: bool = False, site: str = None):
+        """
+        Records a finished build, of `site` if it was crawled. A full build
+        started from an empty collection, so its index holds no deleted entries.
+        """
+        now = time.time()
+        with self._lock:
+            if full:
+                self._pending_deletes.pop(name, None)
+            with self._db:
+                self._db.execute("INSERT OR IGNORE INTO collections (name, created) VALUES (?, ?)", (name, now))
+                self._db.execute(
+                    "UPDATE collections SET chunks = ?, dimension = COALESCE(?, dimension), last_build = ?, "
+                    "deleted_chunks = CASE WHEN ? THEN 0 ELSE deleted_chunks END, site = COALESCE(?, site) "
+                    "WHERE name = ?",
+                    (chunks, dimension, now, full, site, name),
+                )
+        self.flush()
+
+    def record_compaction(self, name: str, chunks: int):
+        with self._lock:
+            self._pending_deletes.pop(name, None)
+            with self._db:
+                self._db.execute("UPDATE collections SET chunks = ?, deleted_chunks = 0 WHERE name = ?", (chunks, name))
+
+    def flush(self):
+        """
+        Adds the buffered query and delete counts to the stored stats.
+        """
+        with self._lock:
+            queries, deletes = self._pending_queries, self._pending_deletes
+            self._pending_queries, self._pending_deletes = {}, {}
+            self._flushed_at = time.monotonic()
+            if not queries and not deletes:
+                return
+            now = time.time()
+            with self._db:
+                self._db.executemany("INSERT OR IGNORE INTO collections (name, created) VALUES (?, ?)",
+                                     [(name, now) for name in set(queries) | set(deletes)])
+                self._db.executemany(
+                    "UPDATE collections SET queries = queries + ?, last_query = MAX(COALESCE(last_query, 0), ?) "
+                    "WHERE name = ?",
+                    [(count, last_query, name) for name, (count, last_query) in queries.items()],
+                )
+                self._db.executemany(
+                    "UPDATE collections SET deleted_chunks = deleted_chunks + ? WHERE name = ?",
+                    [(count, name) for name, count in deletes.items()],
+                )
+
+    def get(self, name: str) -> CollectionStats:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT name, chunks, dimension, deleted_chunks, last_build, last_query, queries, created, site "
+                "FROM collections WHERE name = ?", (name,)
+            ).fetchone()
+        return CollectionStats(*row) if row else None
+
+    def stats(self) -> list:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT name, chunks, dimension, deleted_chunks, last_build, last_query, queries, created, site "
+                "FROM collections ORDER BY name"
+            ).fetchall()
+        return [CollectionStats(*row) for row in rows]
+
+    def sync(self, collections: dict):
+        """
+        Matches the registry to the collections that exist (`{name: chunk
+        count}`): ones built before the registry are added, as if created
+        now, and ones deleted elsewhere are dropped.
+        """
+        now = time.time()
+        with self._lock, self._db:
+            known = {name for (name,) in self._db.execute("SELECT name FROM collections")}
+            self._db.executemany("INSERT INTO collections (name, chunks, created) VALUES (?, ?, ?)",
+                                 [(name, chunks, now) for name, chunks in collections.items() if name not in known])
+            self._db.executemany("DELETE FROM collections WHERE name = ?",
+                                 [(name,) for name in known - set(collections)])
+
+    def forget(self, name: str):
+        with self._lock, self._db:
+            self._pending_queries.pop(name, None)
+            self._pending_deletes.pop(name, None)
+            self._db.execute("DELETE FROM collections WHERE name = ?", (name,))
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+
+def get_registry() -> CollectionRegistry:
+    """
+    The process-wide registry, opened on first use. Buffered counts are written when the process exits.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = CollectionRegistry()
+            atexit.register(_registry.flush)
+        return _registry
+
+
+def _dimension(collection):
+    embeddings = collection.get(limit=1, include=["embeddings"])["embeddings"]
+    return len(embeddings[0]) if embeddings is not None and len(embeddings) else None
+
+
+def _is_staging(name: str) -> bool:
+    return name.startswith(COMPACT_PREFIX) or name.startswith(RETIRED_PREFIX)
+
+
+def _staging_suffix(name: str) -> str:
+    return hashlib.sha1(name.encode("utf-8")).hexdigest()[:16]
+
+
+def get_collection(name: str):
+    """
+    A knowledge base's ChromaDB collection. While a compaction swaps a fresh
+    index in, the name is unused for a moment; a lookup then waits for the
+    swap (up to SWAP_WAIT seconds) instead of reporting the collection
+    missing. Raises ValueError if there is no such collection.
+    """
+    client = get_chroma_client()
+    deadline = time.monotonic() + SWAP_WAIT
+    while True:
+        try:
+            return client.get_collection(name=name)
+        except ValueError:
+            if time.monotonic() >= deadline:
+                raise
+            try:
+                # The original is renamed to this while the copy takes its name.
+                client.get_collection(name=RETIRED_PREFIX + _staging_suffix(name))
+            except ValueError:
+                raise ValueError(f"Collection {name} does not exist.") from None
+            time.sleep(0.01)
+
+
+def _tenant_collections() -> dict:
+    # {name: chunk count} of the knowledge bases, without collections a compaction left behind.
+    collections = {}
+    for collection in get_chroma_client().list_collections():
+        if not _is_staging(collection.name):
+            collections[collection.name] = collection.count()
+    return collections
+
+
+def _collections_being_built() -> set:
+    # Imported here: the job queue builds knowledge bases, which record their builds in this registry.
+    from jobs import active_company_names
+    return {collection_name_for(company_name) for company_name in active_company_names()}
+
+
+def compact_collection(collection):
+    """
+    Copies a collection's chunks, with their embeddings, into a fresh index
+    that holds no deleted entries and swaps it in under the same name.
+    Gives up (returning the old collection) if the collection is written
+    to meanwhile, so only run it when no build of the collection is under
+    way: a build that started with the old index would write to a deleted
+    collection. Returns the collection to use from now on.
+    """
+    client = get_chroma_client()
+    name = collection.name
+    suffix = _staging_suffix(name)
+    version = collection_version(collection)
+    with metrics.span("compact", collection=name) as compacting:
+        # 1. Start from an empty staging collection with the same settings.
+        for leftover in (COMPACT_PREFIX + suffix, RETIRED_PREFIX + suffix):
+            try:
+                client.delete_collection(name=leftover)
+            except ValueError:
+                pass
+        staging = client.create_collection(name=COMPACT_PREFIX + suffix, metadata=collection.metadata)
+
+        # 2. Copy the live chunks over in batches.
+        total = collection.count()
+        for offset in range(0, total, COMPACT_BATCH_SIZE):
+            batch = collection.get(include=["embeddings", "documents", "metadatas"],
+                                   limit=COMPACT_BATCH_SIZE, offset=offset)
+            if batch["ids"]:
+                staging.add(ids=batch["ids"], embeddings=batch["embeddings"],
+                            documents=batch["documents"], metadatas=batch["metadatas"])
+        compacting["chunks"] = total
+
+        # 3. A build that wrote meanwhile changed the version; keep the original then. Writes go to
+        #    the collection's id rather than its name, so the version is checked again once the
+        #    original is out of the way, for a write that landed just before it was moved.
+        unchanged = collection_version(client.get_collection(name=name)) == version and staging.count() == total
+        if unchanged:
+            collection.modify(name=RETIRED_PREFIX + suffix)
+            unchanged = collection_version(client.get_collection(name=RETIRED_PREFIX + suffix)) == version
+            if not unchanged:
+                collection.modify(name=name)
+        if not unchanged:
+            client.delete_collection(name=staging.name)
+            compacting["aborted"] = True
+            print(f"Compaction of '{name}' abandoned: the collection changed while it was copied.")
+            return collection
+
+        # 4. Swap the copy in (lookups meanwhile wait in `get_collection`). The chunk ids don't
+        #    change, so the BM25 index and cached retrievals stay valid.
+        staging.modify(name=name)
+        client.delete_collection(name=RETIRED_PREFIX + suffix)
+    get_registry().record_compaction(name, total)
+    print(f"Compacted '{name}': {total} chunks in a fresh index.")
+    return staging
+
+
+def compact_if_needed(collection, ratio: float = COMPACT_TOMBSTONE_RATIO):
+    """
+    Compacts `collection` if its index holds at least `ratio` deleted
+    entries per live chunk. Returns the collection to use from now on.
+    """
+    stats = get_registry().get(collection.name)
+    if stats is None or stats.deleted_chunks == 0 or stats.deleted_chunks < ratio * max(stats.chunks, 1):
+        return collection
+    return compact_collection(collection)
+
+
+def record_build(collection, full: bool = False, site: str = None):
+    """
+    Records a finished build of `collection` (from a crawl of `site`, if
+    given) and compacts it when deletions have left too many dead entries
+    in its index. Returns the collection to use from now on.
+    """
+    get_registry().record_build(collection.name, collection.count(), _dimension(collection), full, site)
+    return compact_if_needed(collection)
+
+
+def expire_collections(ttl_days: float = COLLECTION_TTL_DAYS, archive_dir: str = None) -> list:
+    """
+    Deletes the knowledge bases neither built nor queried for `ttl_days`
+    days (none when it is 0), with their keyword index and cached results.
+    The crawl state of the site each was built from goes too, so the next
+    build fetches every page again instead of finding them unchanged; with
+    `archive_dir`, so do the site's pages in that crawl archive. Returns
+    the names of the deleted collections. Collections with a queued or
+    running build are kept.
+    """
+    if ttl_days <= 0:
+        return []
+    registry = get_registry()
+    registry.flush()
+    registry.sync(_tenant_collections())
+    cutoff = time.time() - ttl_days * 86400
+    building = _collections_being_built()
+    expired = []
+    crawl_state = None
+    for stats in registry.stats():
+        if stats.last_used >= cutoff or stats.name in building:
+            continue
+        try:
+            get_chroma_client().delete_collection(name=stats.name)
+        except ValueError:
+            pass
+        get_bm25_index().drop_collection(stats.name)
+        retrieval_cache.invalidate(lambda key: key[0] == stats.name)
+        answer_cache.invalidate_collection(stats.name)
+        if stats.site:
+            crawl_state = crawl_state or CrawlStateStore()
+            crawl_state.delete_site(stats.site)
+            if archive_dir:
+                page_archive.forget_site(stats.site, archive_dir)
+        registry.forget(stats.name)
+        expired.append(stats.name)
+    if crawl_state is not None:
+        crawl_state.close()
+    print(f"Expired {len(expired)} collections unused for {ttl_days:g} days.")
+    return expired
+
+
+def prewarm(limit: int = PREWARM_COLLECTIONS) -> list:
+    """
+    Loads the indexes of the `limit` collections queried most in the last
+    PREWARM_WINDOW_DAYS days, and the embedding model if there are any,
+    stopping before the loaded indexes would exceed CHROMA_MEMORY_LIMIT_MB.
+    Returns their names.
+    """
+    if limit <= 0:
+        return []
+    registry = get_registry()
+    registry.flush()
+    since = time.time() - PREWARM_WINDOW_DAYS * 86400
+    candidates = sorted((stats for stats in registry.stats() if stats.queries and (stats.last_query or 0) >= since),
+                        key=lambda stats: (stats.queries, stats.last_query), reverse=True)
+    if not candidates:
+        # Nothing to warm: leave the embedding model unloaded until a question needs it.
+        return []
+    budget = embedding_service.CHROMA_MEMORY_LIMIT_MB * 2**20 or None
+    warmed, loaded_bytes = [], 0
+    query_embedding = None
+    with metrics.span("prewarm") as warming:
+        for stats in candidates[:limit]:
+            if budget is not None and loaded_bytes + stats.vector_bytes > budget:
+                break
+            try:
+                collection = get_chroma_client().get_collection(name=stats.name)
+            except ValueError:
+                continue
+            if collection.count():
+                if query_embedding is None:
+                    query_embedding = embedding_service.encode("warm up").tolist()
+                if stats.dimension in (None, len(query_embedding)):
+                    # Any query loads the whole index into memory.
+                    collection.query(query_embeddings=[query_embedding], n_results=1, include=[])
+            warmed.append(stats.name)
+            loaded_bytes += stats.vector_bytes
+        warming["collections"] = len(warmed)
+    print(f"Pre-warmed {len(warmed)} collections ({loaded_bytes / 2**20:.1f} MB of vectors).")
+    return warmed
+
+
+def start_prewarm(limit: int = PREWARM_COLLECTIONS):
+    """
+    Runs `prewarm` on a background thread, once per process, so an app can start serving straight away.
+    """
+    global _prewarm_thread
+    if limit <= 0:
+        return None
+    with _registry_lock:
+        if _prewarm_thread is None:
+            _prewarm_thread = threading.Thread(target=prewarm, args=(limit,), daemon=True)
+            _prewarm_thread.start()
+        return _prewarm_thread
+
+
+def _format_time(timestamp) -> str:
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp)) if timestamp else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--expire-days", type=float, default=COLLECTION_TTL_DAYS,
+                        help="delete collections neither built nor queried for this many days (0: never)")
+    parser.add_argument("--compact", action="store_true",
+                        help=f"compact collections with at least {COMPACT_TOMBSTONE_RATIO} deleted entries per chunk")
+    parser.add_argument("--prewarm", type=int, default=0, help="load the N most queried collections (for timing)")
+    args = parser.parse_args()
+
+    registry = get_registry()
+    registry.sync(_tenant_collections())
+    from crawler import ARCHIVE_DIR
+    expire_collections(args.expire_days, ARCHIVE_DIR)
+    if args.compact:
+        # Collections being built are compacted at the end of their build instead.
+        building = _collections_being_built()
+        for stats in registry.stats():
+            if stats.name in building:
+                print(f"Skipping '{stats.name}': a build is in progress.")
+                continue
+            compact_if_needed(get_chroma_client().get_collection(name=stats.name))
+    if args.prewarm:
+        start = time.perf_counter()
+        prewarm(args.prewarm)
+        print(f"Pre-warming took {time.perf_counter() - start:.2f}s.")
+
+    all_stats = registry.stats()
+    print(f"\n{'collection':<32} {'chunks':>8} {'vectors MB':>11} {'deleted':>8} "
+          f"{'last build':>17} {'last query':>17} {'queries':>8}")
+    for stats in all_stats:
+        print(f"{stats.name:<32} {stats.chunks:8d} {stats.vector_bytes / 2**20:11.1f} {stats.deleted_chunks:8d} "
+              f"{_format_time(stats.last_build):>17} {_format_time(stats.last_query):>17} {stats.queries:8d}")
+    print(f"\n{len(all_stats)} collections, {sum(s.chunks for s in all_stats)} chunks, "
+          f"{sum(s.vector_bytes for s in all_stats) / 2**20:.1f} MB of vectors.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# file: context_builder.py
+"""
+Packs retrieved chunks into the LLM prompt under a token budget, counted
+with the target model's own tokenizer. Prompt length drives LLM latency
+and cost, so instead of pasting every retrieved chunk we:
+
+1. take chunks in ranking order and keep each one only if the packed
+   context still fits in CONTEXT_TOKEN_BUDGET tokens,
+2. merge chunks that sit next to each other on the same page into one
+   passage, a line apart, dropping any text repeated between them
+   (chunks stored by the older character splitter overlap by up to 50
+   characters; structure-aware chunks don't overlap), and
+3. order passages by their best-ranked chunk.
+"""
+import os
+import threading
+from dataclasses import dataclass
+
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1500"))
+PASSAGE_SEPARATOR = "\n---\n"
+# Longest text two neighbouring chunks can share; the old character splitter's chunk_overlap was 50 characters.
+MAX_OVERLAP_CHARS = 200
+# Shorter matches are coincidences ("support" + "the team"), not repeated text.
+MIN_OVERLAP_CHARS = 20
+
+_tokenizer_lock = threading.Lock()
+_tokenizers = {}
+
+
+@dataclass(frozen=True)
+class RetrievedChunk:
+    """
+    A chunk as returned by retrieval: its text, the page it came from and
+    its position on that page (None when unknown).
+    """
+    text: str
+    source: str = None
+    position: int = None
+
+
+@dataclass
+class PackedContext:
+    text: str
+    tokens: int
+    chunks_used: int
+    chunks_dropped: int
+    passages: int
+
+
+def _approximate_token_count(text: str) -> int:
+    # About four characters per token for English with BPE tokenizers.
+    return max(1, len(text) // 4) if text else 0
+
+
+def get_token_counter(model_name: str):
+    """
+    Returns a function counting tokens with `model_name`'s tokenizer from the
+    Hugging Face Hub (LLM_TOKENIZER overrides the name), loaded once. Falls
+    back to an estimate if the tokenizer can't be downloaded.
+    """
+    return load_token_counter(os.environ.get("LLM_TOKENIZER", model_name))
+
+
+def load_token_counter(tokenizer_name: str):
+    """
+    Returns a function counting tokens with the tokenizer of `tokenizer_name`,
+    a Hub model or a local model directory with a tokenizer.json, loaded
+    once. Falls back to an estimate if the tokenizer can't be loaded.
+    """
+    with _tokenizer_lock:
+        if tokenizer_name not in _tokenizers:
+            try:
+                from tokenizers import Tokenizer
+
+                if os.path.isdir(tokenizer_name):
+                    tokenizer = Tokenizer.from_file(os.path.join(tokenizer_name, "tokenizer.json"))
+                else:
+                    tokenizer = Tokenizer.from_pretrained(tokenizer_name, token=os.environ.get("HF_API_TOKEN"))
+                _tokenizers[tokenizer_name] = lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+            except Exception as e:
+                print(f"Could not load the tokenizer for '{tokenizer_name}' ({e}); estimating token counts instead.")
+                _tokenizers[tokenizer_name] = _approximate_token_count
+        return _tokenizers[tokenizer_name]
+
+
+def _overlap(left: str, right: str) -> int:
+    """
+    Length of the longest suffix of `left` that `right` starts with, if it
+    is at least MIN_OVERLAP_CHARS long and made of whole words; else 0.
+    """
+    for size in range(min(len(left), len(right), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        starts_word = size == len(left) or left[-size - 1].isspace()
+        ends_word = size == len(right) or right[size].isspace() or right[size - 1].isspace()
+        if starts_word and ends_word and left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _passages(chunks: list) -> list:
+    """
+    Merges runs of adjacent chunks from the same page, keeping the order of
+    each run's best-ranked chunk. `chunks` must be in ranking order.
+    """
+    runs = []  # [best rank, source, last position, text]
+    by_page = {}
+    for rank, chunk in sorted(enumerate(chunks), key=lambda item: (
+            item[1].source is None, item[1].source or "", item[1].position if item[1].position is not None else item[0])):
+        previous = by_page.get(chunk.source) if chunk.source is not None and chunk.position is not None else None
+        if previous is not None and previous[2] == chunk.position - 1:
+            rest = chunk.text[_overlap(previous[3], chunk.text):].lstrip()
+            if rest:
+                previous[3] = previous[3] + "\n" + rest
+            previous[0] = min(previous[0], rank)
+            previous[2] = chunk.position
+            continue
+        run = [rank, chunk.source, chunk.position, chunk.text]
+        runs.append(run)
+        if chunk.source is not None and chunk.position is not None:
+            by_page[chunk.source] = run
+    return [run[3] for run in sorted(runs, key=lambda run: run[0])]
+
+
+def build_context(chunks: list, count_tokens, budget: int = CONTEXT_TOKEN_BUDGET) -> PackedContext:
+    """
+    Packs `chunks` (RetrievedChunk or plain strings, best first) into at most
+    `budget` tokens as counted by `count_tokens`.
+    """
+    chunks = [chunk if isinstance(chunk, RetrievedChunk) else RetrievedChunk(chunk) for chunk in chunks]
+    selected, text, tokens = [], "", 0
+    for chunk in chunks:
+        candidate = selected + [chunk]
+        candidate_text = PASSAGE_SEPARATOR.join(_passages(candidate))
+        candidate_tokens = count_tokens(candidate_text)
+        # A chunk that doesn't fit is skipped; a shorter, lower-ranked one may still fit.
+        if candidate_tokens <= budget:
+            selected, text, tokens = candidate, candidate_text, candidate_tokens
+    return PackedContext(
+        text=text,
+        tokens=tokens,
+        chunks_used=len(selected),
+        chunks_dropped=len(chunks) - len(selected),
+        passages=len(_passages(selected)),
+    )
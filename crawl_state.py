@@ -0,0 +1,208 @@
+# file: crawl_state.py
+"""
+Persistent crawl state for incremental recrawls. For every canonical URL we
+remember the validators the server gave us (ETag, Last-Modified), a hash of
+the extracted text and the page's links, so the next crawl can send
+conditional requests and report exactly which pages were added, changed or
+deleted.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+
+CRAWL_STATE_PATH = "./crawl_state.sqlite"
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+@dataclass
+class PageState:
+    url: str
+    site: str
+    etag: str = None
+    last_modified: str = None
+    content_hash: str = None
+    links: list = field(default_factory=list)
+    last_crawled: float = 0.0
+
+
+class CrawlStateStore:
+    """
+    SQLite-backed store of `PageState` records keyed by canonical URL.
+    """
+
+    def __init__(self, path: str = CRAWL_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                site TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT,
+                links TEXT,
+                last_crawled REAL
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS pages_site ON pages (site)")
+        self._db.commit()
+
+    def get(self, url: str) -> PageState:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT url, site, etag, last_modified, content_hash, links, last_crawled FROM pages WHERE url = ?",
+                (url,),
+            ).fetchone()
+        if row is None:
+            return None
+        return PageState(row[0], row[1], row[2], row[3], row[4], json.loads(row[5] or "[]"), row[6] or 0.0)
+
+    def urls_for_site(self, site: str) -> set:
+        with self._lock:
+            rows = self._db.execute("SELECT url FROM pages WHERE site = ?", (site,)).fetchall()
+        return {row[0] for row in rows}
+
+    def save(self, pages):
+        """
+        Inserts or replaces a batch of `PageState` records in one transaction.
+        """
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (p.url, p.site, p.etag, p.last_modified, p.content_hash, json.dumps(p.links), p.last_crawled or now)
+                    for p in pages
+                ],
+            )
+
+    def delete(self, urls):
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM pages WHERE url = ?", [(url,) for url in urls])
+
+    def delete_site(self, site: str) -> int:
+        """
+        Forgets every page of `site`, so its next crawl starts from scratch. Returns the number of pages.
+        """
+        with self._lock, self._db:
+            return self._db.execute("DELETE FROM pages WHERE site = ?", (site,)).rowcount
+
+    def close(self):
+        self._db.close()
+
+
+@dataclass
+class PageChange:
+    """
+    One page event from an incremental crawl. `kind` is 'added', 'changed',
+    'deleted' or 'unchanged'; `state` is the crawl state to save for the page.
+    """
+    url: str
+    kind: str
+    text: str = ""
+    title: str = ""
+    state: PageState = None
+
+
+@dataclass
+class CrawlDelta:
+    """
+    What changed on a site since the previous crawl. `added` and `changed`
+    map URLs to their new text; `deleted` and `unchanged` are URL sets.
+
+    A delta can also be streamed: iterating it yields `PageChange` events as
+    the crawl produces them and fills in the fields along the way. Streamed
+    deltas are created with `keep_text=False`, so page text is passed on
+    rather than held in memory.
+
+    The new crawl state is only written by `commit()`, which
+    `create_and_store_embeddings` calls once the knowledge base has been
+    updated, so a failed build is simply retried on the next crawl.
+    """
+    site: str
+    full: bool = False
+    added: dict = field(default_factory=dict)
+    changed: dict = field(default_factory=dict)
+    deleted: set = field(default_factory=set)
+    unchanged: set = field(default_factory=set)
+    titles: dict = field(default_factory=dict)
+    store: CrawlStateStore = None
+    pending_states: list = field(default_factory=list)
+    keep_text: bool = True
+    source: object = None
+    text_pages: int = 0
+    # The live crawl while it is being iterated, so `close` can stop it.
+    _crawl: object = field(default=None, init=False, repr=False)
+
+    @property
+    def visited_urls(self) -> set:
+        return set(self.added) | set(self.changed) | self.unchanged
+
+    @property
+    def is_full_crawl(self) -> bool:
+        """True when nothing was known about the site, so every page is new."""
+        return self.full
+
+    @property
+    def has_content(self) -> bool:
+        return bool(self.unchanged) or self.text_pages > 0
+
+    def record(self, change: PageChange):
+        text = change.text if self.keep_text else ""
+        if change.kind == 'added':
+            self.added[change.url] = text
+        elif change.kind == 'changed':
+            self.changed[change.url] = text
+        elif change.kind == 'deleted':
+            self.deleted.add(change.url)
+        else:
+            self.unchanged.add(change.url)
+        if change.kind in ('added', 'changed'):
+            self.titles[change.url] = change.title
+            if change.text:
+                self.text_pages += 1
+        if change.state is not None:
+            self.pending_states.append(change.state)
+
+    def __iter__(self):
+        # A live delta pulls events from the running crawl (once); afterwards it replays what it recorded.
+        if self.source is not None:
+            self._crawl, self.source = self.source, None
+            for change in self._crawl:
+                self.record(change)
+                yield change
+            self._crawl = None
+            return
+        for url, text in self.added.items():
+            yield PageChange(url, 'added', text, self.titles.get(url, ""))
+        for url, text in self.changed.items():
+            yield PageChange(url, 'changed', text, self.titles.get(url, ""))
+        for url in self.deleted:
+            yield PageChange(url, 'deleted')
+        for url in self.unchanged:
+            yield PageChange(url, 'unchanged')
+
+    def close(self):
+        """
+        Stops a live crawl that was not iterated to the end, or not at all.
+        """
+        for crawl in (self.source, self._crawl):
+            if hasattr(crawl, "close"):
+                crawl.close()
+        self.source = self._crawl = None
+
+    def commit(self):
+        if self.store is None:
+            return
+        self.store.save(self.pending_states)
+        self.store.delete(self.deleted)
+        self.pending_states = []
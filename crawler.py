@@ -1,74 +1,505 @@
 # file: crawler.py
-import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
-import trafilatura
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import queue
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from urllib.parse import urlparse
+
+import aiohttp
+
+from crawl_state import CRAWL_STATE_PATH, CrawlDelta, CrawlStateStore, PageChange, PageState, content_hash
+from frontier import START_PRIORITY, DiskFrontier, Frontier, canonicalize_url, looks_like_page, url_priority
+import metrics
+from page_archive import ArchiveWriter, PageArchive
+from page_parser import parse_page_timed
+from site_policy import get_site_policy
 
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36'
 }
 
-def crawl_website(start_url: str, max_pages: int = 20) -> str:
+# --- Crawl engine settings ---
+# Maximum number of requests in flight at once, across all hosts.
+MAX_CONCURRENCY = 10
+# Maximum number of requests in flight against a single host.
+PER_HOST_CONCURRENCY = 4
+# Politeness limit per host: sustained requests per second and allowed burst.
+REQUESTS_PER_SECOND = 4.0
+BURST_SIZE = 4
+# Seconds before a single request is abandoned.
+REQUEST_TIMEOUT = 10
+# Crawls with at least this many pages keep their frontier on disk.
+DISK_FRONTIER_MIN_PAGES = 50_000
+# Worker processes for HTML parsing and text extraction. 0 parses on a thread in this process instead.
+PARSE_WORKERS = min(4, os.cpu_count() or 1)
+# Crawled pages waiting for the knowledge base to pick them up. A full queue pauses the crawl.
+PAGE_QUEUE_SIZE = 8
+# Responses with any other Content-Type are dropped before their body is downloaded.
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+# Directory to archive every fetched page into (see page_archive.py), so later runs can replay it. Unset: no archive.
+ARCHIVE_DIR = os.environ.get("CRAWL_ARCHIVE_DIR")
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+class TokenBucket:
     """
-    Crawls a website starting from a URL, follows internal links,
-    and returns the combined text content of all visited pages.
+    A token-bucket rate limiter. Every request takes one token and tokens
+    refill at `rate` per second, up to `capacity` (the allowed burst).
     """
-    # 1. This is your "list for webpages to browse" (the queue).
-    to_visit_queue = [start_url]
-    
-    # 2. This tracks webpages we have visited so we don't browse them again.
-    # A 'set' is faster than a list for checking if an item exists.
-    visited_urls = set()
-    
-    # 3. This is your "list that stores the data of the webpages browsed."
-    all_text_data = []
-    
-    # Get the base domain to ensure we only crawl pages on the same site.
-    base_domain = urlparse(start_url).netloc
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # The lock makes waiting callers line up instead of racing for the next token.
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _get_parse_pool():
+    """
+    Returns the process pool shared by all crawls in this process, creating
+    it on first use. Returns None when PARSE_WORKERS is 0.
+
+    Workers are not forked from this process: it runs build workers, the
+    crawl and tokenizer threads, and a fork could copy a lock one of them
+    holds. They start from a clean forkserver (or are spawned where there
+    is none), which only needs `parse_page_timed` to be importable.
+    """
+    global _parse_pool
+    if PARSE_WORKERS <= 0:
+        return None
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context(method))
+        return _parse_pool
+
+
+@dataclass
+class CrawledPage:
+    """
+    The outcome of one fetch. `status` is 'fetched', 'not_modified' (a 304
+    answer to a conditional request), 'gone' (404/410), 'skipped' (not
+    HTML), 'error', or 'blocked' (the site's robots.txt, or its being
+    unavailable, kept the crawl from starting at this page).
+    """
+    url: str
+    order: int
+    status: str
+    text: str = None
+    links: list = field(default_factory=list)
+    etag: str = None
+    last_modified: str = None
+    title: str = ""
+
+
+async def iter_pages(
+    start_url: str,
+    max_pages: int = 20,
+    max_concurrency: int = MAX_CONCURRENCY,
+    per_host_concurrency: int = PER_HOST_CONCURRENCY,
+    requests_per_second: float = REQUESTS_PER_SECOND,
+    frontier=None,
+    state: CrawlStateStore = None,
+    respect_robots: bool = True,
+    use_sitemaps: bool = True,
+    archive_dir: str = ARCHIVE_DIR,
+    replay_dir: str = None,
+):
+    """
+    The asynchronous crawl engine. Pages are fetched concurrently over a
+    pooled keep-alive connection, each host is rate-limited by a token
+    bucket, and a `CrawledPage` is yielded as soon as each fetch finishes.
+
+    Pages are taken off a priority frontier, most useful first (see
+    `frontier.url_priority`), seeded with the site's sitemap pages. The
+    site's robots.txt rules and crawl delay are obeyed (see site_policy.py),
+    and non-HTML resources are skipped by extension, or by Content-Type
+    before their body is downloaded.
+
+    When a `state` store is given, pages it knows about are requested
+    conditionally, and a 304 reuses the links recorded last time.
+
+    With `archive_dir`, every page fetched (and every 404/410) is also
+    written to a page archive there. With `replay_dir`, nothing is fetched:
+    pages are read back from the archive in that directory, starting from
+    the ones archived for the site, and parsed exactly as if they had just
+    been downloaded, so extraction and chunking changes can be tried on a
+    site without the network. Pages missing from the archive count as errors.
+    """
+    # Pages are fetched at the URL they were found under; their canonical form is only their key
+    # (in the frontier's seen set, in the crawl state and in the `CrawledPage`s yielded).
+    start_url = start_url.strip()
+    start_key = canonicalize_url(start_url)
+    base_domain = urlparse(start_key).netloc
+    # The site's hosts: the start URL's, plus any it redirects to (example.com -> www.example.com).
+    site_hosts = {base_domain}
     print(f"Starting crawl at {start_url} for domain {base_domain}")
 
-    # 4. The main loop: keep browsing as long as there are pages in our queue.
-    while to_visit_queue and len(visited_urls) < max_pages:
-        # Get the next URL from the front of the queue.
-        current_url = to_visit_queue.pop(0)
+    def add_site_host(current_url, final_url):
+        if current_url == start_key:
+            site_hosts.add(urlparse(canonicalize_url(final_url)).netloc)
 
-        # 5. Do not go through the visited webpage again.
-        if current_url in visited_urls:
-            continue
- 
+    # 1. The frontier holds the pages still to browse and remembers every URL ever queued.
+    #    Very large crawls keep it on disk instead of in memory.
+    if frontier is None:
+        frontier = DiskFrontier() if max_pages >= DISK_FRONTIER_MIN_PAGES else Frontier()
+
+    visited_count = 0
+    buckets = {}
+    replay = PageArchive(replay_dir) if replay_dir else None
+    archive = ArchiveWriter(archive_dir) if archive_dir and replay is None else None
+
+    def bucket_for(host):
+        if host not in buckets:
+            buckets[host] = TokenBucket(requests_per_second, BURST_SIZE)
+        return buckets[host]
+
+    connector = aiohttp.TCPConnector(limit=max_concurrency, limit_per_host=per_host_concurrency)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    # A replay never opens a connection.
+    session_context = contextlib.nullcontext() if replay is not None else aiohttp.ClientSession(
+        headers=HEADERS, connector=connector, timeout=timeout)
+
+    async with session_context as session:
+
+        # 2. Read robots.txt and the sitemaps (cached per host), slow down to the crawl delay,
+        #    and seed the frontier with the sitemap's pages after the start page. A replay
+        #    instead seeds it with the site's archived pages.
+        policy = None
+        if replay is None and (respect_robots or use_sitemaps):
+            policy = await get_site_policy(session, start_url, bucket_for(base_domain).acquire, use_sitemaps)
+            if respect_robots and policy.crawl_delay:
+                bucket = bucket_for(base_domain)
+                bucket.rate = min(bucket.rate, 1.0 / policy.crawl_delay)
+                bucket.capacity = 1
+                bucket.tokens = min(bucket.tokens, 1.0)
+
+        def should_queue(url):
+            if not looks_like_page(url):
+                return False
+            return not (respect_robots and policy is not None and not policy.allows(url))
+
+        def priority_of(url):
+            entry = policy.sitemap.get(canonicalize_url(url)) if policy is not None else None
+            if entry is None:
+                return url_priority(url)
+            return url_priority(url, entry.priority, entry.lastmod)
+
+        order = 0
+        if should_queue(start_url):
+            frontier.push(start_url, START_PRIORITY)
+        else:
+            print(f"robots.txt does not allow crawling {start_url}.")
+            metrics.count("pages_total", status='blocked')
+            yield CrawledPage(canonicalize_url(start_url), order, 'blocked')
+            order += 1
+        if policy is not None:
+            for url, entry in policy.sitemap.items():
+                if should_queue(entry.url or url):
+                    frontier.push(entry.url or url, priority_of(url))
+        if replay is not None:
+            for url in replay.urls_for_site(base_domain):
+                frontier.push(url, priority_of(url))
+
+        async def parse_body(current_url, order, body, encoding, etag, last_modified, base_url):
+            # Parsing is CPU-bound, so it runs in the process pool while other fetches continue.
+            # Relative links resolve against the address the page was served from, after redirects.
+            metrics.observe("page_bytes", len(body))
+            html = body.decode(encoding, errors='replace')
+            loop = asyncio.get_running_loop()
+            page_text, links, title, timings = await loop.run_in_executor(
+                _get_parse_pool(), parse_page_timed, html, base_url
+            )
+            metrics.record_span("parse", timings["parse"], url=current_url)
+            metrics.record_span("extract", timings["extract"], url=current_url)
+            return CrawledPage(current_url, order, 'fetched', page_text, links, etag, last_modified, title)
+
+        async def replay_page(current_url, order):
+            print(f"Replaying: {current_url}")
+            with metrics.span("replay", url=current_url) as replayed:
+                archived = replay.get(current_url)
+                replayed["status"] = archived.status if archived is not None else None
+            if archived is None or archived.status not in (200, 404, 410):
+                return CrawledPage(current_url, order, 'error')
+            if archived.status != 200:
+                return CrawledPage(current_url, order, 'gone')
+            add_site_host(current_url, archived.target_url or current_url)
+            return await parse_body(current_url, order, archived.body, archived.encoding,
+                                    archived.headers.get('etag'), archived.headers.get('last-modified'),
+                                    archived.target_url or current_url)
+
+        async def fetch_and_parse(fetch_url, order):
+            current_url = canonicalize_url(fetch_url)
+            if replay is not None:
+                return await replay_page(current_url, order)
+            await bucket_for(urlparse(current_url).netloc).acquire()
+
+            # 3. Ask the server to skip the body if the page hasn't changed since the last crawl.
+            previous = state.get(current_url) if state is not None else None
+            request_headers = {}
+            if previous is not None and previous.etag:
+                request_headers['If-None-Match'] = previous.etag
+            if previous is not None and previous.last_modified:
+                request_headers['If-Modified-Since'] = previous.last_modified
+
+            print(f"Crawling: {fetch_url}")
+            try:
+                with metrics.span("fetch", url=current_url) as fetch:
+                    async with session.get(fetch_url, headers=request_headers) as response:
+                        base_url = str(response.url)
+                        add_site_host(current_url, base_url)
+                        fetch["status"] = response.status
+                        if response.status == 304 and previous is not None:
+                            return CrawledPage(current_url, order, 'not_modified', links=previous.links,
+                                               etag=previous.etag, last_modified=previous.last_modified)
+                        if response.status in (404, 410):
+                            if archive is not None:
+                                archive.add(current_url, response.status, response.reason, response.headers.items(), b"",
+                                            target_url=base_url)
+                            return CrawledPage(current_url, order, 'gone')
+                        response.raise_for_status()
+                        if response.content_type and response.content_type not in HTML_CONTENT_TYPES:
+                            fetch["skipped"] = response.content_type
+                            return CrawledPage(current_url, order, 'skipped')
+                        body = await response.read()
+                        encoding = response.get_encoding()
+                        etag = response.headers.get('ETag')
+                        last_modified = response.headers.get('Last-Modified')
+                        fetch["bytes"] = len(body)
+                        if archive is not None:
+                            archive.add(current_url, response.status, response.reason, response.headers.items(),
+                                        body, encoding, target_url=base_url)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Could not fetch {fetch_url}: {e}")
+                return CrawledPage(current_url, order, 'error')
+            metrics.count("fetched_bytes_total", len(body))
+            return await parse_body(current_url, order, body, encoding, etag, last_modified, base_url)
+
+        # 4. The main loop: keep up to `max_concurrency` fetches in flight. Pages being fetched
+        #    count against `max_pages` too, so we never overshoot the budget; skipped
+        #    resources and failures don't use it up.
+        pending = set()
         try:
-            print(f"Crawling: {current_url}")
-            response = requests.get(current_url, headers=HEADERS, timeout=10)
-            response.raise_for_status()
-            
-            # Mark the page as visited.
-            visited_urls.add(current_url)
-
-            # 6. Extract clean text and add it to our data list.
-            page_text = trafilatura.extract(response.text, include_comments=False, include_tables=False)
-            if page_text:
-                all_text_data.append(page_text)
-
-            # 7. Find all new links on the page.
-            soup = BeautifulSoup(response.text, 'html.parser')
-            for link in soup.find_all('a', href=True):
-                href = link['href']
-                full_url = urljoin(start_url, href).split('#')[0] # Create absolute URL and remove fragments
-
-                # 8. Add other webpages under the same domain to our "to visit" list.
-                if (urlparse(full_url).netloc == base_domain and 
-                        full_url not in visited_urls and 
-                        full_url not in to_visit_queue):
-                    to_visit_queue.append(full_url)
-            
-            # Be a good web citizen and wait a bit between requests.
-            time.sleep(0.5)
-        
-        except requests.RequestException as e:
-            print(f"Could not fetch {current_url}: {e}")
+            while True:
+                while frontier and len(pending) < max_concurrency and visited_count + len(pending) < max_pages:
+                    pending.add(asyncio.create_task(fetch_and_parse(frontier.pop(), order)))
+                    order += 1
+
+                if not pending:
+                    break
+
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    page = task.result()
+                    metrics.count("pages_total", status=page.status)
+                    if page.status in ('fetched', 'not_modified'):
+                        visited_count += 1
+
+                        # 5. Queue other pages of the site by priority; the frontier drops ones already seen.
+                        for full_url in page.links:
+                            if urlparse(canonicalize_url(full_url)).netloc in site_hosts and should_queue(full_url):
+                                frontier.push(full_url, priority_of(full_url))
+                    yield page
+        finally:
+            for task in pending:
+                task.cancel()
+            frontier.close()
+            if archive is not None:
+                archive.close()
+                print(f"Archived {archive.records} responses to {archive_dir}.")
+            if replay is not None:
+                replay.close()
+
+    print(f"Crawl finished. Visited {visited_count} pages and collected data.")
+
+
+async def crawl_website_async(start_url: str, max_pages: int = 20, **engine_options):
+    """
+    Crawls a website and returns the combined text of all visited pages, in
+    the order they were taken off the frontier, plus the set of visited URLs.
+    """
+    visited_urls = set()
+    text_by_order = {}
+    async for page in iter_pages(start_url, max_pages, **engine_options):
+        if page.status != 'fetched':
             continue
+        visited_urls.add(page.url)
+        if page.text:
+            text_by_order[page.order] = page.text
 
-    print(f"Crawl finished. Visited {len(visited_urls)} pages and collected data.")
     # Combine all the collected text into one large corpus.
-    return "\n\n".join(all_text_data), visited_urls
\ No newline at end of file
+    all_text_data = [text_by_order[order] for order in sorted(text_by_order)]
+    return "\n\n".join(all_text_data), visited_urls
+
+
+async def iter_page_changes(start_url: str, max_pages: int = 20, full: bool = False,
+                            store: CrawlStateStore = None, **engine_options):
+    """
+    Recrawls a website against the crawl state in `store` and yields a
+    `PageChange` for every page as soon as it is classified as added,
+    changed or unchanged, followed by the pages found to be deleted.
+    With `full=True` the stored state is ignored and every page counts as added.
+    """
+    site = urlparse(canonicalize_url(start_url)).netloc
+    known_urls = set() if full else store.urls_for_site(site)
+    seen_urls = set()
+    incomplete = False
+    visited_count = 0
+
+    async for page in iter_pages(start_url, max_pages, state=None if full else store, **engine_options):
+        if page.status in ('error', 'blocked'):
+            incomplete = True
+            continue
+        if page.status == 'skipped':
+            # No longer an HTML page: a known URL is dropped below, like a page that's gone.
+            continue
+        if page.status == 'gone':
+            if page.url in known_urls:
+                seen_urls.add(page.url)
+                yield PageChange(page.url, 'deleted')
+            continue
+
+        visited_count += 1
+        seen_urls.add(page.url)
+        if page.status == 'not_modified':
+            yield PageChange(page.url, 'unchanged')
+            continue
+
+        # A new ETag doesn't always mean new content, so compare the extracted text itself.
+        page_hash = content_hash(page.text)
+        previous = store.get(page.url) if page.url in known_urls else None
+        if previous is None:
+            kind = 'added'
+        elif previous.content_hash != page_hash:
+            kind = 'changed'
+        else:
+            kind = 'unchanged'
+        state = PageState(page.url, site, page.etag, page.last_modified, page_hash, page.links)
+        yield PageChange(page.url, kind, page.text or "", page.title, state)
+
+    # If the crawl ran out of links before using its page budget, it saw the whole site,
+    # so known pages it never reached have been removed. Not so if a page failed to load or
+    # robots.txt stopped the crawl: the pages behind it were never reached, so they are all kept.
+    if visited_count < max_pages and not incomplete:
+        for url in sorted(known_urls - seen_urls):
+            yield PageChange(url, 'deleted')
+
+
+def _iterate_in_thread(make_async_iterator, queue_size: int):
+    """
+    Runs an async iterator on its own event loop in a background thread and
+    yields its items here. The queue between the two is bounded, so a slow
+    consumer pauses the crawl instead of letting pages pile up in memory.
+    """
+    items = queue.Queue(maxsize=queue_size)
+    finished = object()
+    stop = threading.Event()
+
+    def run():
+        async def pump():
+            async for item in make_async_iterator():
+                await asyncio.to_thread(items.put, item)
+                if stop.is_set():
+                    break
+        try:
+            asyncio.run(pump())
+            items.put(finished)
+        except BaseException as e:
+            items.put(e)
+
+    # The crawl thread records its spans into the caller's trace, if any.
+    thread = threading.Thread(target=metrics.propagate(run), daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is finished:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # If the consumer stopped early, keep draining so the crawl thread can wind down.
+        stop.set()
+        while thread.is_alive():
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def _run_sync(coro):
+    """
+    Runs a coroutine to completion from synchronous code. If the caller is
+    already inside an event loop, the coroutine runs on a helper thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(metrics.propagate(asyncio.run), coro).result()
+
+
+def crawl_website(start_url: str, max_pages: int = 20, **engine_options):
+    """
+    Crawls a website starting from a URL, follows internal links,
+    and returns the combined text content of all visited pages
+    together with the set of visited URLs. `engine_options` go to
+    `iter_pages`, e.g. `replay_dir` to read the pages from an archive.
+    """
+    return _run_sync(crawl_website_async(start_url, max_pages, **engine_options))
+
+
+def stream_website_changes(start_url: str, max_pages: int = 20, full: bool = False,
+                           state_path: str = CRAWL_STATE_PATH, keep_text: bool = False,
+                           **engine_options) -> CrawlDelta:
+    """
+    Starts an incremental crawl and returns a live `CrawlDelta`. Iterating it
+    (as `create_and_store_embeddings` does) yields each `PageChange` while
+    the crawl is still running, so chunking and embedding overlap with fetching.
+    """
+    site = urlparse(canonicalize_url(start_url)).netloc
+    store = CrawlStateStore(state_path)
+    delta = CrawlDelta(site=site, store=store, keep_text=keep_text)
+    # With no previous state every page is new, which callers treat as a full rebuild.
+    delta.full = full or not store.urls_for_site(site)
+    delta.source = _iterate_in_thread(
+        lambda: iter_page_changes(start_url, max_pages, delta.full, store, **engine_options),
+        PAGE_QUEUE_SIZE,
+    )
+    return delta
+
+
+def crawl_website_changes(start_url: str, max_pages: int = 20, full: bool = False, **options) -> CrawlDelta:
+    """
+    Incremental version of `crawl_website`: crawls the whole site and
+    returns a `CrawlDelta` holding the text of every added or changed page.
+    Pass it to `create_and_store_embeddings` so only those pages are re-embedded.
+    """
+    delta = stream_website_changes(start_url, max_pages, full, keep_text=True, **options)
+    for change in delta:
+        pass
+    print(f"Changes: {len(delta.added)} added, {len(delta.changed)} changed, "
+          f"{len(delta.deleted)} deleted, {len(delta.unchanged)} unchanged.")
+    return delta
@@ -0,0 +1,143 @@
+# file: dedup.py
+"""
+Duplicate and near-duplicate chunk elimination. Crawled sites repeat the
+same navigation text, legal footers and product blurbs on every page; this
+keeps one copy of each and remembers every URL it appeared on.
+
+Exact duplicates are caught by hashing the normalized text. Near duplicates
+are caught with MinHash signatures over word shingles, bucketed with
+locality-sensitive hashing so each new chunk is only compared with a
+handful of candidates instead of every chunk seen so far.
+"""
+import hashlib
+import re
+import zlib
+
+import numpy as np
+
+# Estimated Jaccard similarity at or above which two chunks count as duplicates.
+NEAR_DUPLICATE_THRESHOLD = 0.9
+NUM_PERMUTATIONS = 64
+SHINGLE_SIZE = 3
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_WORD = re.compile(r"\w+")
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _lsh_bands(threshold: float, num_perm: int):
+    """
+    Picks (bands, rows) so that pairs near `threshold` are very likely to share a bucket.
+    The LSH curve's midpoint is about (1 / bands) ** (1 / rows); take the highest one below the threshold.
+    """
+    best = (num_perm, 1)
+    best_midpoint = 0.0
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        midpoint = (1 / bands) ** (1 / rows)
+        if best_midpoint < midpoint <= threshold:
+            best, best_midpoint = (bands, rows), midpoint
+    return best
+
+
+class ChunkDeduplicator:
+    """
+    Feed chunks through `add()` in order. The first copy of a chunk is kept;
+    later exact or near duplicates return the id of the kept chunk and add
+    their URL to its `sources`.
+    """
+
+    def __init__(self, threshold: float = NEAR_DUPLICATE_THRESHOLD, num_perm: int = NUM_PERMUTATIONS,
+                 shingle_size: int = SHINGLE_SIZE, seed: int = 1):
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+        self._bands, self._rows = _lsh_bands(threshold or 1.0, num_perm)
+
+        self._exact = {}
+        self._buckets = [dict() for _ in range(self._bands)]
+        self._signatures = {}
+        # chunk id -> URLs the chunk appeared on, in order of first appearance
+        self.sources = {}
+
+        self.total = 0
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+
+    @property
+    def kept(self) -> int:
+        return self.total - self.exact_duplicates - self.near_duplicates
+
+    def _signature(self, text: str) -> np.ndarray:
+        words = _WORD.findall(text.lower())
+        if len(words) <= self.shingle_size:
+            shingles = {" ".join(words)}
+        else:
+            shingles = {" ".join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0)
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(self._bands):
+            yield band, signature[band * self._rows:(band + 1) * self._rows].tobytes()
+
+    def add(self, chunk_id: str, text: str, url: str = None):
+        """
+        Registers a chunk. Returns None if it is new (keep it), or the id of
+        the chunk it duplicates (drop it).
+        """
+        self.total += 1
+
+        # 1. Exact duplicates, ignoring case and whitespace.
+        exact_key = hashlib.sha1(_normalize(text).encode("utf-8")).digest()
+        original = self._exact.get(exact_key)
+        if original is not None:
+            self.exact_duplicates += 1
+            self._add_source(original, url)
+            return original
+
+        # 2. Near duplicates: only chunks sharing an LSH bucket are compared.
+        signature = None
+        if self.threshold is not None and self.threshold < 1.0:
+            signature = self._signature(text)
+            candidates = []
+            for band, key in self._band_keys(signature):
+                candidate = self._buckets[band].get(key)
+                if candidate is not None and candidate not in candidates:
+                    candidates.append(candidate)
+            for candidate in candidates:
+                similarity = float(np.mean(self._signatures[candidate] == signature))
+                if similarity >= self.threshold:
+                    self.near_duplicates += 1
+                    self._exact[exact_key] = candidate
+                    self._add_source(candidate, url)
+                    return candidate
+
+        # 3. A new chunk: index it so later copies are found.
+        self._exact[exact_key] = chunk_id
+        if signature is not None:
+            self._signatures[chunk_id] = signature
+            for band, key in self._band_keys(signature):
+                self._buckets[band].setdefault(key, chunk_id)
+        self.sources[chunk_id] = []
+        self._add_source(chunk_id, url)
+        return None
+
+    def _add_source(self, chunk_id: str, url: str):
+        if url is not None and url not in self.sources[chunk_id]:
+            self.sources[chunk_id].append(url)
+
+    def report(self) -> str:
+        removed = self.total - self.kept
+        share = removed / self.total if self.total else 0.0
+        return (f"Deduplication: {self.total} chunks -> {self.kept} kept "
+                f"({self.exact_duplicates} exact and {self.near_duplicates} near duplicates removed, -{share:.0%}).")
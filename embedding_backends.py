@@ -0,0 +1,228 @@
+# file: embedding_backends.py
+"""
+Interchangeable CPU embedding backends. All of them take a list of strings
+and return a float32 array of normalized sentence embeddings:
+
+- `SentenceTransformerBackend`: the default PyTorch path through
+  sentence-transformers, optionally spread over a pool of worker processes
+  for large ingests.
+- `OnnxBackend`: the same model exported once to ONNX and run with ONNX
+  Runtime, optionally with int8 dynamic quantization. After the first
+  export it only needs `onnxruntime` and `tokenizers`, not torch.
+
+Batches are sized by sequence length: texts are sorted by length and
+grouped so each batch holds about TOKENS_PER_BATCH padded tokens, which
+keeps short chunks in big batches without long ones blowing up memory.
+"""
+import atexit
+import inspect
+import json
+import os
+import threading
+
+import numpy as np
+
+ONNX_CACHE_DIR = "./onnx_models"
+# Padded tokens per batch. 8192 is 32 chunks of 256 tokens, or 128 chunks of 64 tokens.
+TOKENS_PER_BATCH = 8192
+MIN_BATCH_SIZE = 8
+MAX_BATCH_SIZE = 256
+# Below this many texts, a multi-process pool costs more than it saves.
+MULTI_PROCESS_MIN_TEXTS = 128
+
+
+def _estimate_tokens(text: str) -> int:
+    # WordPiece averages roughly four characters per token on English web text.
+    return len(text) // 4 + 2
+
+
+def batch_size_for(texts, max_seq_length: int = 256) -> int:
+    """
+    Picks one batch size for `texts` from the padded length of the longest ones.
+    """
+    if not texts:
+        return MIN_BATCH_SIZE
+    longest = min(max(_estimate_tokens(text) for text in texts), max_seq_length)
+    return max(MIN_BATCH_SIZE, min(MAX_BATCH_SIZE, TOKENS_PER_BATCH // longest))
+
+
+def length_bucketed_batches(texts, max_seq_length: int = 256):
+    """
+    Yields lists of indices into `texts`, shortest texts first, each batch
+    holding about TOKENS_PER_BATCH tokens once padded to its longest member.
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    batch = []
+    for i in order:
+        longest = min(_estimate_tokens(texts[i]), max_seq_length)
+        if batch and (len(batch) + 1) * longest > TOKENS_PER_BATCH:
+            yield batch
+            batch = []
+        batch.append(i)
+        if len(batch) >= MAX_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class SentenceTransformerBackend:
+    """
+    The sentence-transformers (PyTorch) path. With `processes > 1`, large
+    inputs are encoded by a pool of worker processes started on first use.
+    """
+
+    def __init__(self, model_name: str, processes: int = 0):
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.processes = processes
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = self.model.start_multi_process_pool(["cpu"] * self.processes)
+                atexit.register(self.model.stop_multi_process_pool, self._pool)
+            return self._pool
+
+    def encode(self, texts, show_progress_bar: bool = False) -> np.ndarray:
+        batch_size = batch_size_for(texts, self.model.max_seq_length)
+        if self.processes > 1 and len(texts) >= MULTI_PROCESS_MIN_TEXTS:
+            embeddings = self.model.encode_multi_process(
+                texts, self._get_pool(), batch_size=batch_size, normalize_embeddings=True
+            )
+        else:
+            embeddings = self.model.encode(
+                texts, batch_size=batch_size, show_progress_bar=show_progress_bar, normalize_embeddings=True
+            )
+        return np.asarray(embeddings, dtype=np.float32)
+
+
+def export_onnx(model_name: str, cache_dir: str = ONNX_CACHE_DIR, quantize: bool = False) -> str:
+    """
+    Exports the transformer of a sentence-transformers model to ONNX (and
+    an int8 copy if `quantize`), next to its tokenizer and pooling settings.
+    Returns the export directory. Only this step needs torch.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    export_dir = os.path.join(cache_dir, model_name.replace("/", "__"))
+    fp32_path = os.path.join(export_dir, "model.onnx")
+    int8_path = os.path.join(export_dir, "model.int8.onnx")
+
+    if not os.path.exists(fp32_path):
+        os.makedirs(export_dir, exist_ok=True)
+        st_model = SentenceTransformer(model_name, device="cpu")
+        pooling = st_model[1]
+        if not getattr(pooling, "pooling_mode_mean_tokens", False):
+            raise ValueError(f"ONNX backend only supports mean pooling, which '{model_name}' does not use.")
+
+        class LastHiddenState(torch.nn.Module):
+            def __init__(self, transformer):
+                super().__init__()
+                self.transformer = transformer
+
+            def forward(self, input_ids, attention_mask, token_type_ids):
+                return self.transformer(input_ids=input_ids, attention_mask=attention_mask,
+                                        token_type_ids=token_type_ids)[0]
+
+        dummy = st_model.tokenizer(["an example sentence"], return_tensors="pt", return_token_type_ids=True)
+        names = ["input_ids", "attention_mask", "token_type_ids"]
+        options = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+        torch.onnx.export(
+            LastHiddenState(st_model[0].auto_model).eval(),
+            tuple(dummy[name] for name in names),
+            fp32_path,
+            input_names=names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={name: {0: "batch", 1: "sequence"} for name in names + ["last_hidden_state"]},
+            opset_version=14,
+            **options,
+        )
+        st_model.tokenizer.save_pretrained(export_dir)
+        with open(os.path.join(export_dir, "settings.json"), "w") as f:
+            json.dump({
+                "model_name": model_name,
+                "max_seq_length": st_model.max_seq_length,
+            }, f)
+
+    if quantize and not os.path.exists(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+
+    return export_dir
+
+
+class OnnxBackend:
+    """
+    ONNX Runtime path for CPU deployments, with optional int8 weights.
+    Exports the model on first use if `cache_dir` doesn't have it yet.
+    """
+
+    def __init__(self, model_name: str, quantize: bool = False, cache_dir: str = ONNX_CACHE_DIR, threads: int = 0):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.model_name = model_name
+        self.quantize = quantize
+
+        export_dir = export_onnx(model_name, cache_dir, quantize)
+        with open(os.path.join(export_dir, "settings.json")) as f:
+            settings = json.load(f)
+        self.max_seq_length = settings["max_seq_length"]
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(export_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        model_file = "model.int8.onnx" if quantize else "model.onnx"
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(export_dir, model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def _encode_batch(self, texts) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        hidden = self.session.run(None, {name: value for name, value in inputs.items() if name in self._input_names})[0]
+
+        # Mean pooling over real (non-padding) tokens, as the sentence-transformers Pooling layer does.
+        mask = inputs["attention_mask"][:, :, None].astype(np.float32)
+        embeddings = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        # Always L2-normalized, like the torch backend's normalize_embeddings=True, whatever the model's own layers.
+        embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings.astype(np.float32)
+
+    def encode(self, texts, show_progress_bar: bool = False) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        output = [None] * len(texts)
+        for batch in length_bucketed_batches(texts, self.max_seq_length):
+            for i, embedding in zip(batch, self._encode_batch([texts[i] for i in batch])):
+                output[i] = embedding
+        return np.stack(output)
+
+
+def create_backend(kind: str, model_name: str, processes: int = 0):
+    """
+    Builds a backend from its short name: 'torch', 'onnx' or 'onnx-int8'.
+    """
+    if kind == "torch":
+        return SentenceTransformerBackend(model_name, processes=processes)
+    if kind == "onnx":
+        return OnnxBackend(model_name)
+    if kind == "onnx-int8":
+        return OnnxBackend(model_name, quantize=True)
+    raise ValueError(f"Unknown embedding backend '{kind}'. Use 'torch', 'onnx' or 'onnx-int8'.")
@@ -0,0 +1,153 @@
+# file: embedding_cache.py
+"""
+Content-addressed, on-disk cache of chunk embeddings. Vectors are keyed by
+(model name, SHA-256 of the chunk text), so boilerplate that repeats across
+pages and rebuilds of an unchanged site are served from disk instead of
+going through the model. The cache is size-bounded with LRU eviction.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+EMBEDDING_CACHE_PATH = "./embedding_cache.sqlite"
+# Upper bound on stored vector bytes. all-MiniLM-L6-v2 vectors are 1.5 KB, so 256 MB is ~170k chunks.
+EMBEDDING_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    SQLite-backed embedding cache. Use `encode(model_name, encode_fn, texts)`
+    to embed a batch where only cache misses are passed to `encode_fn`.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            ) WITHOUT ROWID
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._db.commit()
+        self._total_bytes = self._db.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "evictions": self.evictions,
+            "bytes": self._total_bytes,
+        }
+
+    def get_many(self, model_name: str, hashes: list) -> dict:
+        """
+        Returns `{text_hash: vector}` for the hashes that are cached and marks them as recently used.
+        """
+        found = {}
+        now = time.time()
+        with self._lock, self._db:
+            # Stay well below SQLite's limit on bound parameters.
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._db.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model_name, *batch],
+                ).fetchall()
+                for row_hash, blob in rows:
+                    found[row_hash] = np.frombuffer(blob, dtype=np.float32)
+                self._db.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model_name, row_hash) for row_hash, _ in rows],
+                )
+        return found
+
+    def put_many(self, model_name: str, hashes: list, vectors):
+        now = time.time()
+        rows = [
+            (model_name, h, np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for h, vector in zip(hashes, vectors)
+        ]
+        with self._lock, self._db:
+            for row in rows:
+                previous = self._db.execute(
+                    "SELECT LENGTH(vector) FROM embeddings WHERE model = ? AND text_hash = ?", row[:2]
+                ).fetchone()
+                self._total_bytes += len(row[2]) - (previous[0] if previous else 0)
+            self._db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._evict()
+
+    def _evict(self):
+        # Drop least recently used vectors until we are back under 90% of the budget.
+        if self._total_bytes <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        while self._total_bytes > target:
+            rows = self._db.execute(
+                "SELECT model, text_hash, LENGTH(vector) FROM embeddings ORDER BY last_used LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                self._total_bytes = 0
+                return
+            evicted = []
+            for model_name, row_hash, size in rows:
+                evicted.append((model_name, row_hash))
+                self._total_bytes -= size
+                if self._total_bytes <= target:
+                    break
+            self._db.executemany("DELETE FROM embeddings WHERE model = ? AND text_hash = ?", evicted)
+            self.evictions += len(evicted)
+
+    def encode(self, model_name: str, encode_fn, texts: list) -> np.ndarray:
+        """
+        Embeds `texts`, calling `encode_fn(list_of_texts)` only for texts
+        that are not cached yet (each distinct text at most once).
+        Returns a float32 array with one row per input text.
+        """
+        hashes = [text_hash(text) for text in texts]
+        vectors = self.get_many(model_name, list(dict.fromkeys(hashes)))
+
+        missing = {}
+        for h, text in zip(hashes, texts):
+            if h not in vectors and h not in missing:
+                missing[h] = text
+        with self._lock:
+            cached = sum(1 for h in hashes if h in vectors)
+            self.hits += cached
+            self.misses += len(hashes) - cached
+
+        if missing:
+            new_vectors = np.asarray(encode_fn(list(missing.values())), dtype=np.float32)
+            self.put_many(model_name, list(missing), new_vectors)
+            vectors.update(zip(missing, new_vectors))
+
+        return np.stack([vectors[h] for h in hashes]) if hashes else np.zeros((0, 0), dtype=np.float32)
+
+    def close(self):
+        self._db.close()
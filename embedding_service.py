@@ -0,0 +1,123 @@
+# file: embedding_service.py
+"""
+One embedding model and one ChromaDB client per process, shared by
+`knowledge_Base` and `qa_agent`. Nothing is loaded at import time: the
+model and the client are created on first use, under a lock so concurrent
+first requests still only load them once.
+
+The backend that runs the model is picked with the EMBEDDING_BACKEND
+environment variable (see embedding_backends.py):
+
+- `torch` (default): sentence-transformers on PyTorch. Set
+  EMBEDDING_PROCESSES to 2 or more to spread large ingests over that many
+  worker processes.
+- `onnx`: the same model exported to ONNX Runtime.
+- `onnx-int8`: ONNX Runtime with int8 quantized weights, the fastest on CPU.
+"""
+import os
+import threading
+
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch")
+EMBEDDING_PROCESSES = int(os.environ.get("EMBEDDING_PROCESSES", "0"))
+# This will create a local persistent database in the 'chroma_db' directory
+CHROMA_PATH = "./chroma_db"
+# Megabytes of vector indexes kept loaded; beyond it the least recently used collection is evicted. 0: no limit.
+CHROMA_MEMORY_LIMIT_MB = int(os.environ.get("CHROMA_MEMORY_LIMIT_MB", "0"))
+# Optional second-stage reranker for qa_agent, small enough for CPU.
+RERANKER_MODEL_NAME = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+
+_lock = threading.Lock()
+_embedding_model = None
+_client = None
+_bm25_index = None
+_reranker = None
+
+
+def get_embedding_model():
+    """
+    Returns the shared embedding backend, loading it on first use.
+    Encoding with it is safe from several threads at once.
+    """
+    global _embedding_model
+    if _embedding_model is None:
+        with _lock:
+            if _embedding_model is None:
+                # Imported here so that importing this module stays cheap.
+                from embedding_backends import create_backend
+
+                print(f"Loading embedding model ({EMBEDDING_BACKEND})...")
+                _embedding_model = create_backend(EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME, EMBEDDING_PROCESSES)
+                print("Embedding model loaded.")
+    return _embedding_model
+
+
+def cache_key() -> str:
+    """
+    The name embeddings from the current backend are cached under. Backends
+    whose vectors differ (int8 quantization) get their own key.
+    """
+    if EMBEDDING_BACKEND == "onnx-int8":
+        return f"{EMBEDDING_MODEL_NAME}:int8"
+    return EMBEDDING_MODEL_NAME
+
+
+def get_chroma_client():
+    """
+    Returns the shared ChromaDB persistent client, opening it on first use.
+    With CHROMA_MEMORY_LIMIT_MB set, it keeps the loaded vector indexes in
+    an LRU cache of that size (ChromaDB sizes them by their files on disk).
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                import chromadb
+                from chromadb.config import Settings
+
+                settings = Settings()
+                if CHROMA_MEMORY_LIMIT_MB > 0:
+                    settings = Settings(chroma_segment_cache_policy="LRU",
+                                        chroma_memory_limit_bytes=CHROMA_MEMORY_LIMIT_MB * 2**20)
+                _client = chromadb.PersistentClient(path=CHROMA_PATH, settings=settings)
+    return _client
+
+
+def get_bm25_index():
+    """
+    Returns the shared BM25 keyword index that sits next to ChromaDB, opening it on first use.
+    """
+    global _bm25_index
+    if _bm25_index is None:
+        with _lock:
+            if _bm25_index is None:
+                from bm25_index import BM25Index
+
+                _bm25_index = BM25Index()
+    return _bm25_index
+
+
+def get_reranker():
+    """
+    Returns the shared cross-encoder reranker, loading it on first use.
+    """
+    global _reranker
+    if _reranker is None:
+        with _lock:
+            if _reranker is None:
+                from sentence_transformers import CrossEncoder
+
+                print("Loading reranker model...")
+                _reranker = CrossEncoder(RERANKER_MODEL_NAME, device="cpu")
+                print("Reranker model loaded.")
+    return _reranker
+
+
+def encode(texts, **kwargs):
+    """
+    Embeds a string or a list of strings with the shared model.
+    Returns one float32 vector for a string, or an array of them for a list.
+    """
+    if isinstance(texts, str):
+        return get_embedding_model().encode([texts], **kwargs)[0]
+    return get_embedding_model().encode(list(texts), **kwargs)
@@ -0,0 +1,241 @@
+# file: frontier.py
+"""
+The crawl frontier: a priority queue of pages still to visit plus the set
+of every URL that has ever been queued, so de-duplicating a link is O(1).
+The seen set holds canonical URLs, so trivial variations of the same page
+(case, default ports, tracking parameters, trailing slashes) are only
+crawled once. The queue keeps each URL as it was found, because that is
+the address to fetch: dropping the slash of /docs/ would cost a redirect
+and change the base its relative links resolve against.
+
+Pages come off the frontier best first, as scored by `url_priority`, so a
+small page budget is spent on pages like /about, /pricing and /products
+rather than on logins, tag archives and pagination. Equal priorities keep
+the order pages were found in.
+"""
+import heapq
+import itertools
+import os
+import re
+import sqlite3
+import tempfile
+import time
+from urllib.parse import parse_qsl, urldefrag, urlencode, urlsplit, urlunsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Query parameters that only carry tracking information and never change the page.
+TRACKING_PARAMS = {
+    'gclid', 'dclid', 'fbclid', 'msclkid', 'yclid', 'igshid',
+    'mc_cid', 'mc_eid', '_ga', '_gl', '_hsenc', '_hsmi',
+}
+TRACKING_PREFIXES = ('utm_',)
+
+# Resources that are never worth fetching as pages.
+NON_HTML_EXTENSIONS = {
+    '.pdf', '.zip', '.gz', '.tgz', '.rar', '.7z', '.dmg', '.exe', '.msi', '.apk',
+    '.jpg', '.jpeg', '.png', '.gif', '.svg', '.webp', '.ico', '.bmp', '.tif', '.tiff',
+    '.mp3', '.mp4', '.m4a', '.wav', '.avi', '.mov', '.webm', '.ogg',
+    '.css', '.js', '.json', '.xml', '.rss', '.atom', '.txt', '.csv',
+    '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.woff', '.woff2', '.ttf', '.eot',
+}
+
+# Path words of pages that describe a company well, and of pages that rarely do.
+HIGH_VALUE_WORDS = {
+    'about', 'company', 'pricing', 'plans', 'product', 'products', 'solutions', 'services',
+    'features', 'platform', 'customers', 'case-studies', 'team', 'leadership', 'contact',
+    'careers', 'faq', 'security', 'integrations', 'partners', 'industries', 'enterprise',
+}
+LOW_VALUE_WORDS = {
+    'login', 'log-in', 'signin', 'sign-in', 'signup', 'sign-up', 'register', 'account',
+    'cart', 'checkout', 'tag', 'tags', 'category', 'categories', 'author', 'archive',
+    'archives', 'search', 'feed', 'wp-admin', 'wp-login', 'cdn-cgi', 'privacy', 'terms',
+    'cookies', 'legal', 'print', 'share', 'attachment', 'calendar',
+}
+PAGINATION_PARAMS = {'page', 'p', 'paged', 'offset', 'start', 'sort', 'order', 'orderby', 'filter'}
+# The start page goes first whatever its score.
+START_PRIORITY = 100.0
+
+_WORD_SEPARATORS = re.compile(r'[-_.]')
+_PAGINATION_SEGMENT = re.compile(r'^(page|p)$')
+_YEAR_SEGMENT = re.compile(r'^(19|20)\d\d$')
+
+
+def _is_tracking_param(name: str) -> bool:
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Returns a canonical form of `url`: lowercase scheme and host, no default
+    port, no fragment, tracking parameters removed and the rest sorted, and
+    no trailing slash except on the site root.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+
+    host = (parts.hostname or '').rstrip('.')
+    if ':' in host:
+        host = f'[{host}]'
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host
+    if parts.username:
+        userinfo = parts.username + (f':{parts.password}' if parts.password else '')
+        netloc = f'{userinfo}@{netloc}'
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = f'{netloc}:{port}'
+
+    path = parts.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/') or '/'
+
+    query_params = [
+        (name, value)
+        for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not _is_tracking_param(name)
+    ]
+    query = urlencode(sorted(query_params))
+
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+
+def looks_like_page(url: str) -> bool:
+    """
+    False for URLs whose extension marks them as images, documents,
+    archives, media, feeds or other resources that aren't HTML pages.
+    """
+    path = urlsplit(url).path.lower()
+    extension = os.path.splitext(path.rsplit('/', 1)[-1])[1]
+    return extension not in NON_HTML_EXTENSIONS
+
+
+def url_priority(url: str, sitemap_priority: float = None, lastmod: float = None, now: float = None) -> float:
+    """
+    Scores how useful `url` is likely to be for learning about a company;
+    higher is better. Shallow paths and words like 'about' or 'pricing'
+    score up; logins, archives, pagination and query strings score down.
+    The sitemap's <priority> (0 to 1, 0.5 being neutral) and a recent
+    <lastmod> (a Unix timestamp) raise the score further.
+    """
+    parts = urlsplit(url)
+    segments = [segment for segment in parts.path.lower().split('/') if segment]
+    words = set(segments)
+    for segment in segments:
+        words.update(word for word in _WORD_SEPARATORS.split(segment) if word)
+
+    score = -0.1 * len(segments)
+    if words & HIGH_VALUE_WORDS:
+        score += 1.0
+    if words & LOW_VALUE_WORDS:
+        score -= 1.0
+    # Pagination (/page/3) and date archives (/2019/05).
+    if any(_PAGINATION_SEGMENT.match(segment) or _YEAR_SEGMENT.match(segment) for segment in segments):
+        score -= 0.5
+    if parts.query:
+        params = {name.lower() for name, _ in parse_qsl(parts.query, keep_blank_values=True)}
+        score -= 0.5 if params & PAGINATION_PARAMS else 0.2
+    if sitemap_priority is not None:
+        score += sitemap_priority - 0.5
+    if lastmod is not None:
+        age_days = ((now or time.time()) - lastmod) / 86400
+        if age_days < 90:
+            score += 0.3
+        elif age_days < 365:
+            score += 0.1
+    return score
+
+
+class Frontier:
+    """
+    In-memory priority frontier backed by a heap and a "seen" set that
+    covers both queued and visited URLs.
+    """
+
+    def __init__(self):
+        self._queue = []
+        self._order = itertools.count()
+        self._seen = set()
+
+    def push(self, url: str, priority: float = 0.0) -> bool:
+        """
+        Queues `url` (without its fragment) unless its canonical form has
+        been seen before. Higher `priority` pops sooner. Returns True if
+        the URL was new.
+        """
+        key = canonicalize_url(url)
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        heapq.heappush(self._queue, (-priority, next(self._order), urldefrag(url.strip())[0]))
+        return True
+
+    def pop(self) -> str:
+        if not self._queue:
+            raise IndexError('pop from an empty frontier')
+        return heapq.heappop(self._queue)[2]
+
+    def __contains__(self, url: str) -> bool:
+        return canonicalize_url(url) in self._seen
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def close(self):
+        pass
+
+
+class DiskFrontier:
+    """
+    SQLite-backed frontier for very large crawls, where the queue and the
+    seen set may not fit comfortably in memory. Same interface as `Frontier`.
+    """
+
+    def __init__(self, path: str = None):
+        self._owns_file = path is None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='frontier_', suffix='.sqlite')
+            os.close(fd)
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # The frontier is scratch data, so trade durability for speed.
+        self._db.execute('PRAGMA journal_mode=OFF')
+        self._db.execute('PRAGMA synchronous=OFF')
+        self._db.execute('CREATE TABLE IF NOT EXISTS seen (url TEXT PRIMARY KEY) WITHOUT ROWID')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS queue '
+            '(id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, priority REAL NOT NULL DEFAULT 0)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS queue_order ON queue (priority DESC, id)')
+        self._length = self._db.execute('SELECT COUNT(*) FROM queue').fetchone()[0]
+
+    def push(self, url: str, priority: float = 0.0) -> bool:
+        cursor = self._db.execute('INSERT OR IGNORE INTO seen (url) VALUES (?)', (canonicalize_url(url),))
+        if cursor.rowcount == 0:
+            return False
+        self._db.execute('INSERT INTO queue (url, priority) VALUES (?, ?)', (urldefrag(url.strip())[0], priority))
+        self._length += 1
+        return True
+
+    def pop(self) -> str:
+        row = self._db.execute('SELECT id, url FROM queue ORDER BY priority DESC, id LIMIT 1').fetchone()
+        if row is None:
+            raise IndexError('pop from an empty frontier')
+        self._db.execute('DELETE FROM queue WHERE id = ?', (row[0],))
+        self._length -= 1
+        return row[1]
+
+    def __contains__(self, url: str) -> bool:
+        row = self._db.execute('SELECT 1 FROM seen WHERE url = ?', (canonicalize_url(url),)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        return self._length
+
+    def close(self):
+        self._db.close()
+        if self._owns_file:
+            os.remove(self.path)
@@ -0,0 +1,313 @@
+# file: jobs.py
+"""
+Background knowledge-base builds. The UIs submit a build and get a job ID
+back straight away; a small pool of worker threads runs the crawl and the
+embedding, while the UI polls the job for progress. Chat on knowledge bases
+that already exist stays responsive while builds run.
+
+Jobs live in a local SQLite database, so their status survives page
+reloads and is shared by every app process on the machine. A build
+requested for a domain that already has a queued or running job joins that
+job instead of starting a second one.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from urllib.parse import urlparse
+
+import psutil
+
+import metrics
+from crawler import stream_website_changes
+from knowledge_Base import create_and_store_embeddings, knowledge_base_exists
+
+JOBS_PATH = "./jobs.sqlite"
+BUILD_WORKERS = int(os.environ.get("BUILD_WORKERS", "2"))
+# How often idle workers look for jobs submitted by other processes.
+POLL_INTERVAL = 1.0
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (DONE, FAILED, CANCELLED)
+
+_queue_lock = threading.Lock()
+_job_queue = None
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def company_name_for(url: str) -> str:
+    """
+    The knowledge-base name for a site: its host with dots (and a port's
+    colon, which collection names don't allow) replaced by underscores.
+    """
+    return urlparse(url).netloc.replace(".", "_").replace(":", "_")
+
+
+@dataclass
+class Job:
+    id: int
+    company_name: str
+    url: str
+    max_pages: int
+    status: str = QUEUED
+    pages_crawled: int = 0
+    chunks_embedded: int = 0
+    error: str = None
+    visited_urls: list = field(default_factory=list)
+    created_at: float = 0.0
+    started_at: float = None
+    finished_at: float = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def progress(self) -> float:
+        """Rough completion between 0 and 1, by pages crawled."""
+        if self.status == DONE:
+            return 1.0
+        return min(self.pages_crawled / self.max_pages, 1.0) if self.max_pages else 0.0
+
+    def describe(self) -> str:
+        if self.status == QUEUED:
+            return f"Waiting to build {self.company_name}..."
+        if self.status == RUNNING:
+            return f"Crawled {self.pages_crawled} pages, embedded {self.chunks_embedded} chunks..."
+        if self.status == DONE:
+            return f"Knowledge base for '{self.company_name}' is ready ({self.chunks_embedded} chunks embedded)."
+        if self.status == CANCELLED:
+            return f"Build for '{self.company_name}' was cancelled."
+        return f"Build for '{self.company_name}' failed: {self.error}"
+
+
+class JobQueue:
+    """
+    SQLite-backed queue of knowledge-base builds with `workers` threads
+    running them. Use `submit` to request a build, `get` to poll it and
+    `cancel` to stop it.
+    """
+
+    _COLUMNS = ("id, company_name, url, max_pages, status, pages_crawled, chunks_embedded, error, "
+                "visited_urls, created_at, started_at, finished_at")
+
+    def __init__(self, path: str = JOBS_PATH, workers: int = BUILD_WORKERS):
+        self.path = path
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                company_name TEXT NOT NULL,
+                url TEXT NOT NULL,
+                max_pages INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                pages_crawled INTEGER NOT NULL DEFAULT 0,
+                chunks_embedded INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                visited_urls TEXT,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                worker_pid INTEGER,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+            """
+        )
+        # At most one queued or running build per knowledge base, even across processes.
+        self._db.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS jobs_one_active_per_company ON jobs (company_name) "
+            "WHERE status IN ('queued', 'running')"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._db.commit()
+        self._requeue_orphaned_jobs()
+
+        self._workers = [
+            threading.Thread(target=self._work, name=f"build-worker-{i}", daemon=True) for i in range(max(1, workers))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def _requeue_orphaned_jobs(self):
+        # Builds whose worker process has died are picked up again from the start.
+        with self._lock, self._db:
+            rows = self._db.execute("SELECT id, worker_pid FROM jobs WHERE status = ?", (RUNNING,)).fetchall()
+            orphaned = [job_id for job_id, pid in rows if pid is None or pid == os.getpid() or not psutil.pid_exists(pid)]
+            self._db.executemany(
+                "UPDATE jobs SET status = ?, worker_pid = NULL, cancel_requested = 0 WHERE id = ?",
+                [(QUEUED, job_id) for job_id in orphaned],
+            )
+        if orphaned:
+            print(f"Requeued {len(orphaned)} interrupted build(s).")
+
+    def _row_to_job(self, row) -> Job:
+        values = dict(zip([name.strip() for name in self._COLUMNS.split(",")], row))
+        values["visited_urls"] = json.loads(values["visited_urls"] or "[]")
+        return Job(**values)
+
+    def _active_job_id(self, company_name: str):
+        row = self._db.execute(
+            "SELECT id FROM jobs WHERE company_name = ? AND status IN (?, ?)", (company_name, QUEUED, RUNNING)
+        ).fetchone()
+        return row[0] if row else None
+
+    def submit(self, url: str, max_pages: int) -> Job:
+        """
+        Queues a build of `url`'s knowledge base and returns its job. If the
+        domain already has a queued or running build, that job is returned
+        instead (a queued one is widened to the larger `max_pages`).
+        """
+        company_name = company_name_for(url)
+        if not company_name:
+            raise ValueError("Please enter a full URL (e.g., https://www.example.com).")
+        with self._lock, self._db:
+            job_id = self._active_job_id(company_name)
+            if job_id is None:
+                try:
+                    job_id = self._db.execute(
+                        "INSERT INTO jobs (company_name, url, max_pages, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                        (company_name, url, max_pages, QUEUED, time.time()),
+                    ).lastrowid
+                except sqlite3.IntegrityError:
+                    # Another process queued the same domain a moment ago.
+                    job_id = self._active_job_id(company_name)
+            else:
+                self._db.execute(
+                    "UPDATE jobs SET max_pages = MAX(max_pages, ?) WHERE id = ? AND status = ?",
+                    (max_pages, job_id, QUEUED),
+                )
+        self._wake.set()
+        return self.get(job_id)
+
+    def get(self, job_id: int) -> Job:
+        with self._lock:
+            row = self._db.execute(f"SELECT {self._COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"No build job {job_id}")
+        return self._row_to_job(row)
+
+    def recent(self, limit: int = 20) -> list:
+        """The most recent jobs, newest first."""
+        with self._lock:
+            rows = self._db.execute(f"SELECT {self._COLUMNS} FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def cancel(self, job_id: int) -> Job:
+        """
+        Cancels a job. A queued job is cancelled at once; a running one stops
+        at its next progress update, leaving the knowledge base to be
+        completed by the next build.
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+                (CANCELLED, time.time(), job_id, QUEUED),
+            )
+            self._db.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?", (job_id, RUNNING))
+        return self.get(job_id)
+
+    def _claim(self):
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            # The status check makes the claim safe against workers in other processes.
+            claimed = self._db.execute(
+                "UPDATE jobs SET status = ?, worker_pid = ?, started_at = ? WHERE id = ? AND status = ?",
+                (RUNNING, os.getpid(), time.time(), row[0], QUEUED),
+            ).rowcount
+        return self.get(row[0]) if claimed else None
+
+    def _update(self, job_id: int, **fields) -> bool:
+        """
+        Writes `fields` to a job and returns whether it has been asked to cancel.
+        """
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._db:
+            if fields:
+                self._db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            return bool(self._db.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()[0])
+
+    def _work(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                self._wake.wait(POLL_INTERVAL)
+                self._wake.clear()
+                continue
+            self._run(job)
+
+    def _run(self, job: Job):
+        print(f"Build job {job.id}: {job.url} ({job.max_pages} pages)")
+
+        def report(pages_crawled, chunks_embedded):
+            if self._update(job.id, pages_crawled=pages_crawled, chunks_embedded=chunks_embedded):
+                raise JobCancelled()
+
+        changes = None
+        build_trace = metrics.Trace("build", company=job.company_name, url=job.url, job=job.id)
+        try:
+            if self._update(job.id):
+                raise JobCancelled()
+            # Pages are chunked and embedded while the crawl is still running, and only pages
+            # that changed since the last build are fetched in full and re-embedded.
+            with build_trace.activate(), metrics.profile(f"build-{job.company_name}"):
+                changes = stream_website_changes(job.url, max_pages=job.max_pages,
+                                                 full=not knowledge_base_exists(job.company_name))
+                create_and_store_embeddings(job.company_name, changes, progress=report)
+            if not changes.has_content:
+                raise ValueError("Failed to fetch content. The website may be blocking crawlers or requires JavaScript.")
+            fields = {"status": DONE, "visited_urls": json.dumps(sorted(changes.visited_urls))}
+        except JobCancelled:
+            fields = {"status": CANCELLED}
+        except Exception as e:
+            fields = {"status": FAILED, "error": str(e) or repr(e)}
+        finally:
+            # Stop a crawl that was cut short.
+            if changes is not None:
+                changes.close()
+        self._update(job.id, finished_at=time.time(), **fields)
+        metrics.count("builds_total", status=fields["status"])
+        build_trace.attributes["status"] = fields["status"]
+        trace_path = build_trace.finish()
+        print(f"Build job {job.id}: {fields['status']}" + (f" (trace: {trace_path})" if trace_path else ""))
+
+
+def active_company_names(path: str = JOBS_PATH) -> set:
+    """
+    The knowledge bases with a queued or running build, read without starting a queue.
+    """
+    if not os.path.exists(path):
+        return set()
+    db = sqlite3.connect(path, timeout=30)
+    try:
+        rows = db.execute("SELECT company_name FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchall()
+    finally:
+        db.close()
+    return {company_name for (company_name,) in rows}
+
+
+def get_job_queue() -> JobQueue:
+    """
+    The process-wide job queue, started on first use.
+    """
+    global _job_queue
+    with _queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue()
+        return _job_queue
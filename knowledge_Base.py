@@ -1,56 +1,419 @@
 # file: knowledge_base.py
-import chromadb
-from sentence_transformers import SentenceTransformer
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import hashlib
+import queue
+import threading
 
-# Initialize the embedding model once
-print("Loading embedding model...")
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-print("Embedding model loaded.")
+import embedding_service
+import metrics
+from chunking import chunk_text, get_chunk_token_counter
+from collection_registry import collection_name_for, get_collection, get_registry, record_build
+from crawl_state import CrawlDelta
+from dedup import NEAR_DUPLICATE_THRESHOLD, ChunkDeduplicator
+from embedding_cache import EmbeddingCache
+from embedding_service import get_bm25_index, get_chroma_client
+from query_cache import mark_collection_changed
 
-# Initialize ChromaDB client
-# This will create a local persistent database in the 'chroma_db' directory
-client = chromadb.PersistentClient(path="./chroma_db")
+# The embedding model and the ChromaDB client are shared with qa_agent and loaded
+# on first use (see embedding_service.py).
 
-def create_and_store_embeddings(company_name: str, text_corpus: str):
+# Chunks we have embedded before (boilerplate, unchanged pages) are served from this cache
+embedding_cache = EmbeddingCache()
+
+# Streaming ingest: chunks per embedding call, and embedding batches allowed to wait in line.
+# With a multi-process embedding pool, batches grow so every worker gets a share.
+EMBED_BATCH_SIZE = 64 * max(1, embedding_service.EMBEDDING_PROCESSES)
+EMBED_QUEUE_SIZE = 4
+
+def embed_chunks(chunks: list, show_progress_bar: bool = False):
+    """
+    Embeds `chunks`, sending only the ones missing from the embedding cache to the model.
+    """
+    return embedding_cache.encode(
+        embedding_service.cache_key(),
+        lambda texts: embedding_service.encode(texts, show_progress_bar=show_progress_bar),
+        chunks,
+    )
+
+
+def knowledge_base_exists(company_name: str) -> bool:
+    """
+    Returns True if the company already has a non-empty collection.
+    """
+    collection_name = collection_name_for(company_name)
+    try:
+        return get_collection(collection_name).count() > 0
+    except ValueError:
+        return False
+
+
+class _EmbeddingWriter:
+    """
+    Background stage of the streaming pipeline: takes batches of chunks off
+    a bounded queue, embeds them and upserts them into the collection, so the
+    next pages can be chunked while the current batch is being embedded.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.batches = queue.Queue(maxsize=EMBED_QUEUE_SIZE)
+        self.chunks_embedded = 0
+        self.error = None
+        self.thread = threading.Thread(target=metrics.propagate(self._run), daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                return
+            if self.error is not None:
+                continue
+            chunks, ids, metadatas = batch
+            try:
+                with metrics.span("embed", chunks=len(chunks)):
+                    embeddings = embed_chunks(chunks)
+                with metrics.span("upsert", chunks=len(chunks)):
+                    self.collection.upsert(
+                        embeddings=embeddings.tolist(),
+                        documents=chunks,
+                        metadatas=metadatas,
+                        ids=ids
+                    )
+                    get_bm25_index().add(self.collection.name, ids, chunks)
+                self.chunks_embedded += len(chunks)
+                metrics.count("chunks_total", len(chunks), outcome="embedded")
+            except Exception as e:
+                # Remember the failure and keep draining so the producer never blocks.
+                self.error = e
+
+    def put(self, chunks, ids, metadatas):
+        if self.error is not None:
+            raise self.error
+        self.batches.put((chunks, ids, metadatas))
+
+    def close(self):
+        self.batches.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def content_hash_for(chunk: str) -> str:
+    return hashlib.sha1(chunk.encode("utf-8")).hexdigest()[:16]
+
+
+def chunk_id_for(collection_name: str, url: str, chunk: str) -> str:
+    """
+    Deterministic chunk id from the page's canonical URL and the chunk's
+    text, so a chunk keeps its id (and its embedding) across rebuilds even
+    when edits elsewhere on the page move it to another position.
+    """
+    url_key = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+    return f"{collection_name}_{url_key}_{content_hash_for(chunk)}"
+
+
+def _page_chunks(collection, url: str) -> dict:
+    """
+    The chunks a page currently owns, as {chunk id: metadata}.
+    """
+    existing = collection.get(where={"source": url}, include=["metadatas"])
+    return {chunk_id: metadata or {} for chunk_id, metadata in zip(existing["ids"], existing["metadatas"])}
+
+
+def _chunks_by_content(collection, content_hashes: list) -> dict:
+    """
+    Stored chunks with any of these texts (see `content_hash_for`), whatever
+    page holds them, as {content hash: (chunk id, metadata)}.
+    """
+    if not content_hashes:
+        return {}
+    found = collection.get(where={"content_hash": {"$in": sorted(set(content_hashes))}}, include=["metadatas"])
+    return {metadata["content_hash"]: (chunk_id, metadata) for chunk_id, metadata in zip(found["ids"], found["metadatas"])}
+
+
+def _delete_chunks(collection, ids: list):
+    if ids:
+        # The vector index keeps deleted entries until the collection is compacted.
+        get_registry().record_deletes(collection.name, len(ids))
+    for start in range(0, len(ids), EMBED_BATCH_SIZE):
+        batch = ids[start:start + EMBED_BATCH_SIZE]
+        collection.delete(ids=batch)
+        get_bm25_index().delete(collection.name, batch)
+
+
+def _release_chunks(collection, url: str, chunks: dict, live_urls: set = None) -> int:
+    """
+    Removes chunks that `url` no longer has (`chunks` maps their ids to
+    their metadata). A chunk that other pages also contained (see the
+    'sources' metadata) is kept and handed over to the next of those pages
+    instead; with `live_urls`, only pages in that set can take it over.
+    Returns the number of chunks deleted.
+    """
+    orphaned_ids, handed_over_ids, handed_over_metadatas = [], [], []
+    for chunk_id, metadata in chunks.items():
+        other_urls = [u for u in (metadata.get("sources") or "").split("\n")
+                      if u and u != url and (live_urls is None or u in live_urls)]
+        if other_urls:
+            handed_over_ids.append(chunk_id)
+            handed_over_metadatas.append({**metadata, "source": other_urls[0], "sources": "\n".join(other_urls)})
+        else:
+            orphaned_ids.append(chunk_id)
+    _delete_chunks(collection, orphaned_ids)
+    if handed_over_ids:
+        collection.update(ids=handed_over_ids, metadatas=handed_over_metadatas)
+    return len(orphaned_ids)
+
+
+def _release_page_chunks(collection, url: str) -> int:
+    """
+    Removes the chunks owned by a page that disappeared.
+    """
+    return _release_chunks(collection, url, _page_chunks(collection, url))
+
+
+def _collect_garbage(collection, live_urls: set) -> int:
+    """
+    Deletes chunks whose page is no longer part of the site: pages dropped
+    while a build failed halfway, or chunks stored before pages were
+    tracked. Returns the number of chunks deleted.
+    """
+    existing = collection.get(include=["metadatas"])
+    stale_by_page = {}
+    for chunk_id, metadata in zip(existing["ids"], existing["metadatas"]):
+        metadata = metadata or {}
+        source = metadata.get("source")
+        if source not in live_urls:
+            stale_by_page.setdefault(source, {})[chunk_id] = metadata
+    return sum(_release_chunks(collection, url, chunks, live_urls) for url, chunks in stale_by_page.items())
+
+
+def _ingest_page_changes(company_name: str, collection_name: str, delta: CrawlDelta, progress=None):
+    """
+    Updates a knowledge base in place from a `CrawlDelta`, streaming pages
+    through chunking into batched embedding as they arrive: chunks of
+    deleted pages are removed, and only chunks of added and changed pages
+    whose text is new are embedded. Pages are chunked along their structure
+    (see chunking.py), and each chunk records its page's URL, title, heading
+    path and position on the page as metadata.
+
+    Chunk ids are derived from the page URL and the chunk text (see
+    `chunk_id_for`), so the chunks a changed page still has keep their
+    embeddings and only get their position updated, and chunks it lost are
+    removed. After an incremental build, chunks of pages the site no longer
+    has are garbage-collected.
+
+    Duplicate and near-duplicate chunks are dropped before embedding; the
+    kept copy lists every page it appeared on in its 'sources' metadata.
+    On an incremental build, a chunk another page already holds (a shared
+    footer, say) is found by its 'content_hash' metadata and gains the page
+    as a source rather than being embedded again.
+
+    `progress`, if given, is called as `progress(pages_crawled, chunks_embedded)`.
+    """
+    count_tokens = get_chunk_token_counter()
+    dedup = ChunkDeduplicator(NEAR_DUPLICATE_THRESHOLD)
+    kept_metadatas = {}
+    collection = None
+    writer = None
+    pages_crawled = 0
+    chunks_unchanged = 0
+    chunks, ids, metadatas = [], [], []
+
+    try:
+        for change in delta:
+            # 1. Open the collection when the first page arrives. A full rebuild starts from an
+            #    empty collection, which also clears chunks left by a full-corpus build.
+            if collection is None:
+                if delta.is_full_crawl:
+                    try:
+                        get_chroma_client().delete_collection(name=collection_name)
+                    except ValueError:
+                        pass
+                    get_bm25_index().drop_collection(collection_name)
+                collection = get_chroma_client().get_or_create_collection(name=collection_name)
+                writer = _EmbeddingWriter(collection)
+
+            # 2. Look up what the page had before; a page that disappeared loses all of it.
+            existing = {}
+            if change.kind == 'changed' or (change.kind == 'added' and not delta.is_full_crawl):
+                existing = _page_chunks(collection, change.url)
+            elif change.kind == 'deleted':
+                with metrics.span("delete", url=change.url):
+                    _release_page_chunks(collection, change.url)
+            if change.kind != 'deleted':
+                pages_crawled += 1
+
+            # 3. Chunk each added or changed page on its own, so chunks never straddle pages,
+            #    drop duplicates of chunks we already have, and hand full batches of new chunks
+            #    to the embedding stage. Chunks the page already had keep their embedding.
+            if change.kind in ('added', 'changed'):
+                with metrics.span("chunk", url=change.url) as chunking:
+                    page_chunks = chunk_text(change.text, count_tokens)
+                    chunking["chunks"] = len(page_chunks)
+                moved_ids, moved_metadatas = [], []
+                content_hashes = [content_hash_for(page_chunk.text) for page_chunk in page_chunks]
+                stored = {}
+                if not delta.is_full_crawl:
+                    stored = _chunks_by_content(collection, [
+                        content_hash for page_chunk, content_hash in zip(page_chunks, content_hashes)
+                        if chunk_id_for(collection_name, change.url, page_chunk.text) not in existing
+                    ])
+                for i, (page_chunk, content_hash) in enumerate(zip(page_chunks, content_hashes)):
+                    chunk = page_chunk.text
+                    chunk_id = chunk_id_for(collection_name, change.url, chunk)
+                    shared = stored.get(content_hash) if chunk_id not in existing else None
+                    if shared is not None:
+                        chunk_id = shared[0]
+                    if dedup.add(chunk_id, chunk, change.url) is not None:
+                        metrics.count("chunks_total", outcome="duplicate")
+                        continue
+                    if shared is not None:
+                        # Another page holds this text already: list this page among its sources.
+                        metadata = shared[1]
+                        sources = (metadata.get("sources") or metadata["source"]).split("\n")
+                        metadata = {**metadata, "sources": "\n".join(dict.fromkeys(sources + [change.url]))}
+                        kept_metadatas[chunk_id] = metadata
+                        moved_ids.append(chunk_id)
+                        moved_metadatas.append(metadata)
+                        chunks_unchanged += 1
+                        metrics.count("chunks_total", outcome="shared")
+                        continue
+                    metadata = {"source": change.url, "title": change.title, "sources": change.url, "chunk": i,
+                                "headings": page_chunk.heading_path, "content_hash": content_hash}
+                    kept_metadatas[chunk_id] = metadata
+                    previous = existing.pop(chunk_id, None)
+                    if previous is not None:
+                        metadata["sources"] = previous.get("sources") or change.url
+                        if metadata != previous:
+                            moved_ids.append(chunk_id)
+                            moved_metadatas.append(metadata)
+                        chunks_unchanged += 1
+                        metrics.count("chunks_total", outcome="unchanged")
+                        continue
+                    chunks.append(chunk)
+                    ids.append(chunk_id)
+                    metadatas.append(metadata)
+                    if len(chunks) >= EMBED_BATCH_SIZE:
+                        writer.put(chunks, ids, metadatas)
+                        chunks, ids, metadatas = [], [], []
+                if moved_ids:
+                    collection.update(ids=moved_ids, metadatas=moved_metadatas)
+                # Whatever is left of the page's old chunks was edited away.
+                if existing:
+                    with metrics.span("delete", url=change.url, chunks=len(existing)):
+                        _release_chunks(collection, change.url, existing)
+
+            if progress is not None:
+                progress(pages_crawled, writer.chunks_embedded)
+
+        if chunks:
+            writer.put(chunks, ids, metadatas)
+    finally:
+        if writer is not None:
+            try:
+                writer.close()
+            finally:
+                # Cached retrievals for this collection are stale now, even if the update failed halfway.
+                mark_collection_changed(collection)
+
+    # 4. Chunks that turned up again on later pages now list all of those pages
+    #    (plus the pages an unchanged chunk was already shared with).
+    shared_ids, shared_metadatas = [], []
+    for chunk_id, urls in dedup.sources.items():
+        metadata = kept_metadatas[chunk_id]
+        sources = list(dict.fromkeys(metadata["sources"].split("\n") + list(urls)))
+        if len(urls) > 1:
+            shared_ids.append(chunk_id)
+            shared_metadatas.append({**metadata, "sources": "\n".join(sources)})
+    if shared_ids:
+        collection.update(ids=shared_ids, metadatas=shared_metadatas)
+        mark_collection_changed(collection)
+
+    if progress is not None:
+        progress(pages_crawled, writer.chunks_embedded if writer else 0)
+
+    # 5. Only now that the knowledge base is up to date, remember what we crawled.
+    delta.commit()
+
+    # 6. Garbage-collect chunks of pages the site no longer has. A full rebuild started empty.
+    chunks_collected = 0
+    if collection is not None and delta.store is not None and not delta.is_full_crawl:
+        with metrics.span("gc"):
+            chunks_collected = _collect_garbage(collection, delta.store.urls_for_site(delta.site))
+        if chunks_collected:
+            mark_collection_changed(collection)
+
+    # 7. Record the build's stats, compacting the index if deletions have bloated it.
+    if collection is not None:
+        collection = record_build(collection, full=delta.is_full_crawl, site=delta.site)
+    print(f"Updated knowledge base for '{company_name}': {writer.chunks_embedded if writer else 0} chunks embedded, "
+          f"{chunks_unchanged} kept, {len(delta.deleted)} pages removed, {len(delta.unchanged)} pages unchanged, "
+          f"{chunks_collected} orphaned chunks collected.")
+    print(dedup.report())
+    print(f"Embedding cache: {embedding_cache.hits} hits, {embedding_cache.misses} misses "
+          f"({embedding_cache.hit_rate:.0%} hit rate).")
+    return collection
+
+
+def create_and_store_embeddings(company_name: str, text_corpus, progress=None):
     """
     Creates a knowledge base for a company by chunking text,
     creating embeddings, and storing them in ChromaDB.
+
+    `text_corpus` is either the full text of the site, or a `CrawlDelta`
+    from `crawl_website_changes` / `stream_website_changes`, in which case
+    pages are embedded as they stream in and only the pages that were
+    added, changed or deleted are touched. `progress(pages, chunks)` is
+    called as the build advances.
     """
     # 1. Sanitize company name for collection name
-    collection_name = company_name.lower().replace(" ", "_")
+    collection_name = collection_name_for(company_name)
+
+    if isinstance(text_corpus, CrawlDelta):
+        return _ingest_page_changes(company_name, collection_name, text_corpus, progress)
     
     # 2. Get or create a collection in ChromaDB
-    collection = client.get_or_create_collection(name=collection_name)
+    collection = get_chroma_client().get_or_create_collection(name=collection_name)
     
-    # 3. Split the text into manageable chunks
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=500,
-        chunk_overlap=50,
-    )
-    chunks = text_splitter.split_text(text_corpus)
+    # 3. Split the text into chunks along its structure and drop duplicate or near-duplicate ones
+    dedup = ChunkDeduplicator(NEAR_DUPLICATE_THRESHOLD)
+    corpus_chunks = [chunk for i, chunk in enumerate(chunk_text(text_corpus)) if dedup.add(str(i), chunk.text) is None]
+    chunks = [chunk.text for chunk in corpus_chunks]
+    print(dedup.report())
     
     if not chunks:
         print("Text corpus is empty, nothing to store.")
         return None
         
-    # 4. Create embeddings and store them in ChromaDB
-    # ChromaDB's add method can handle embedding creation automatically if you pass the model
-    # But doing it manually gives us more control. Let's do it manually.
-    print(f"Creating embeddings for {len(chunks)} chunks...")
-    embeddings = embedding_model.encode(chunks, show_progress_bar=True)
-    
-    # Generate IDs for each chunk
-    ids = [f"{collection_name}_{i}" for i in range(len(chunks))]
-    
-    # 5. Add to the collection
-    collection.add(
-        embeddings=embeddings.tolist(),
-        documents=chunks,
-        ids=ids
-    )
+    # 4. Give each chunk an id from its text, so chunks kept from the previous build
+    #    keep their embeddings and only new ones are embedded
+    ids = [chunk_id_for(collection_name, "", chunk) for chunk in chunks]
+    existing_ids = set(collection.get(include=[])["ids"])
+    new_chunks = [(chunk_id, chunk, i) for i, (chunk_id, chunk) in enumerate(zip(ids, chunks)) if chunk_id not in existing_ids]
+    print(f"Creating embeddings for {len(new_chunks)} new chunks ({len(chunks) - len(new_chunks)} unchanged)...")
+
+    # 5. Upsert the new chunks into the collection in batches
+    for start in range(0, len(new_chunks), EMBED_BATCH_SIZE):
+        batch_ids, batch_chunks, positions = zip(*new_chunks[start:start + EMBED_BATCH_SIZE])
+        embeddings = embed_chunks(list(batch_chunks))
+        collection.upsert(
+            embeddings=embeddings.tolist(),
+            documents=list(batch_chunks),
+            metadatas=[{"chunk": i, "headings": corpus_chunks[i].heading_path} for i in positions],
+            ids=list(batch_ids)
+        )
+        get_bm25_index().add(collection_name, list(batch_ids), list(batch_chunks))
+
+    # 6. Remove chunks of the previous build that are no longer in the text
+    orphaned_ids = sorted(existing_ids - set(ids))
+    _delete_chunks(collection, orphaned_ids)
+    mark_collection_changed(collection)
+    collection = record_build(collection)
     
-    print(f"Successfully created knowledge base for '{company_name}' with {len(chunks)} chunks.")
+    print(f"Successfully created knowledge base for '{company_name}' with {len(chunks)} chunks "
+          f"({len(orphaned_ids)} orphaned chunks removed).")
+    print(f"Embedding cache: {embedding_cache.hits} hits, {embedding_cache.misses} misses "
+          f"({embedding_cache.hit_rate:.0%} hit rate).")
     return collection
 
 # Test function
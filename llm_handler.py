@@ -2,25 +2,53 @@
 from huggingface_hub import InferenceClient
 from huggingface_hub.errors import HfHubHTTPError
 import os
+import time
+from dataclasses import dataclass
 import dotenv
+import metrics
+from collection_registry import collection_name_for
+from context_builder import build_context, get_token_counter
+from query_cache import answer_cache, context_fingerprint, embed_query, normalize_query
 dotenv.load_dotenv()  # Load variables from .env file if present
 
 # --- Model configured for CONVERSATIONAL task ---
 MODEL_URL = "meta-llama/Meta-Llama-3-8B-Instruct" # Or any other conversational model
+# Optional: send requests to another OpenAI-compatible endpoint instead of the Hugging Face API
+# (e.g. a self-hosted server, or benchmarks/fake_llm_server.py for local testing).
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL")
+# Chat templates add a few tokens around each message (role header and end-of-turn markers).
+MESSAGE_OVERHEAD_TOKENS = 5
 
 try:
-    client = InferenceClient(api_key=os.environ['HF_API_TOKEN'])
+    client = InferenceClient(base_url=LLM_BASE_URL, api_key=os.environ['HF_API_TOKEN'])
 except Exception as e:
     client = None
 
-def get_llm_answer(query: str, context_chunks: list[str]) -> str:
-    if client is None:
-        return "### 🚨 Error\n**Could not initialize the Hugging Face Inference Client.**"
 
-    context = "\n---\n".join(context_chunks)
+@dataclass
+class GenerationStats:
+    """
+    Timings of one answer, filled in by `stream_llm_answer` as tokens arrive.
+    """
+    time_to_first_token: float = None
+    tokens: int = 0
+    duration: float = 0.0
+    prompt_tokens: int = 0
+    context_tokens: int = 0
+    context_chunks: int = 0
+    dropped_chunks: int = 0
+
+    @property
+    def tokens_per_second(self) -> float:
+        # Decoding speed after the first token, so it isn't skewed by queueing and prompt processing.
+        if self.tokens < 2 or self.time_to_first_token is None:
+            return 0.0
+        return (self.tokens - 1) / max(self.duration - self.time_to_first_token, 1e-9)
 
+
+def _build_messages(query: str, context: str) -> list[dict]:
     # --- THE FIX: Format input as a list of messages ---
-    messages = [
+    return [
         {
             "role": "system",
             "content": "You are an expert business analyst. Answer the user's question based *only* on the provided text context. If the context does not contain the answer, state that the information is not available."
@@ -31,19 +59,95 @@ def get_llm_answer(query: str, context_chunks: list[str]) -> str:
         }
     ]
 
+
+def stream_llm_answer(query: str, context_chunks: list, stats: GenerationStats = None,
+                      company_name: str = None):
+    """
+    Yields the answer in pieces as the model generates them. Pass a
+    `GenerationStats` to get time to first token and tokens/sec; they are
+    also printed once the answer is complete.
+
+    `context_chunks` (strings or `RetrievedChunk`s, best first) are packed
+    into the prompt by `context_builder.build_context` up to its token budget.
+
+    With `company_name`, answers go through the semantic answer cache: a
+    question close enough to an earlier one about the same company, with
+    the same retrieved context, gets the earlier answer in one piece.
+    """
+    stats = stats if stats is not None else GenerationStats()
+    count_tokens = get_token_counter(MODEL_URL)
+    with metrics.span("pack_context") as packing:
+        context = build_context(context_chunks, count_tokens)
+        packing.update(tokens=context.tokens, chunks=context.chunks_used)
+    messages = _build_messages(query, context.text)
+    stats.context_tokens = context.tokens
+    stats.context_chunks = context.chunks_used
+    stats.dropped_chunks = context.chunks_dropped
+    stats.prompt_tokens = sum(count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+    if company_name is not None:
+        collection_name = collection_name_for(company_name)
+        fingerprint = context_fingerprint([context.text])
+        query_embedding = embed_query(normalize_query(query))
+        cached = answer_cache.get(collection_name, fingerprint, query_embedding)
+        if cached is not None:
+            print(f"LLM answer served from the answer cache ({answer_cache.hit_rate:.0%} hit rate, "
+                  f"{answer_cache.seconds_saved:.1f}s of generation saved so far).")
+            yield cached
+            return
+
+    if client is None:
+        yield "### 🚨 Error\n**Could not initialize the Hugging Face Inference Client.**"
+        return
+
+    start = time.perf_counter()
+    pieces = []
     try:
         # --- THE FIX: Call the chat_completion method ---
-        response = client.chat_completion(
+        for chunk in client.chat_completion(
             model=MODEL_URL,
             messages=messages,
             max_tokens=512,
             temperature=0.7,
-        )
-        
-        # The response structure is slightly different for chat
-        return response.choices[0].message.content.strip()
+            stream=True,
+        ):
+            if not chunk.choices:
+                continue
+            piece = chunk.choices[0].delta.content
+            if not piece:
+                continue
+            if stats.time_to_first_token is None:
+                stats.time_to_first_token = time.perf_counter() - start
+            # Hosted models stream one token per chunk.
+            stats.tokens += 1
+            pieces.append(piece)
+            yield piece
+
+        # Only complete answers are cached, never errors or answers the caller stopped reading.
+        if company_name is not None and pieces:
+            answer_cache.put(collection_name, fingerprint, query_embedding, "".join(pieces),
+                             time.perf_counter() - start)
 
     except HfHubHTTPError as e:
-        return f"API Error: Could not connect to the model. Details: {e}"
+        yield f"API Error: Could not connect to the model. Details: {e}"
     except Exception as e:
-        return f"An unexpected error occurred: {e}"
\ No newline at end of file
+        yield f"An unexpected error occurred: {e}"
+    finally:
+        stats.duration = time.perf_counter() - start
+        metrics.record_span("generate", stats.duration, start=start, tokens=stats.tokens)
+        metrics.count("llm_tokens_total", stats.prompt_tokens, kind="prompt")
+        metrics.count("llm_tokens_total", stats.tokens, kind="completion")
+        if stats.time_to_first_token is not None:
+            metrics.observe("llm_time_to_first_token_seconds", stats.time_to_first_token)
+        if stats.tokens:
+            print(f"LLM answer: prompt {stats.prompt_tokens} tokens ({stats.context_chunks} chunks packed into "
+                  f"{context.passages} passages, {stats.dropped_chunks} over budget), "
+                  f"first token after {stats.time_to_first_token:.2f}s, "
+                  f"{stats.tokens} tokens in {stats.duration:.2f}s ({stats.tokens_per_second:.1f} tokens/s).")
+
+
+def get_llm_answer(query: str, context_chunks: list, company_name: str = None) -> str:
+    """
+    Returns the whole answer at once. Use `stream_llm_answer` to show it while it is generated.
+    """
+    return "".join(stream_llm_answer(query, context_chunks, company_name=company_name)).strip()
@@ -0,0 +1,411 @@
+# file: metrics.py
+"""
+Pipeline instrumentation: timing spans per stage, counters and histograms,
+exported as Prometheus text, plus optional JSON traces and profiles.
+
+    with metrics.span("embed", chunks=len(batch)):
+        ...
+    metrics.count("pages_total", status="fetched")
+
+Every span is also observed in the `ciagent_stage_seconds` histogram, so
+the Prometheus export shows where build and query time goes (fetch, parse,
+extract, chunk, embed, upsert, retrieve, generate, ...). Spans recorded
+inside `trace(...)` (or `Trace.activate()`) are also collected into a
+per-build or per-query trace, written as JSON to TRACE_DIR when it is set.
+Work handed to other threads joins the trace when the thread runs a
+function wrapped with `propagate`.
+
+Set METRICS_PORT to serve the Prometheus text over HTTP, and PROFILER to
+"cprofile" or "pyinstrument" to profile every build (see `profile`).
+"""
+import contextvars
+import cProfile
+import functools
+import json
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRIC_PREFIX = "ciagent_"
+# Write a JSON trace of every build and query into this directory (off when unset).
+TRACE_DIR = os.environ.get("TRACE_DIR")
+# Serve the Prometheus text at http://localhost:METRICS_PORT/metrics (off when unset).
+METRICS_PORT = os.environ.get("METRICS_PORT")
+# "cprofile" or "pyinstrument" profiles every build into PROFILE_DIR (off when unset).
+PROFILER = os.environ.get("PROFILER")
+PROFILE_DIR = "./profiles"
+
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+SIZE_BUCKETS = (1_000, 5_000, 10_000, 50_000, 100_000, 250_000, 500_000, 1_000_000, 5_000_000)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    "stage_seconds": ("histogram", "Time spent in each pipeline stage.", TIME_BUCKETS),
+    "pages_total": ("counter", "Pages requested by the crawler, by outcome.", None),
+    "fetched_bytes_total": ("counter", "Bytes of HTML downloaded.", None),
+    "page_bytes": ("histogram", "Size of downloaded pages in bytes.", SIZE_BUCKETS),
+    "chunks_total": ("counter", "Chunks cut from crawled pages, by outcome (embedded or duplicate).", None),
+    "builds_total": ("counter", "Knowledge-base builds, by outcome.", None),
+    "retrievals_total": ("counter", "Knowledge-base lookups, by retrieval mode and whether the cache answered.", None),
+    "llm_tokens_total": ("counter", "LLM tokens, by kind (prompt or completion).", None),
+    "llm_time_to_first_token_seconds": ("histogram", "Time until the LLM streamed its first token.", TIME_BUCKETS),
+}
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_server = None
+_server_lock = threading.Lock()
+# One profile at a time: profilers hook the interpreter, and concurrent builds would overlap.
+_profile_lock = threading.Lock()
+
+
+class MetricsRegistry:
+    """
+    Thread-safe store of counter values and histogram buckets, keyed by
+    metric name and label values.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def count(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = METRICS.get(name, (None, None, TIME_BUCKETS))[2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def snapshot(self) -> dict:
+        """
+        Current values as plain data: `{"counters": {...}, "histograms": {...}}`
+        keyed by `name{label="value",...}`.
+        """
+        with self._lock:
+            return {
+                "counters": {_series(name, labels): value for (name, labels), value in self._counters.items()},
+                "histograms": {
+                    _series(name, labels): {"sum": h["sum"], "count": h["count"]}
+                    for (name, labels), h in self._histograms.items()
+                },
+            }
+
+    def prometheus_text(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: {**h, "buckets": list(h["buckets"])} for key, h in self._histograms.items()}
+        lines = []
+        for name in sorted({name for name, _ in counters} | {name for name, _ in histograms}):
+            default_kind = "histogram" if any(series_name == name for series_name, _ in histograms) else "counter"
+            kind, help_text, buckets = METRICS.get(name, (default_kind, "", TIME_BUCKETS))
+            full_name = METRIC_PREFIX + name
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            for (series_name, labels), value in sorted(counters.items()):
+                if series_name == name:
+                    lines.append(f"{_series(full_name, labels)} {_format_value(value)}")
+            for (series_name, labels), histogram in sorted(histograms.items()):
+                if series_name != name:
+                    continue
+                for bound, cumulative in zip(buckets, histogram["buckets"]):
+                    lines.append(f"{_series(full_name + '_bucket', labels + (('le', _format_value(bound)),))} {cumulative}")
+                lines.append(f"{_series(full_name + '_bucket', labels + (('le', '+Inf'),))} {histogram['count']}")
+                lines.append(f"{_series(full_name + '_sum', labels)} {_format_value(histogram['sum'])}")
+                lines.append(f"{_series(full_name + '_count', labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _series(name: str, labels) -> str:
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels) + "}"
+
+
+registry = MetricsRegistry()
+
+
+def count(name: str, value: float = 1, **labels):
+    registry.count(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels):
+    registry.observe(name, value, **labels)
+
+
+def prometheus_text() -> str:
+    return registry.prometheus_text()
+
+
+class Trace:
+    """
+    The spans of one build or query. Spans recorded while the trace is
+    active (see `activate`) are added to it, from any thread that runs in
+    its context.
+    """
+
+    def __init__(self, name: str, **attributes):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.duration = None
+        self.spans = []
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, start: float, seconds: float, attributes: dict):
+        with self._lock:
+            self.spans.append({
+                "stage": stage,
+                "start": round(start - self._start, 6),
+                "seconds": round(seconds, 6),
+                "thread": threading.current_thread().name,
+                **attributes,
+            })
+
+    @contextmanager
+    def activate(self):
+        token = _current_trace.set(self)
+        try:
+            yield self
+        finally:
+            _current_trace.reset(token)
+
+    def wrap(self, iterator):
+        """
+        Iterates `iterator` with the trace active around each step, for
+        generators that the caller advances from different threads.
+        """
+        iterator = iter(iterator)
+        try:
+            while True:
+                with self.activate():
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                yield item
+        finally:
+            if hasattr(iterator, "close"):
+                with self.activate():
+                    iterator.close()
+
+    def summary(self) -> dict:
+        """
+        Total seconds and span count per stage.
+        """
+        stages = {}
+        with self._lock:
+            for span_record in self.spans:
+                stage = stages.setdefault(span_record["stage"], {"count": 0, "seconds": 0.0})
+                stage["count"] += 1
+                stage["seconds"] = round(stage["seconds"] + span_record["seconds"], 6)
+        return stages
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "id": self.id,
+            "name": self.name,
+            "attributes": self.attributes,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "stages": self.summary(),
+            "spans": spans,
+        }
+
+    def finish(self, trace_dir: str = None) -> str:
+        """
+        Ends the trace and, if `trace_dir` (default TRACE_DIR) is set, writes
+        it there as JSON. Returns the file's path, or None.
+        """
+        self.duration = round(time.perf_counter() - self._start, 6)
+        trace_dir = trace_dir or TRACE_DIR
+        if not trace_dir:
+            return None
+        os.makedirs(trace_dir, exist_ok=True)
+        path = os.path.join(trace_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{self.name}-{self.id}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=1, default=str)
+        return path
+
+
+def current_trace() -> Trace:
+    return _current_trace.get()
+
+
+@contextmanager
+def trace(name: str, **attributes):
+    """
+    Collects the spans recorded inside the block into a new `Trace`,
+    written to TRACE_DIR at the end.
+    """
+    new_trace = Trace(name, **attributes)
+    try:
+        with new_trace.activate():
+            yield new_trace
+    finally:
+        new_trace.finish()
+
+
+def record_span(stage: str, seconds: float, start: float = None, **attributes):
+    """
+    Records a stage timing measured elsewhere (e.g. in a worker process).
+    """
+    observe("stage_seconds", seconds, stage=stage)
+    active = _current_trace.get()
+    if active is not None:
+        active.add(stage, start if start is not None else time.perf_counter() - seconds, seconds, attributes)
+
+
+@contextmanager
+def span(stage: str, **attributes):
+    """
+    Times the block as one `stage` span. Yields the attribute dict, so the
+    block can add attributes it only learns along the way.
+    """
+    active = _current_trace.get()
+    start = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        seconds = time.perf_counter() - start
+        observe("stage_seconds", seconds, stage=stage)
+        if active is not None:
+            active.add(stage, start, seconds, attributes)
+
+
+def propagate(fn):
+    """
+    Wraps `fn` to run in a copy of the current context, so spans it records
+    on another thread land in the caller's trace.
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def run_in_context(*args, **kwargs):
+        return context.run(fn, *args, **kwargs)
+
+    return run_in_context
+
+
+@contextmanager
+def profile(name: str, profiler: str = None):
+    """
+    Profiles the block with `profiler` ("cprofile" or "pyinstrument",
+    default PROFILER) into PROFILE_DIR; does nothing when neither is set.
+    Only the calling thread is profiled, so work on the crawl and embedding
+    threads shows up as time spent waiting for them.
+    """
+    profiler = profiler or PROFILER
+    if not profiler:
+        yield None
+        return
+    if not _profile_lock.acquire(blocking=False):
+        print(f"Another build is being profiled; not profiling {name}.")
+        yield None
+        return
+    try:
+        with _profiled(name, profiler) as active_profiler:
+            yield active_profiler
+    finally:
+        _profile_lock.release()
+
+
+@contextmanager
+def _profiled(name: str, profiler: str):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stem = os.path.join(PROFILE_DIR, f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', name)}-{time.strftime('%Y%m%d-%H%M%S')}")
+
+    if profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("pyinstrument is not installed (pip install pyinstrument); profiling with cProfile instead.")
+        else:
+            sampler = Profiler()
+            sampler.start()
+            try:
+                yield sampler
+            finally:
+                sampler.stop()
+                with open(stem + ".html", "w", encoding="utf-8") as f:
+                    f.write(sampler.output_html())
+                print(f"Profile written to {stem}.html")
+            return
+
+    tracer = cProfile.Profile()
+    tracer.enable()
+    try:
+        yield tracer
+    finally:
+        tracer.disable()
+        tracer.dump_stats(stem + ".prof")
+        print(f"Profile written to {stem}.prof; slowest calls:")
+        pstats.Stats(tracer).sort_stats("cumulative").print_stats(15)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=None):
+    """
+    Serves the Prometheus text on `port` (default METRICS_PORT) from a
+    background thread. Does nothing without a port or when already running.
+    """
+    global _server
+    port = port or METRICS_PORT
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+            print(f"Serving metrics at http://localhost:{port}/metrics")
+        return _server
@@ -0,0 +1,231 @@
+# file: page_archive.py
+"""
+Raw-page crawl archive, so extraction and chunking experiments can be
+rerun without downloading the sites again.
+
+Fetched responses (URL, status, headers and body) are written as WARC
+response records, each gzip-compressed on its own and appended to segment
+files (`segment-*.warc.gz`, a new one every SEGMENT_BYTES), which standard
+WARC tools can read. A SQLite index maps every URL to its latest record:
+segment, offset and length. Replay memory-maps the segments and
+decompresses single records straight from the map, so reading a page
+costs no network and almost no I/O.
+
+    writer = ArchiveWriter("./crawl_archive")      # or crawl with archive_dir=...
+    writer.add(url, 200, "OK", headers, body, "utf-8")
+    page = PageArchive("./crawl_archive").get(url)  # or crawl with replay_dir=...
+"""
+import gzip
+import mmap
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+ARCHIVE_DIR = "./crawl_archive"
+INDEX_NAME = "index.sqlite"
+SEGMENT_BYTES = 64 * 2**20
+# Headers describing the transfer rather than the page: the body is stored decoded and whole.
+_TRANSFER_HEADERS = {"content-encoding", "transfer-encoding", "content-length", "connection", "keep-alive"}
+
+
+@dataclass
+class ArchivedPage:
+    url: str
+    status: int
+    headers: dict = field(default_factory=dict)  # lowercase names
+    body: bytes = b""
+    encoding: str = "utf-8"
+    fetched_at: float = 0.0
+    target_url: str = None  # the address the response came from, the base of its relative links
+
+
+def _open_index(directory: str, create: bool) -> sqlite3.Connection:
+    path = os.path.join(directory, INDEX_NAME)
+    if not create and not os.path.exists(path):
+        raise FileNotFoundError(f"No crawl archive at {directory}")
+    db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS records (
+            url TEXT PRIMARY KEY,
+            site TEXT NOT NULL,
+            segment TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            status INTEGER NOT NULL,
+            encoding TEXT,
+            fetched_at REAL NOT NULL
+        )
+        """
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS records_site ON records (site)")
+    db.commit()
+    return db
+
+
+def _warc_record(url: str, status: int, reason: str, headers, body: bytes, fetched_at: float) -> bytes:
+    http_head = f"HTTP/1.1 {status} {reason or ''}".rstrip() + "\r\n"
+    http_head += "".join(f"{name}: {value}\r\n" for name, value in headers if name.lower() not in _TRANSFER_HEADERS)
+    http_head += f"Content-Length: {len(body)}\r\n\r\n"
+    block = http_head.encode("utf-8", errors="replace") + body
+    warc_head = (
+        "WARC/1.1\r\n"
+        "WARC-Type: response\r\n"
+        f"WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>\r\n"
+        f"WARC-Date: {time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(fetched_at))}\r\n"
+        f"WARC-Target-URI: {url}\r\n"
+        "Content-Type: application/http; msgtype=response\r\n"
+        f"Content-Length: {len(block)}\r\n\r\n"
+    )
+    return warc_head.encode("utf-8") + block + b"\r\n\r\n"
+
+
+def _parse_warc_record(record: bytes) -> tuple:
+    """
+    Returns (target URI, status, headers, body) from one uncompressed WARC response record.
+    """
+    warc_head, _, rest = record.partition(b"\r\n\r\n")
+    warc_fields = {}
+    for line in warc_head.split(b"\r\n")[1:]:
+        name, _, value = line.decode("utf-8", errors="replace").partition(":")
+        warc_fields[name.strip().lower()] = value.strip()
+    length = int(warc_fields["content-length"])
+    http_head, _, body = rest[:length].partition(b"\r\n\r\n")
+    lines = http_head.decode("utf-8", errors="replace").split("\r\n")
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return warc_fields.get("warc-target-uri"), status, headers, body
+
+
+def forget_site(site: str, directory: str = ARCHIVE_DIR) -> int:
+    """
+    Drops a site's records from the archive index, so its pages are no
+    longer replayed. Their bytes stay in the segments, which other sites
+    share. Returns the number of records dropped.
+    """
+    if not os.path.exists(os.path.join(directory, INDEX_NAME)):
+        return 0
+    db = _open_index(directory, create=False)
+    try:
+        with db:
+            return db.execute("DELETE FROM records WHERE site = ?", (site,)).rowcount
+    finally:
+        db.close()
+
+
+class ArchiveWriter:
+    """
+    Appends responses to the archive in `directory`. Each writer has its
+    own segment files, so several crawls (threads or processes) can
+    archive into the same directory at once.
+    """
+
+    def __init__(self, directory: str = ARCHIVE_DIR, segment_bytes: int = SEGMENT_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.records = 0
+        self._lock = threading.Lock()
+        self._db = _open_index(directory, create=True)
+        self._name = f"segment-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self._sequence = 0
+        self._segment = None
+        self._segment_file = None
+
+    def _rotate(self):
+        if self._segment_file is not None:
+            self._segment_file.close()
+        self._segment = f"{self._name}-{self._sequence:04d}.warc.gz"
+        self._sequence += 1
+        self._segment_file = open(os.path.join(self.directory, self._segment), "ab")
+
+    def add(self, url: str, status: int, reason: str, headers, body: bytes, encoding: str = None,
+            target_url: str = None):
+        """
+        Archives one response under `url`. `headers` is a sequence of (name,
+        value) pairs; `encoding` is the charset the body was decoded with;
+        `target_url` is the address it was served from, if not `url`.
+        """
+        fetched_at = time.time()
+        record = _warc_record(target_url or url, status, reason, headers, body, fetched_at)
+        compressed = gzip.compress(record, compresslevel=6)
+        with self._lock:
+            if self._segment_file is None or self._segment_file.tell() + len(compressed) > self.segment_bytes:
+                self._rotate()
+            offset = self._segment_file.tell()
+            self._segment_file.write(compressed)
+            # The record must be on disk before the index points at it.
+            self._segment_file.flush()
+            with self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO records (url, site, segment, offset, length, status, encoding, fetched_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (url, urlsplit(url).netloc, self._segment, offset, len(compressed), status, encoding, fetched_at),
+                )
+            self.records += 1
+
+    def close(self):
+        with self._lock:
+            if self._segment_file is not None:
+                self._segment_file.close()
+                self._segment_file = None
+            self._db.close()
+
+
+class PageArchive:
+    """
+    Read access to an archive: the latest record of a URL, read from
+    memory-mapped segments.
+    """
+
+    def __init__(self, directory: str = ARCHIVE_DIR):
+        self.directory = directory
+        self._db = _open_index(directory, create=False)
+        self._maps = {}
+
+    def _map(self, segment: str, end: int):
+        mapped = self._maps.get(segment)
+        if mapped is None or len(mapped) < end:
+            # Segments still being written grow, so map them again when a record lies past the end.
+            if mapped is not None:
+                mapped.close()
+            with open(os.path.join(self.directory, segment), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = mapped
+        return mapped
+
+    def get(self, url: str) -> ArchivedPage:
+        """
+        The latest archived response for `url`, or None.
+        """
+        row = self._db.execute(
+            "SELECT segment, offset, length, encoding, fetched_at FROM records WHERE url = ?", (url,)
+        ).fetchone()
+        if row is None:
+            return None
+        segment, offset, length, encoding, fetched_at = row
+        record = gzip.decompress(self._map(segment, offset + length)[offset:offset + length])
+        target_url, status, headers, body = _parse_warc_record(record)
+        return ArchivedPage(url, status, headers, body, encoding or "utf-8", fetched_at, target_url)
+
+    def urls_for_site(self, site: str) -> list:
+        rows = self._db.execute("SELECT url FROM records WHERE site = ? ORDER BY fetched_at", (site,)).fetchall()
+        return [url for (url,) in rows]
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def close(self):
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps = {}
+        self._db.close()
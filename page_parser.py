@@ -0,0 +1,84 @@
+# file: page_parser.py
+"""
+Single-parse HTML pipeline. Each page is parsed once into an lxml tree and
+both link discovery and trafilatura's text extraction run on that tree.
+
+The page text keeps the structure trafilatura finds, one block per line:
+headings start with '#' marks for their level ("## Pricing"), list items
+with "- " and table rows with "| ", and every other line is a paragraph.
+chunking.py splits pages along these blocks.
+
+This module is deliberately light on imports because the crawler runs
+`parse_page` inside worker processes.
+"""
+import os
+import time
+from urllib.parse import urljoin
+
+import trafilatura
+from trafilatura.utils import load_html
+
+# Set EXTRACT_TABLES=1 to keep tables (as "| cell | cell |" rows) in the page text.
+EXTRACT_TABLES = os.environ.get("EXTRACT_TABLES", "0") == "1"
+
+
+def _inline_text(element) -> str:
+    return " ".join("".join(element.itertext()).split())
+
+
+def structured_text(body) -> str:
+    """
+    Renders the <body> of trafilatura's XML output as structured page text
+    (see the module docstring), or "" if it holds no text.
+    """
+    lines = []
+    for element in body:
+        if element.tag == "head":
+            rend = element.get("rend") or "h2"
+            level = int(rend[1]) if len(rend) == 2 and rend[1].isdigit() else 2
+            line = "#" * level + " " + _inline_text(element)
+        elif element.tag == "list":
+            lines.extend("- " + text for text in (_inline_text(item) for item in element.findall("item")) if text)
+            continue
+        elif element.tag == "table":
+            for row in element.iter("row"):
+                cells = [_inline_text(cell) for cell in row.findall("cell")]
+                if any(cells):
+                    lines.append("| " + " | ".join(cells) + " |")
+            continue
+        else:
+            line = _inline_text(element)
+        if line.strip("# "):
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def parse_page(html: str, page_url: str):
+    """
+    Parses `html` once and returns `(page_text, links, title)`: the clean
+    main text of the page (or None), its absolute, fragment-free links and
+    the contents of its <title>.
+    """
+    return parse_page_timed(html, page_url)[:3]
+
+
+def parse_page_timed(html: str, page_url: str):
+    """
+    Like `parse_page`, with a fourth item: the seconds spent parsing the
+    HTML (tree, title and links) and extracting the text, as
+    `{"parse": ..., "extract": ...}`.
+    """
+    start = time.perf_counter()
+    tree = load_html(html)
+    if tree is None:
+        return None, [], "", {"parse": time.perf_counter() - start, "extract": 0.0}
+
+    title = " ".join((tree.findtext('.//title') or "").split())
+
+    # Collect the links first: trafilatura prunes the tree while it extracts.
+    links = [urljoin(page_url, href.strip()).split('#')[0] for href in tree.xpath('//a/@href')]
+    parsed = time.perf_counter()
+
+    document = trafilatura.bare_extraction(tree, include_comments=False, include_tables=EXTRACT_TABLES)
+    page_text = structured_text(document["body"]) if document else None
+    return page_text or None, links, title, {"parse": parsed - start, "extract": time.perf_counter() - parsed}
@@ -1,41 +1,161 @@
 # file: qa_agent.py
-import chromadb
-from sentence_transformers import SentenceTransformer
+import os
+import re
 
-# Load the same embedding model we used to create the knowledge base
-print("QA Agent: Loading embedding model...")
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-print("QA Agent: Embedding model loaded.")
+import metrics
+from collection_registry import collection_name_for, get_collection, get_registry
+from context_builder import RetrievedChunk
+from embedding_service import get_bm25_index, get_reranker
+from query_cache import collection_version, embed_query, normalize_query, retrieval_cache
 
-# Connect to the same persistent ChromaDB client
-client = chromadb.PersistentClient(path="./chroma_db")
+# The same embedding model and persistent ChromaDB client as the knowledge base,
+# shared through embedding_service and loaded on first use.
+# Repeated questions are answered from the caches in query_cache.py (see `query_cache.cache_stats()`).
 
-def query_knowledge_base(company_name: str, query: str, n_results: int = 3):
+# Retrieval is hybrid by default: dense (MiniLM) and keyword (BM25) rankings are merged with
+# reciprocal rank fusion, so exact terms like product names and SKUs are found too.
+RETRIEVAL_MODE = "hybrid"  # or "dense" / "bm25"
+CANDIDATES_PER_RETRIEVER = 20
+RRF_K = 60
+# Optional cross-encoder pass over the best fused candidates (RERANK=1 to enable).
+RERANK = os.environ.get("RERANK", "0") == "1"
+RERANK_CANDIDATES = 10
+# Chunks handed to the context builder, which keeps as many as fit in the prompt's token budget.
+CONTEXT_CANDIDATES = 8
+
+_POSITION_SUFFIX = re.compile(r"_(\d+)$")
+
+
+def reciprocal_rank_fusion(rankings, k: int = RRF_K) -> list:
+    """
+    Merges ranked lists of ids: each id scores 1 / (k + rank) in every list it appears in.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def _bm25_index_for(collection):
+    # Knowledge bases built before the keyword index existed get it built from ChromaDB on first use.
+    index = get_bm25_index()
+    if index.count(collection.name) == 0 and collection.count() > 0:
+        existing = collection.get(include=["documents"])
+        index.add(collection.name, existing["ids"], existing["documents"])
+    return index
+
+
+def _to_retrieved_chunk(chunk_id: str, document: str, metadata) -> RetrievedChunk:
+    metadata = metadata or {}
+    position = metadata.get("chunk")
+    if position is None:
+        # Older knowledge bases only carry the position in the chunk id.
+        match = _POSITION_SUFFIX.search(chunk_id)
+        position = int(match.group(1)) if match else None
+    return RetrievedChunk(document, metadata.get("source"), position)
+
+
+def query_knowledge_base(company_name: str, query: str, n_results: int = 3, mode: str = None, rerank: bool = None):
     """
     Queries the knowledge base for a given company and question.
+    `mode` is 'hybrid' (default), 'dense' or 'bm25'; `rerank` defaults to the RERANK setting.
+    """
+    return [chunk.text for chunk in retrieve_chunks(company_name, query, n_results, mode, rerank)]
+
+
+def retrieve_chunks(company_name: str, query: str, n_results: int = CONTEXT_CANDIDATES, mode: str = None,
+                    rerank: bool = None) -> list:
     """
+    Like `query_knowledge_base`, but returns `RetrievedChunk`s with each chunk's
+    page and position, best first, for `context_builder.build_context`.
+    """
+    mode = mode or RETRIEVAL_MODE
+    rerank = RERANK if rerank is None else rerank
+    with metrics.span("retrieve", company=company_name, mode=mode, rerank=rerank):
+        return _retrieve_chunks(company_name, query, n_results, mode, rerank)
+
+
+def _is_retired_collection(error: Exception) -> bool:
+    # ChromaDB is imported on first use (see embedding_service), and so is its exception.
+    from chromadb.errors import InvalidCollectionException
+    return isinstance(error, InvalidCollectionException)
+
+
+def _retrieve_chunks(company_name: str, query: str, n_results: int, mode: str, rerank: bool) -> list:
     # 1. Sanitize company name to get the collection name
-    collection_name = company_name.lower().replace(" ", "_")
-    
+    collection_name = collection_name_for(company_name)
+
     try:
-        # 2. Get the collection from ChromaDB
-        collection = client.get_collection(name=collection_name)
-        
-        # 3. Create an embedding for the user's query
-        query_embedding = embedding_model.encode(query).tolist()
-        
-        # 4. Query the collection
-        results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=n_results
-        )
-        
-        # 5. Return the documents (the actual text chunks)
-        return results['documents'][0]
-        
+        # 2. Get the collection from ChromaDB. If a compaction swaps a fresh index in and deletes the
+        #    one we hold while we read it, look the collection up again and read the fresh one.
+        collection = get_collection(collection_name)
+        get_registry().record_query(collection_name)
+        try:
+            return _search_collection(collection, collection_name, query, n_results, mode, rerank)
+        except Exception as e:
+            if not _is_retired_collection(e):
+                raise
+            return _search_collection(get_collection(collection_name), collection_name, query, n_results, mode, rerank)
+
     except ValueError as e:
         print(f"Error: Collection '{collection_name}' not found. {e}")
-        return [f"Knowledge base for '{company_name}' not found. Please build it first."]
+        return [RetrievedChunk(f"Knowledge base for '{company_name}' not found. Please build it first.")]
+
+
+def _search_collection(collection, collection_name: str, query: str, n_results: int, mode: str, rerank: bool) -> list:
+    # 3. Serve repeated questions from the retrieval cache, as long as the collection hasn't changed
+    normalized_query = normalize_query(query)
+    retrieval_key = (collection_name, collection_version(collection), normalized_query, n_results, mode, rerank)
+    cached = retrieval_cache.get(retrieval_key)
+    metrics.count("retrievals_total", mode=mode, cached="true" if cached is not None else "false")
+    if cached is not None:
+        return list(cached)
+
+    # 4. Rank candidates with each retriever. Fusion and reranking need a deeper pool than n_results.
+    candidates = max(n_results, CANDIDATES_PER_RETRIEVER) if mode == "hybrid" or rerank else n_results
+    rankings, documents = [], {}
+    if mode in ("dense", "hybrid"):
+        with metrics.span("dense", candidates=candidates):
+            # Create an embedding for the user's query (or reuse the one from last time)
+            query_embedding = embed_query(normalized_query)
+            results = collection.query(
+                query_embeddings=[query_embedding],
+                n_results=candidates
+            )
+        rankings.append(results['ids'][0])
+        documents.update(
+            (chunk_id, _to_retrieved_chunk(chunk_id, document, metadata))
+            for chunk_id, document, metadata in zip(results['ids'][0], results['documents'][0], results['metadatas'][0])
+        )
+    if mode in ("bm25", "hybrid"):
+        with metrics.span("bm25", candidates=candidates):
+            matches = _bm25_index_for(collection).search(collection_name, normalized_query, candidates)
+        rankings.append([chunk_id for chunk_id, _ in matches])
+
+    # 5. Fuse the rankings and fetch the text of keyword-only matches
+    ranked = reciprocal_rank_fusion(rankings) if len(rankings) > 1 else rankings[0]
+    shortlist = ranked[:max(n_results, RERANK_CANDIDATES) if rerank else n_results]
+    missing = [chunk_id for chunk_id in shortlist if chunk_id not in documents]
+    if missing:
+        fetched = collection.get(ids=missing, include=["documents", "metadatas"])
+        documents.update(
+            (chunk_id, _to_retrieved_chunk(chunk_id, document, metadata))
+            for chunk_id, document, metadata in zip(fetched['ids'], fetched['documents'], fetched['metadatas'])
+        )
+    shortlist = [chunk_id for chunk_id in shortlist if chunk_id in documents]
+
+    # 6. Optionally let the cross-encoder reorder the shortlist
+    if rerank and len(shortlist) > 1:
+        with metrics.span("rerank", candidates=len(shortlist)):
+            scores = get_reranker().predict([(query, documents[chunk_id].text) for chunk_id in shortlist])
+        shortlist = [chunk_id for _, chunk_id in sorted(zip(scores, shortlist), key=lambda pair: -pair[0])]
+
+    # 7. Return the chunks with their text, page and position
+    result = [documents[chunk_id] for chunk_id in shortlist[:n_results]]
+    retrieval_cache.put(retrieval_key, tuple(result))
+    return result
+
 
 # Test function
 if __name__ == '__main__':
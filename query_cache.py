@@ -0,0 +1,255 @@
+# file: query_cache.py
+"""
+In-memory caches for the question path, so repeated and FAQ-style
+questions skip the embedding model, the vector search and the LLM:
+
+- `query_embedding_cache`: query embeddings, keyed by (embedding model, normalized query).
+- `retrieval_cache`: retrieved chunks, keyed by (collection, collection version,
+  normalized query, n_results).
+- `answer_cache`: LLM answers, reused for a new question when it is
+  semantically close to a cached one that retrieved exactly the same context.
+
+Every time the knowledge base modifies a collection it calls
+`mark_collection_changed`, which stores a new version in the collection's
+ChromaDB metadata. Retrieval keys include that version, so cached results
+go stale in every process that reads the collection, not just this one.
+Cached answers for the collection are dropped in this process; elsewhere
+they are only reused for questions that retrieve the very same chunks.
+"""
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+import embedding_service
+
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+RETRIEVAL_CACHE_SIZE = 512
+ANSWER_CACHE_SIZE = 1024
+ANSWER_CACHE_TTL = 6 * 60 * 60
+# Cosine similarity between two questions' embeddings above which they get the same answer.
+ANSWER_SIMILARITY_THRESHOLD = 0.92
+COLLECTION_VERSION_KEY = "version"
+
+
+def normalize_query(query: str) -> str:
+    # The embedding model is uncased and ignores runs of whitespace, so these variants embed identically.
+    return " ".join(query.lower().split())
+
+
+class LRUCache:
+    """
+    A thread-safe, size-bounded mapping that evicts the least recently used
+    entry and counts hits and misses. `get` returns None on a miss.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+        }
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, predicate):
+        """
+        Drops every entry whose key matches `predicate(key)`.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+@dataclass
+class _CachedAnswer:
+    key: tuple
+    query_embedding: np.ndarray
+    answer: str
+    created: float
+    generation_seconds: float
+
+
+class SemanticAnswerCache:
+    """
+    LLM answers grouped by (collection, context fingerprint). A question
+    gets a stored answer if it retrieved the same context and its embedding
+    is within `threshold` cosine similarity of the cached question's.
+    Entries expire after `ttl` seconds; beyond `max_entries` the least
+    recently used are evicted.
+    """
+
+    def __init__(self, threshold: float = ANSWER_SIMILARITY_THRESHOLD, ttl: float = ANSWER_CACHE_TTL,
+                 max_entries: int = ANSWER_CACHE_SIZE):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # Generation time of the answers that were served from the cache instead of the LLM.
+        self.seconds_saved = 0.0
+        self._entries = OrderedDict()
+        self._groups = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "seconds_saved": self.seconds_saved,
+        }
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        group = self._groups[entry.key]
+        group.remove(entry_id)
+        if not group:
+            del self._groups[entry.key]
+
+    def get(self, collection_name: str, fingerprint: str, query_embedding):
+        """
+        Returns the cached answer for the most similar question above the threshold, or None.
+        """
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        now = time.time()
+        with self._lock:
+            best_id, best_similarity = None, self.threshold
+            for entry_id in list(self._groups.get((collection_name, fingerprint), ())):
+                entry = self._entries[entry_id]
+                if now - entry.created > self.ttl:
+                    self._remove(entry_id)
+                    self.expirations += 1
+                    continue
+                # Embeddings are normalized, so the dot product is the cosine similarity.
+                similarity = float(np.dot(entry.query_embedding, query_embedding))
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            entry = self._entries[best_id]
+            self.hits += 1
+            self.seconds_saved += entry.generation_seconds
+            return entry.answer
+
+    def put(self, collection_name: str, fingerprint: str, query_embedding, answer: str,
+            generation_seconds: float = 0.0):
+        key = (collection_name, fingerprint)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _CachedAnswer(
+                key, np.asarray(query_embedding, dtype=np.float32), answer, time.time(), generation_seconds
+            )
+            self._groups.setdefault(key, []).append(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_collection(self, collection_name: str):
+        with self._lock:
+            for entry_id in [i for i, entry in self._entries.items() if entry.key[0] == collection_name]:
+                self._remove(entry_id)
+
+
+query_embedding_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE)
+retrieval_cache = LRUCache(RETRIEVAL_CACHE_SIZE)
+answer_cache = SemanticAnswerCache()
+
+
+def embed_query(normalized_query: str) -> list:
+    """
+    The embedding of a normalized query, from `query_embedding_cache` when possible.
+    """
+    key = (embedding_service.cache_key(), normalized_query)
+    query_embedding = query_embedding_cache.get(key)
+    if query_embedding is None:
+        query_embedding = embedding_service.encode(normalized_query).tolist()
+        query_embedding_cache.put(key, query_embedding)
+    return query_embedding
+
+
+def context_fingerprint(context_chunks) -> str:
+    return hashlib.sha1("\x00".join(context_chunks).encode("utf-8")).hexdigest()
+
+
+def collection_version(collection):
+    """
+    The version `mark_collection_changed` last stored on a ChromaDB collection, or None.
+    """
+    return (collection.metadata or {}).get(COLLECTION_VERSION_KEY)
+
+
+def mark_collection_changed(collection):
+    """
+    Gives the collection a new version and drops this process's cached
+    retrievals and answers for it. Call after every write to a collection.
+    """
+    collection.modify(metadata={**(collection.metadata or {}), COLLECTION_VERSION_KEY: uuid.uuid4().hex})
+    retrieval_cache.invalidate(lambda key: key[0] == collection.name)
+    answer_cache.invalidate_collection(collection.name)
+
+
+def cache_stats() -> dict:
+    return {
+        "query_embeddings": query_embedding_cache.stats(),
+        "retrievals": retrieval_cache.stats(),
+        "answers": answer_cache.stats(),
+    }
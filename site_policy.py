@@ -0,0 +1,244 @@
+# file: site_policy.py
+"""
+What a site tells crawlers about itself, fetched once per host and cached
+for POLICY_TTL seconds:
+
+1. robots.txt: the Allow/Disallow rules and Crawl-delay (or Request-rate)
+   that apply to ROBOTS_AGENT, following RFC 9309: a missing robots.txt
+   (any 4xx) allows everything, while a server error or an unreachable
+   robots.txt disallows the whole site for this crawl (and isn't cached);
+2. sitemaps: the ones robots.txt lists, or /sitemap.xml, followed through
+   sitemap indexes and gzip, with each page's <lastmod> and <priority>.
+
+The crawler only fetches pages the rules allow, slows down to the crawl
+delay, and queues sitemap pages by priority next to the links it finds.
+"""
+import asyncio
+import gzip
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from urllib.parse import urljoin, urlsplit
+from urllib.robotparser import RobotFileParser
+
+import aiohttp
+from lxml import etree
+
+import metrics
+from frontier import canonicalize_url
+
+# The product token robots.txt groups are matched against; sites without a group for it get the '*' rules.
+ROBOTS_AGENT = "ciagent"
+POLICY_TTL = 3600.0
+# Limits on sitemap reading: sitemap files fetched, pages taken from them and bytes per (unpacked) file.
+MAX_SITEMAPS = 10
+MAX_SITEMAP_URLS = 50_000
+MAX_SITEMAP_BYTES = 50 * 2**20
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+
+@dataclass
+class SitemapEntry:
+    lastmod: float = None  # Unix timestamp
+    priority: float = None
+    url: str = None  # as listed, which is the address to fetch
+
+
+@dataclass
+class SitePolicy:
+    origin: str
+    robots: RobotFileParser = None
+    disallow_all: bool = False
+    crawl_delay: float = None
+    sitemap: dict = field(default_factory=dict)  # canonical URL -> SitemapEntry
+    sitemaps_loaded: bool = False
+    fetched_at: float = 0.0
+
+    def allows(self, url: str) -> bool:
+        if self.disallow_all:
+            return False
+        return self.robots is None or self.robots.can_fetch(ROBOTS_AGENT, url)
+
+
+def parse_crawl_delay(lines: list):
+    """
+    The Crawl-delay of the robots.txt group for ROBOTS_AGENT, else of the
+    '*' group, in seconds. urllib.robotparser only reads whole seconds.
+    """
+    delays = {}
+    agents, in_rules = [], False
+    for line in lines:
+        line = line.split("#", 1)[0].strip()
+        if ":" not in line:
+            continue
+        key, value = (part.strip() for part in line.split(":", 1))
+        key = key.lower()
+        if key == "user-agent":
+            # Consecutive User-agent lines share one group.
+            if in_rules:
+                agents, in_rules = [], False
+            agents.append(value.lower())
+            continue
+        in_rules = True
+        if key == "crawl-delay":
+            try:
+                delay = float(value)
+            except ValueError:
+                continue
+            for agent in agents:
+                delays.setdefault(agent, delay)
+    return delays.get(ROBOTS_AGENT, delays.get("*"))
+
+
+def _parse_lastmod(value: str):
+    try:
+        parsed = datetime.fromisoformat(value.strip())
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _parse_priority(value: str):
+    try:
+        return min(max(float(value), 0.0), 1.0)
+    except ValueError:
+        return None
+
+
+def parse_sitemap(body: bytes) -> tuple:
+    """
+    Parses a sitemap or sitemap index (optionally gzipped). Returns
+    `(pages, sitemaps)`: [(url, SitemapEntry)] and the URLs of further sitemaps.
+    """
+    if body[:2] == b"\x1f\x8b":
+        try:
+            body = gzip.decompress(body)
+        except OSError:
+            return [], []
+    if len(body) > MAX_SITEMAP_BYTES:
+        body = body[:MAX_SITEMAP_BYTES]
+    parser = etree.XMLParser(recover=True, resolve_entities=False, no_network=True)
+    try:
+        root = etree.fromstring(body, parser=parser)
+    except etree.XMLSyntaxError:
+        return [], []
+    if root is None:
+        return [], []
+
+    pages, sitemaps = [], []
+    kind = etree.QName(root).localname
+    for item in root:
+        if not isinstance(item.tag, str):
+            continue
+        fields = {etree.QName(child).localname: (child.text or "").strip()
+                  for child in item if isinstance(child.tag, str)}
+        if not fields.get("loc"):
+            continue
+        if kind == "sitemapindex":
+            sitemaps.append(fields["loc"])
+        elif kind == "urlset":
+            entry = SitemapEntry(
+                _parse_lastmod(fields["lastmod"]) if fields.get("lastmod") else None,
+                _parse_priority(fields["priority"]) if fields.get("priority") else None,
+            )
+            pages.append((fields["loc"], entry))
+    return pages, sitemaps
+
+
+async def _fetch(session, url: str, acquire):
+    """
+    GETs `url` after taking a politeness token. Returns (status, body),
+    with status None if the server couldn't be reached.
+    """
+    await acquire()
+    try:
+        async with session.get(url) as response:
+            if response.status != 200:
+                return response.status, None
+            return response.status, await response.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Could not fetch {url}: {e}")
+        return None, None
+
+
+async def _load_robots(session, policy: SitePolicy, acquire) -> bool:
+    """
+    Fills in `policy` from robots.txt. Returns False if the result mustn't be cached.
+    """
+    with metrics.span("robots", origin=policy.origin) as robots_span:
+        status, body = await _fetch(session, policy.origin + "/robots.txt", acquire)
+        robots_span["status"] = status
+    if status is not None and 400 <= status < 500:
+        return True
+    if body is None:
+        print(f"robots.txt of {policy.origin} is unavailable ({status or 'unreachable'}); not crawling the site.")
+        policy.disallow_all = True
+        return False
+    lines = body.decode("utf-8", errors="replace").splitlines()
+    policy.robots = RobotFileParser(policy.origin + "/robots.txt")
+    policy.robots.parse(lines)
+    delays = [parse_crawl_delay(lines)]
+    rate = policy.robots.request_rate(ROBOTS_AGENT)
+    if rate is not None and rate.requests:
+        delays.append(rate.seconds / rate.requests)
+    delays = [float(delay) for delay in delays if delay]
+    policy.crawl_delay = max(delays) if delays else None
+    return True
+
+
+async def _load_sitemaps(session, policy: SitePolicy, acquire):
+    host = urlsplit(policy.origin).netloc
+    listed = policy.robots.site_maps() if policy.robots is not None else None
+    to_fetch = list(listed or [policy.origin + "/sitemap.xml"])
+    fetched = set()
+    with metrics.span("sitemap", origin=policy.origin) as sitemap_span:
+        while to_fetch and len(fetched) < MAX_SITEMAPS and len(policy.sitemap) < MAX_SITEMAP_URLS:
+            sitemap_url = urljoin(policy.origin + "/", to_fetch.pop(0))
+            if sitemap_url in fetched or not policy.allows(sitemap_url):
+                continue
+            fetched.add(sitemap_url)
+            _, body = await _fetch(session, sitemap_url, acquire)
+            if body is None:
+                continue
+            pages, sitemaps = parse_sitemap(body)
+            to_fetch.extend(sitemaps)
+            for url, entry in pages:
+                entry.url = urljoin(sitemap_url, url)
+                key = canonicalize_url(entry.url)
+                if urlsplit(key).netloc == host and len(policy.sitemap) < MAX_SITEMAP_URLS:
+                    policy.sitemap.setdefault(key, entry)
+        sitemap_span["sitemaps"] = len(fetched)
+        sitemap_span["pages"] = len(policy.sitemap)
+    policy.sitemaps_loaded = True
+
+
+async def get_site_policy(session, site_url: str, acquire, use_sitemaps: bool = True) -> SitePolicy:
+    """
+    Returns the robots rules (and, with `use_sitemaps`, the sitemap pages)
+    of `site_url`'s host, from the cache when they were fetched less than
+    POLICY_TTL seconds ago. `acquire` is awaited before every request, to
+    share the crawl's politeness limit.
+    """
+    parts = urlsplit(canonicalize_url(site_url))
+    origin = f"{parts.scheme}://{parts.netloc}"
+    with _policies_lock:
+        cached = _policies.get(origin)
+    if cached is not None and time.time() - cached.fetched_at < POLICY_TTL:
+        if cached.sitemaps_loaded or not use_sitemaps:
+            return cached
+
+    policy = SitePolicy(origin, fetched_at=time.time())
+    cacheable = await _load_robots(session, policy, acquire)
+    if use_sitemaps and not policy.disallow_all:
+        await _load_sitemaps(session, policy, acquire)
+    if cacheable:
+        with _policies_lock:
+            _policies[origin] = policy
+    print(f"Site policy for {origin}: crawl delay {policy.crawl_delay or 'none'}, "
+          f"{len(policy.sitemap)} pages in sitemaps.")
+    return policy
@@ -0,0 +1,27 @@
+# file: tests/test_bm25_index.py
+"""
+BM25 keyword search over one collection's chunks.
+"""
+from bm25_index import BM25Index
+
+
+def test_exact_terms_rank_first(tmp_path):
+    index = BM25Index(str(tmp_path / "bm25.sqlite"))
+    index.add("acme", ["pricing", "about", "sku"], [
+        "Our pricing starts at ten dollars a month.",
+        "Acme was founded to make widgets simple.",
+        "The WX-200 widget ships with a ten year warranty.",
+    ])
+
+    results = index.search("acme", "WX-200 warranty", n_results=2)
+
+    assert [chunk_id for chunk_id, _ in results] == ["sku"]
+
+
+def test_a_collection_without_terms_finds_nothing(tmp_path):
+    index = BM25Index(str(tmp_path / "bm25.sqlite"))
+    index.add("acme", ["empty", "stopwords"], ["", "What is it? It is what it is."])
+
+    results = index.search("acme", "what is acme")
+
+    assert results == []
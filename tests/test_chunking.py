@@ -0,0 +1,94 @@
+# file: tests/test_chunking.py
+"""
+Structure-aware chunking: the token bound, heading paths, and how sentences,
+lists and tables are split.
+"""
+from chunking import chunk_text
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+def sentence(n: int) -> str:
+    return f"Sentence {n} tells the reader something new about the product."
+
+
+def test_chunks_stay_within_the_token_bound():
+    page = "\n".join([
+        "# Guide",
+        " ".join(sentence(n) for n in range(40)),
+        "## Install",
+        " ".join(f"word{n}" for n in range(120)),
+        "- " + " ".join(sentence(n) for n in range(12)),
+    ])
+
+    chunks = chunk_text(page, count_words, max_tokens=50, min_tokens=10)
+
+    assert len(chunks) > 5
+    assert all(count_words(chunk.text) <= 50 for chunk in chunks)
+
+
+def test_a_long_paragraph_is_split_between_sentences():
+    paragraph = " ".join(sentence(n) for n in range(20))
+
+    chunks = chunk_text(paragraph, count_words, max_tokens=50, min_tokens=10)
+
+    assert len(chunks) > 1
+    assert all(chunk.text.startswith("Sentence ") and chunk.text.endswith(".") for chunk in chunks)
+    assert " ".join(chunk.text for chunk in chunks) == paragraph
+
+
+def test_headings_start_chunks_and_give_their_path():
+    page = "\n".join([
+        "# Pricing",
+        " ".join(sentence(n) for n in range(2)),
+        "## Enterprise",
+        " ".join(sentence(n) for n in range(2)),
+        "# Support",
+        sentence(0),
+    ])
+
+    chunks = chunk_text(page, count_words, max_tokens=100, min_tokens=10)
+
+    assert [chunk.heading_path for chunk in chunks] == ["Pricing", "Pricing > Enterprise", "Support"]
+    assert [chunk.text.splitlines()[0] for chunk in chunks] == ["Pricing", "Enterprise", "Support"]
+
+
+def test_a_short_section_stays_with_the_next_one():
+    page = "# Pricing\nFree for small teams.\n## Enterprise\n" + sentence(0)
+
+    chunks = chunk_text(page, count_words, max_tokens=100, min_tokens=10)
+
+    assert len(chunks) == 1
+    assert chunks[0].text.splitlines() == ["Pricing", "Free for small teams.", "Enterprise", sentence(0)]
+
+
+def test_a_heading_never_ends_a_chunk():
+    page = "\n".join([sentence(n) for n in range(3)] + ["# Next section"] + [sentence(n) for n in range(4)])
+
+    # The heading fits after three sentences, but the sentence under it doesn't.
+    chunks = chunk_text(page, count_words, max_tokens=42, min_tokens=50)
+
+    assert all(chunk.text.splitlines()[-1] != "Next section" for chunk in chunks)
+    assert any(chunk.text.startswith("Next section") for chunk in chunks)
+
+
+def test_lists_and_tables_split_between_items():
+    items = [f"- Item {n} is one of the features included in every plan." for n in range(12)]
+    rows = [f"| Plan {n} | {n * 10} users | {n} projects |" for n in range(12)]
+
+    chunks = chunk_text("\n".join(items + rows), count_words, max_tokens=40, min_tokens=10)
+
+    lines = [line for chunk in chunks for line in chunk.text.splitlines()]
+    assert len(chunks) > 2
+    assert lines == items + rows
+
+
+def test_a_long_list_item_keeps_its_marker_on_every_piece():
+    item = "- " + " ".join(sentence(n) for n in range(10))
+
+    chunks = chunk_text(item, count_words, max_tokens=30, min_tokens=10)
+
+    assert len(chunks) > 1
+    assert all(chunk.text.startswith("- ") and count_words(chunk.text) <= 30 for chunk in chunks)
@@ -0,0 +1,59 @@
+# file: tests/test_context_builder.py
+"""
+Packing retrieved chunks into the prompt: merging neighbours on a page,
+ranking order and the token budget.
+"""
+from context_builder import PASSAGE_SEPARATOR, RetrievedChunk, build_context
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+def test_adjacent_chunks_are_joined_a_line_apart():
+    chunks = [
+        RetrievedChunk("## Support\n- Priority email support", "https://acme.example/pricing", 3),
+        RetrievedChunk("the team answers within 4 hours.", "https://acme.example/pricing", 4),
+    ]
+
+    context = build_context(chunks, count_words)
+
+    assert context.text == "## Support\n- Priority email support\nthe team answers within 4 hours."
+    assert context.passages == 1 and context.chunks_used == 2
+
+
+def test_text_repeated_between_overlapping_chunks_is_dropped_once():
+    shared = "plans are billed monthly or yearly"
+    chunks = [
+        RetrievedChunk(f"All of our {shared}", "https://acme.example/pricing", 0),
+        RetrievedChunk(f"{shared} and can be cancelled at any time.", "https://acme.example/pricing", 1),
+    ]
+
+    context = build_context(chunks, count_words)
+
+    assert context.text == f"All of our {shared}\nand can be cancelled at any time."
+
+
+def test_passages_follow_their_best_ranked_chunk():
+    chunks = [
+        RetrievedChunk("Pricing starts at ten dollars.", "https://acme.example/pricing", 1),
+        RetrievedChunk("Founded in 2015 in Lisbon.", "https://acme.example/about", 0),
+        RetrievedChunk("There are three plans.", "https://acme.example/pricing", 0),
+    ]
+
+    context = build_context(chunks, count_words)
+
+    assert context.text.split(PASSAGE_SEPARATOR) == [
+        "There are three plans.\nPricing starts at ten dollars.",
+        "Founded in 2015 in Lisbon.",
+    ]
+
+
+def test_chunks_over_budget_are_skipped_but_shorter_ones_still_fit():
+    chunks = ["one two three four five", "six seven eight nine ten eleven twelve", "thirteen"]
+
+    context = build_context(chunks, count_words, budget=7)
+
+    assert context.text == "one two three four five" + PASSAGE_SEPARATOR + "thirteen"
+    assert context.tokens <= 7
+    assert (context.chunks_used, context.chunks_dropped) == (2, 1)
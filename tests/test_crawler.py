@@ -0,0 +1,163 @@
+# file: tests/test_crawler.py
+"""
+Incremental recrawls of a small local site: which known pages a crawl
+reports as deleted, and stopping a streamed crawl early.
+"""
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import crawler
+import site_policy
+from crawl_state import CrawlStateStore
+
+TEXT = " ".join(["Our company builds reliable software for teams around the world."] * 8)
+PAGES = {
+    "/": f'<p>{TEXT}</p><a href="/about">About</a> <a href="/pricing">Pricing</a>',
+    "/about": f"<h1>About us</h1><p>{TEXT}</p>",
+    "/pricing": f"<h1>Pricing</h1><p>{TEXT} Plans start at ten dollars.</p>",
+}
+
+
+class LocalSite:
+    """
+    Serves PAGES on 127.0.0.1. `statuses` maps a path to a status code to
+    answer with instead; `requests` lists the paths requested. With
+    `redirect_to` set to a host, requests for any other host are
+    redirected there.
+    """
+
+    def __init__(self):
+        self.pages = dict(PAGES)
+        self.statuses = {}
+        self.requests = []
+        self.redirect_to = None
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                site.requests.append(self.path)
+                host = f"{site.redirect_to}:{site.server.server_port}"
+                if site.redirect_to and self.headers.get("Host") != host:
+                    self.send_response(301)
+                    self.send_header("Location", f"http://{host}{self.path}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                status = site.statuses.get(self.path)
+                body = site.pages.get(self.path)
+                if status is None:
+                    status = 200 if body is not None else 404
+                if status != 200:
+                    self.send_response(status)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = f"<html><head><title>Example</title></head><body><article>{body}</article></body></html>"
+                body = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}{path}"
+
+
+@pytest.fixture
+def site():
+    local_site = LocalSite()
+    yield local_site
+    local_site.server.shutdown()
+    local_site.server.server_close()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # Parse on a thread rather than in worker processes.
+    monkeypatch.setattr(crawler, "PARSE_WORKERS", 0)
+    state_store = CrawlStateStore(str(tmp_path / "crawl_state.sqlite"))
+    yield state_store
+    state_store.close()
+
+
+def recrawl(site, store, full: bool = False) -> dict:
+    """
+    Crawls the site against `store`, saves the result like `CrawlDelta.commit`, and returns {url: kind}.
+    """
+    async def collect():
+        return [change async for change in crawler.iter_page_changes(site.url("/"), 20, full, store)]
+
+    # Fetch robots.txt again on every crawl.
+    site_policy._policies.clear()
+    changes = asyncio.run(collect())
+    store.save([change.state for change in changes if change.state is not None])
+    store.delete([change.url for change in changes if change.kind == 'deleted'])
+    return {change.url: change.kind for change in changes}
+
+
+def test_removed_page_is_deleted(site, store):
+    recrawl(site, store, full=True)
+    site.pages["/"] = f"<p>{TEXT}</p><a href=\"/about\">About</a>"
+    del site.pages["/pricing"]
+
+    changes = recrawl(site, store)
+
+    assert changes[site.url("/pricing")] == 'deleted'
+    assert store.urls_for_site(f"127.0.0.1:{site.server.server_port}") == {site.url("/"), site.url("/about")}
+
+
+def test_start_page_server_error_keeps_known_pages(site, store):
+    first = recrawl(site, store, full=True)
+    assert set(first.values()) == {'added'} and len(first) == 3
+    site.statuses["/"] = 503
+
+    changes = recrawl(site, store)
+
+    assert 'deleted' not in changes.values()
+    assert len(store.urls_for_site(f"127.0.0.1:{site.server.server_port}")) == 3
+
+
+def test_unavailable_robots_txt_keeps_known_pages(site, store):
+    recrawl(site, store, full=True)
+    site.statuses["/robots.txt"] = 503
+
+    changes = recrawl(site, store)
+
+    assert changes == {}
+    assert len(store.urls_for_site(f"127.0.0.1:{site.server.server_port}")) == 3
+
+
+def test_crawl_follows_the_start_page_to_another_host(site, store):
+    site.redirect_to = "localhost"
+
+    changes = recrawl(site, store, full=True)
+
+    port = site.server.server_port
+    assert {f"http://localhost:{port}/about", f"http://localhost:{port}/pricing"} <= set(changes)
+
+
+def test_closing_a_streamed_crawl_stops_it(site, store, tmp_path):
+    site.pages["/"] = f"<p>{TEXT}</p>" + "".join(f'<a href="/page/{i}">Page {i}</a>' for i in range(40))
+    site.pages.update({f"/page/{i}": f"<h1>Page {i}</h1><p>{TEXT}</p>" for i in range(40)})
+    site_policy._policies.clear()
+    delta = crawler.stream_website_changes(site.url("/"), max_pages=41, state_path=str(tmp_path / "state.sqlite"))
+
+    first = next(iter(delta))
+    delta.close()
+    fetched = len(site.requests)
+    time.sleep(1.0)
+
+    assert len(site.requests) == fetched < 41
+    # Afterwards the delta only replays what it recorded.
+    assert [change.url for change in delta] == [first.url]
@@ -0,0 +1,79 @@
+# file: tests/test_dedup.py
+"""
+Exact and near-duplicate chunk elimination, and the URLs kept for each chunk.
+"""
+from dedup import ChunkDeduplicator
+
+FOOTER = ("Acme Corp builds reliable widgets for teams of every size. Contact our sales team for a quote, "
+          "read the documentation to get started, or visit the community forum to ask questions and share "
+          "what you have built with other customers around the world.")
+# The same footer with one more word: nearly all of its word shingles are shared.
+EDITED = FOOTER + " Thanks!"
+
+
+def test_exact_duplicates_ignore_case_and_whitespace():
+    dedup = ChunkDeduplicator()
+
+    first = dedup.add("a", FOOTER, url="https://acme.com/")
+    second = dedup.add("b", "  " + FOOTER.upper().replace(" ", "\n  "), url="https://acme.com/pricing")
+
+    assert first is None
+    assert second == "a"
+    assert (dedup.total, dedup.exact_duplicates, dedup.near_duplicates, dedup.kept) == (2, 1, 0, 1)
+
+
+def test_a_near_duplicate_is_dropped():
+    dedup = ChunkDeduplicator()
+
+    dedup.add("a", FOOTER)
+    duplicate_of = dedup.add("b", EDITED)
+
+    assert duplicate_of == "a"
+    assert (dedup.exact_duplicates, dedup.near_duplicates, dedup.kept) == (0, 1, 1)
+
+
+def test_different_chunks_are_both_kept():
+    dedup = ChunkDeduplicator()
+    # Only the first half of the text is shared, well under the threshold.
+    different = FOOTER[:len(FOOTER) // 2] + " Our offices are closed on public holidays and weekends."
+
+    dedup.add("a", FOOTER)
+    duplicate_of = dedup.add("b", different)
+
+    assert duplicate_of is None
+    assert dedup.kept == 2
+
+
+def test_a_near_duplicate_below_a_stricter_threshold_is_kept():
+    dedup = ChunkDeduplicator(threshold=0.99)
+
+    dedup.add("a", FOOTER)
+    duplicate_of = dedup.add("b", EDITED)
+
+    assert duplicate_of is None
+    assert dedup.kept == 2
+
+
+def test_without_a_threshold_only_exact_duplicates_are_dropped():
+    dedup = ChunkDeduplicator(threshold=None)
+
+    dedup.add("a", FOOTER)
+    near = dedup.add("b", EDITED)
+    exact = dedup.add("c", FOOTER.lower())
+
+    assert near is None
+    assert exact == "a"
+    assert (dedup.exact_duplicates, dedup.near_duplicates, dedup.kept) == (1, 0, 2)
+
+
+def test_duplicates_add_their_url_to_the_kept_chunk_once():
+    dedup = ChunkDeduplicator()
+
+    dedup.add("a", FOOTER, url="https://acme.com/")
+    dedup.add("b", FOOTER, url="https://acme.com/pricing")
+    dedup.add("c", EDITED, url="https://acme.com/about")
+    dedup.add("d", FOOTER, url="https://acme.com/pricing")
+    dedup.add("e", FOOTER)
+
+    assert dedup.sources == {"a": ["https://acme.com/", "https://acme.com/pricing", "https://acme.com/about"]}
+    assert dedup.report() == "Deduplication: 5 chunks -> 1 kept (3 exact and 1 near duplicates removed, -80%)."
@@ -0,0 +1,54 @@
+# file: tests/test_frontier.py
+"""
+URL canonicalization and the frontier's de-duplication and ordering.
+"""
+import pytest
+
+from frontier import DiskFrontier, Frontier, canonicalize_url
+
+
+@pytest.mark.parametrize("url, canonical", [
+    ("HTTPS://Example.COM/About", "https://example.com/About"),
+    ("https://example.com:443/pricing", "https://example.com/pricing"),
+    ("http://example.com:80/", "http://example.com/"),
+    ("http://example.com:8080/", "http://example.com:8080/"),
+    ("https://example.com/docs/", "https://example.com/docs"),
+    ("https://example.com", "https://example.com/"),
+    ("https://example.com/pricing#plans", "https://example.com/pricing"),
+    ("https://example.com/?utm_source=x&b=2&gclid=y&a=1", "https://example.com/?a=1&b=2"),
+    ("  https://example.com/about  ", "https://example.com/about"),
+])
+def test_canonicalize_url(url, canonical):
+    assert canonicalize_url(url) == canonical
+
+
+@pytest.mark.parametrize("make_frontier", [Frontier, DiskFrontier])
+def test_variants_of_a_url_are_queued_once_as_found(make_frontier):
+    frontier = make_frontier()
+    try:
+        assert frontier.push("https://example.com/docs/#intro")
+        assert not frontier.push("https://EXAMPLE.com/docs?utm_campaign=launch")
+        assert "https://example.com/docs" in frontier
+
+        # The queue keeps the address as found (without its fragment), since that is what gets fetched.
+        assert len(frontier) == 1
+        assert frontier.pop() == "https://example.com/docs/"
+    finally:
+        frontier.close()
+
+
+@pytest.mark.parametrize("make_frontier", [Frontier, DiskFrontier])
+def test_pages_pop_best_first_then_in_order_found(make_frontier):
+    frontier = make_frontier()
+    try:
+        frontier.push("https://example.com/a", 0.0)
+        frontier.push("https://example.com/b", 1.0)
+        frontier.push("https://example.com/c", 0.0)
+
+        assert [frontier.pop() for _ in range(3)] == [
+            "https://example.com/b", "https://example.com/a", "https://example.com/c",
+        ]
+        with pytest.raises(IndexError):
+            frontier.pop()
+    finally:
+        frontier.close()
@@ -0,0 +1,90 @@
+# file: tests/test_llm_handler.py
+"""
+Streamed answers from a local stand-in for the chat-completion API
+(benchmarks/fake_llm_server.py): what reaches the caller, when, and what
+ends up in the answer cache.
+"""
+import time
+
+import pytest
+from huggingface_hub import InferenceClient
+
+import llm_handler
+from context_builder import _approximate_token_count
+from fake_llm_server import FakeLLMServer
+from query_cache import answer_cache
+
+TOKENS = 12
+TOKEN_LATENCY = 0.05
+QUESTION = "What does the company sell?"
+CONTEXT = ["The company sells reliable project planning software to small teams."]
+
+
+@pytest.fixture
+def use_server(monkeypatch):
+    """
+    Points llm_handler at a FakeLLMServer started with the given options; no tokenizer or embedding model is loaded.
+    """
+    servers = []
+
+    def start(**options):
+        server = FakeLLMServer(**{"tokens": TOKENS, "first_token_latency": 0.05, "token_latency": TOKEN_LATENCY,
+                                  **options}).__enter__()
+        servers.append(server)
+        monkeypatch.setattr(llm_handler, "client", InferenceClient(base_url=server.base_url, api_key="unused"))
+        monkeypatch.setattr(llm_handler, "get_token_counter", lambda model_name: _approximate_token_count)
+        monkeypatch.setattr(llm_handler, "embed_query", lambda normalized_query: [1.0, 0.0, 0.0])
+        return server
+
+    yield start
+    for server in servers:
+        server.__exit__(None, None, None)
+    answer_cache.invalidate_collection("acme")
+
+
+def test_stream_yields_pieces_as_they_are_generated(use_server):
+    use_server()
+    stats = llm_handler.GenerationStats()
+    start = time.perf_counter()
+    arrivals = []
+    for piece in llm_handler.stream_llm_answer(QUESTION, CONTEXT, stats):
+        arrivals.append((time.perf_counter() - start, piece))
+
+    assert len(arrivals) == TOKENS
+    # The first piece arrives long before the last one is generated.
+    assert arrivals[-1][0] - arrivals[0][0] >= (TOKENS - 1) * TOKEN_LATENCY * 0.8
+    assert stats.tokens == TOKENS
+    assert stats.time_to_first_token is not None
+    assert 0 < stats.time_to_first_token <= arrivals[0][0]
+    assert stats.duration >= stats.time_to_first_token
+    assert stats.prompt_tokens > 0 and stats.context_chunks == 1
+
+
+def test_streamed_answer_matches_blocking_answer(use_server):
+    use_server(token_latency=0.0)
+    streamed = "".join(llm_handler.stream_llm_answer(QUESTION, CONTEXT)).strip()
+    assert streamed
+    assert streamed == llm_handler.get_llm_answer(QUESTION, CONTEXT)
+
+
+def test_complete_answer_is_cached(use_server):
+    server = use_server(token_latency=0.0)
+    first = llm_handler.get_llm_answer(QUESTION, CONTEXT, company_name="Acme")
+    second = llm_handler.get_llm_answer(QUESTION, CONTEXT, company_name="Acme")
+    assert second == first
+    assert server.requests == 1
+
+
+def test_server_error_is_reported_and_not_cached(use_server):
+    server = use_server(error_status=500)
+    entries = answer_cache.stats()["entries"]
+    stats = llm_handler.GenerationStats()
+    answer = "".join(llm_handler.stream_llm_answer(QUESTION, CONTEXT, stats, company_name="Acme"))
+
+    assert answer.startswith("API Error") and "500" in answer
+    assert stats.tokens == 0
+    assert answer_cache.stats()["entries"] == entries
+    # The next question goes to the model again rather than getting the error back.
+    requests = server.requests
+    "".join(llm_handler.stream_llm_answer(QUESTION, CONTEXT, company_name="Acme"))
+    assert server.requests > requests